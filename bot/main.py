@@ -111,6 +111,9 @@ async def add_client_finish(m: Message, state: FSMContext):
             )
             s.execute(stmt)
             s.commit()
+        # group_chat_id мог измениться: сбрасываем кэш валидации отчетов клиента
+        from tasks.refactored_reports import invalidate_report_validation
+        invalidate_report_validation(data["client_id"])
     import concurrent.futures
     loop = asyncio.get_running_loop()
     await loop.run_in_executor(None, sync_insert)
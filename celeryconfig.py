@@ -19,6 +19,17 @@ task_acks_late = True
 worker_disable_rate_limits = True
 worker_max_tasks_per_child = 1000
 
+# Маршрутизация задач: генерация Excel (xlsxwriter) нагружает CPU, поэтому
+# выполняется отдельным воркером на очереди reports_cpu и не блокирует
+# процессы, занятые заказами парсера и проверкой отчетов.
+# Ежедневные отчеты по клиентам ждут БД и Telegram (I/O), поэтому идут
+# в очередь summaries к воркеру с большим concurrency
+task_routes = {
+    'tasks.app_v2.send_excel_report_v2': {'queue': 'reports_cpu'},
+    'tasks.refactored_reports.generate_report_for_marketplace': {'queue': 'reports_cpu'},
+    'tasks.app_v2.send_daily_summary_v2': {'queue': 'summaries'},
+}
+
 # Настройки результатов
 result_expires = 3600  # 1 час
 result_persistent = True
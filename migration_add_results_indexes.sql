@@ -0,0 +1,68 @@
+-- Миграция для индексов таблицы results
+-- Выполнить: docker-compose exec db psql -U pricebot -d pricebot -f /app/migration_add_results_indexes.sql
+
+-- UPDATE results SET showcase_price = ... WHERE client_id = ... AND task_id = ... AND product_code = ...
+-- должен идти по индексу. Ограничение uq_result (client_id, task_id, product_code) уже создает
+-- такой индекс, поэтому отдельный индекс создаем только если в БД его нет (например, таблица
+-- была создана до появления ограничения). Дубликат индекса лишь замедлил бы запись.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1
+        FROM pg_index i
+        JOIN pg_class t ON t.oid = i.indrelid
+        WHERE t.relname = 'results'
+          AND (
+              SELECT array_agg(a.attname ORDER BY k.ord)
+              FROM unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+              JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+          ) = ARRAY['client_id', 'task_id', 'product_code']::name[]
+    ) THEN
+        CREATE INDEX idx_results_client_task_code ON results(client_id, task_id, product_code);
+    END IF;
+END $$;
+
+-- Отчеты (fetch_report_results) выбирают последнюю запись по каждому товару клиента:
+-- WHERE client_id = ... ORDER BY product_code, timestamp DESC. Покрывающий индекс отдает
+-- строки уже в нужном порядке и содержит все выбираемые столбцы (Index Only Scan).
+-- CONCURRENTLY не блокирует запись в results, но не может выполняться внутри транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_results_client_code_ts
+    ON results (client_id, product_code, timestamp DESC)
+    INCLUDE (product_name, product_link, market_price, showcase_price, account_id);
+
+-- DISTINCT ON (product_code) ... ORDER BY product_code, timestamp DESC в запросах ежедневной
+-- сводки (fetch_summary_stats) обслуживается тем же индексом:
+-- строки уже идут в порядке (product_code, timestamp DESC), и Unique берет первую строку
+-- группы без отдельной сортировки. Переписывать на ROW_NUMBER() не нужно - оконной функции
+-- нужен тот же порядок, но она нумерует все строки группы, а не останавливается на первой.
+
+-- Отчеты и сводка соединяют results с accounts и фильтруют по accounts.market.
+-- Ограничение uq_account (client_id, market, account_id) уже дает индекс с ведущими
+-- client_id, market, поэтому отдельный accounts(client_id, market) создаем только если
+-- в БД его нет (таблица создана до появления ограничения). Соединение по accounts.id
+-- обслуживает первичный ключ.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1
+        FROM pg_index i
+        JOIN pg_class t ON t.oid = i.indrelid
+        WHERE t.relname = 'accounts'
+          AND (
+              SELECT array_agg(a.attname ORDER BY k.ord)
+              FROM unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+              JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+              WHERE k.ord <= 2
+          ) = ARRAY['client_id', 'market']::name[]
+    ) THEN
+        CREATE INDEX idx_accounts_client_market ON accounts(client_id, market);
+    END IF;
+END $$;
+
+-- Материализованное представление срезов отчета (client_id, date, marketplace) не создаем.
+-- Цены в results обновляются асинхронно, по мере готовности отчетов парсера (report_checker,
+-- каждые 3 минуты), поэтому представление, обновляемое по расписанию, отдавало бы
+-- неполные срезы. Обновление после каждого отчета (REFRESH ... CONCURRENTLY) пересчитывало бы
+-- срезы всех клиентов за все даты. Повторные отчеты за ту же дату вместо этого читаются из
+-- кэша Redis (tasks.refactored_reports.load_report_results). Ключ кэша включает
+-- max(orders.updated_at) клиента и меняется при любом изменении его результатов.
@@ -4,19 +4,138 @@
 Разбит на отдельные функции согласно принципу Single Responsibility.
 """
 
-import os
+import html
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import pytz
 import redis
-import requests
 from datetime import datetime, timedelta, date
-from typing import List, Dict, Optional, Tuple, Any
+from typing import List, Dict, Optional, Set, Tuple, Any
 from dataclasses import dataclass
 from celery.utils.log import get_task_logger
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
+
+from db.models import Client
+from db.session import get_sync_session
+from services.telegram_notifier import BOT_TOKEN, telegram_http_session
 
 logger = get_task_logger(__name__)
 MSK_TZ = pytz.timezone('Europe/Moscow')
 
+# Маркетплейсы, по которым отправляется ежедневный отчет
+SUMMARY_MARKETPLACES = ('ozon', 'wb')
+
+# Отображаемое название и эмодзи маркетплейса в сообщении сводки
+MARKETPLACE_DISPLAY_INFO = {"ozon": ("Ozon", "🟠"), "wb": ("Wildberries", "🟣")}
+
+# Текст кнопки Excel-отчета зависит только от маркетплейса
+EXCEL_BUTTON_TEXTS = {
+    marketplace: f"📥 Подробный отчет {name} (EXCEL)"
+    for marketplace, (name, _) in MARKETPLACE_DISPLAY_INFO.items()
+}
+
+# Разметка сообщения сводки: собирается одним format() вместо цепочки конкатенаций
+SUMMARY_MESSAGE_TEMPLATE = (
+    "{emoji} <b>Отчет СПП мониторинга - {marketplace}</b>\n\n"
+    "<b>Клиент:</b> {client_name} (ID: {client_id})\n"
+    "<b>Дата:</b> {today}\n"
+    "<b>Текущий срез:</b> {today_slice} МСК\n"
+    "<b>Сравнение с:</b> {previous_slice}\n\n"
+    "📈 <b>Статистика:</b>\n"
+    "• Всего отслеживается: {total_tracked}\n"
+    "• СПП выросла (скидка увеличилась): {increased}\n"
+    "• СПП снизилась (скидка уменьшилась): {decreased}\n"
+    "• СПП без изменений: {unchanged}\n"
+    "• Новые товары: {new_products}\n\n"
+)
+render_summary_message = SUMMARY_MESSAGE_TEMPLATE.format
+
+# Время жизни отметки об отправке отчета
+SUMMARY_SENT_TTL = 86400  # 24 часа
+
+# Общий пул соединений Redis: задачи воркера переиспользуют открытые соединения
+# вместо нового TCP-подключения на каждый вызов
+REDIS_POOL = redis.ConnectionPool(host='redis', port=6379, db=0, max_connections=32)
+
+# Параллельные отправки сводок разным клиентам; сообщения одному чату уходят по порядку.
+# Не больше пула соединений telegram_http_session (TELEGRAM_POOL_MAXSIZE)
+SUMMARY_SEND_WORKERS = 8
+
+# Тело запросов к Bot API сериализуется orjson, заголовок ставим сами
+TELEGRAM_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Скидка в SQL считается так же, как в calculate_discount_percent
+SUMMARY_DISCOUNT_SQL = (
+    "CASE WHEN {p}.market_price > 0 AND {p}.showcase_price <> 0 "
+    "THEN round(({p}.market_price - {p}.showcase_price) / {p}.market_price, 2) ELSE 0 END"
+)
+
+# Статистика сегодняшнего среза против предыдущего для каждой пары (client_id, market).
+# Срезы строятся по (client_id, market, product_code), а сравнение и подсчет
+# идут агрегатами в Postgres - в Python возвращается одна строка на пару.
+SUMMARY_STATS_QUERY = text(f"""
+    WITH scoped AS (
+        SELECT r.client_id, r.product_code,
+            r.market_price, r.showcase_price, r.timestamp,
+            a.market
+        FROM results r
+        JOIN accounts a ON r.account_id = a.id
+        WHERE r.client_id IN :client_ids
+            AND a.market IN :marketplaces
+            AND r.timestamp < :today_end
+    ),
+    today_rows AS (
+        SELECT DISTINCT ON (client_id, market, product_code) *
+        FROM scoped
+        WHERE timestamp >= :today_start
+        ORDER BY client_id, market, product_code, timestamp DESC
+    ),
+    today_slices AS (
+        SELECT client_id, market, max(timestamp) AS slice_ts
+        FROM today_rows
+        GROUP BY client_id, market
+    ),
+    previous_rows AS (
+        SELECT DISTINCT ON (s.client_id, s.market, s.product_code) s.*
+        FROM scoped s
+        JOIN today_slices t ON t.client_id = s.client_id AND t.market = s.market
+        WHERE s.timestamp < t.slice_ts
+        ORDER BY s.client_id, s.market, s.product_code, s.timestamp DESC
+    ),
+    previous_slices AS (
+        SELECT client_id, market, max(timestamp) AS slice_ts
+        FROM previous_rows
+        GROUP BY client_id, market
+    ),
+    compared AS (
+        SELECT cur.client_id, cur.market,
+            {SUMMARY_DISCOUNT_SQL.format(p="cur")} AS today_discount,
+            {SUMMARY_DISCOUNT_SQL.format(p="prev")} AS previous_discount,
+            prev.product_code IS NOT NULL AS has_previous
+        FROM today_rows cur
+        LEFT JOIN previous_rows prev
+            ON prev.client_id = cur.client_id
+            AND prev.market = cur.market
+            AND prev.product_code = cur.product_code
+    )
+    SELECT c.client_id, c.market,
+        t.slice_ts AS today_timestamp,
+        p.slice_ts AS previous_timestamp,
+        count(*) AS total_tracked,
+        count(*) FILTER (WHERE has_previous AND today_discount > previous_discount) AS increased,
+        count(*) FILTER (WHERE has_previous AND today_discount < previous_discount) AS decreased,
+        count(*) FILTER (WHERE has_previous AND today_discount = previous_discount) AS unchanged,
+        count(*) FILTER (WHERE NOT has_previous) AS new_products
+    FROM compared c
+    JOIN today_slices t ON t.client_id = c.client_id AND t.market = c.market
+    LEFT JOIN previous_slices p ON p.client_id = c.client_id AND p.market = c.market
+    GROUP BY c.client_id, c.market, t.slice_ts, p.slice_ts
+""").bindparams(
+    bindparam("client_ids", expanding=True),
+    bindparam("marketplaces", expanding=True)
+)
+
 
 @dataclass
 class MarketplaceStats:
@@ -33,8 +152,6 @@ class SummaryData:
     """Данные для генерации отчета."""
     client: Any
     marketplace: str
-    today_results: List[Any]
-    previous_results: List[Any]
     today_timestamp: datetime
     previous_timestamp: Optional[datetime]
     stats: MarketplaceStats
@@ -42,16 +159,12 @@ class SummaryData:
 
 def get_redis_client() -> redis.Redis:
     """
-    Создает подключение к Redis.
+    Возвращает Redis клиент на общем пуле соединений модуля.
     
     Returns:
         Redis клиент
     """
-    try:
-        return redis.Redis(host='redis', port=6379, db=0)
-    except Exception as e:
-        logger.error(f"Ошибка подключения к Redis: {e}")
-        raise
+    return redis.Redis(connection_pool=REDIS_POOL)
 
 
 def safe_error_message(text: Any) -> str:
@@ -66,220 +179,139 @@ def safe_error_message(text: Any) -> str:
     """
     if text is None:
         return ""
-    text_str = str(text)
-    return text_str.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return html.escape(str(text), quote=False)
 
 
 def get_clients_for_summary(session, client_id: Optional[str]) -> List[Any]:
     """
     Получает список клиентов для отправки отчетов.
     
+    Клиенты без group_chat_id отсекаются в запросе: отправлять им некуда.
+    
     Args:
         session: Сессия БД
         client_id: ID конкретного клиента или None для всех
         
     Returns:
-        Список клиентов
+        Список клиентов с group_chat_id
     """
-    try:
-        from db.models import Client
-        
-        if client_id:
-            clients = session.query(Client).filter(Client.id == client_id).all()
-        else:
-            clients = session.query(Client).all()
-        
-        return clients
-        
-    except Exception as e:
-        logger.error(f"Ошибка получения клиентов: {e}")
-        return []
+    has_chat = Client.group_chat_id.isnot(None)
+    
+    if client_id:
+        return session.query(Client).filter(Client.id == client_id, has_chat).all()
+    return session.query(Client).filter(has_chat).all()
 
 
-def is_summary_already_sent(redis_client: redis.Redis, client_id: str, date_str: str) -> bool:
+def get_clients_for_summary_bulk(session, client_ids: List[str]) -> List[Any]:
     """
-    Проверяет, был ли уже отправлен отчет для клиента на указанную дату.
+    Получает клиентов для отправки отчетов одним запросом по списку ID.
     
     Args:
-        redis_client: Redis клиент
-        client_id: ID клиента
-        date_str: Дата в формате YYYY-MM-DD
+        session: Сессия БД
+        client_ids: ID клиентов
         
     Returns:
-        True если отчет уже отправлялся
+        Список клиентов с group_chat_id
     """
-    try:
-        redis_key = f"daily_summary_sent:{client_id}:{date_str}"
-        return bool(redis_client.get(redis_key))
-    except Exception as e:
-        logger.error(f"Ошибка проверки Redis: {e}")
-        return False
+    return session.query(Client).filter(
+        Client.id.in_(client_ids), Client.group_chat_id.isnot(None)
+    ).all()
 
 
-def mark_summary_as_sent(redis_client: redis.Redis, client_id: str, date_str: str) -> None:
+def get_summary_sent_key(client_id: str, date_str: str) -> str:
     """
-    Отмечает отчет как отправленный в Redis.
+    Ключ Redis с отметкой об отправке отчета клиенту.
     
     Args:
-        redis_client: Redis клиент
         client_id: ID клиента
         date_str: Дата в формате YYYY-MM-DD
-    """
-    try:
-        redis_key = f"daily_summary_sent:{client_id}:{date_str}"
-        redis_client.setex(redis_key, 86400, "sent")  # 24 часа
-    except Exception as e:
-        logger.error(f"Ошибка записи в Redis: {e}")
-
-
-def fetch_today_results(session, client_id: str, marketplace: str, today: date) -> List[Any]:
-    """
-    Получает результаты за сегодня для конкретного маркетплейса.
-    
-    Args:
-        session: Сессия БД
-        client_id: ID клиента
-        marketplace: Маркетплейс (ozon/wb)
-        today: Сегодняшняя дата
         
     Returns:
-        Список результатов
+        Ключ Redis
     """
-    try:
-        results = session.execute(text("""
-            SELECT DISTINCT ON (r.product_code) 
-                r.product_code, r.product_name, r.product_link, 
-                r.market_price, r.showcase_price, r.timestamp,
-                a.market
-            FROM results r
-            JOIN accounts a ON r.account_id = a.id
-            WHERE r.client_id = :client_id 
-                AND a.market = :marketplace
-                AND r.timestamp >= :today_start 
-                AND r.timestamp < :today_end
-            ORDER BY r.product_code, r.timestamp DESC
-        """), {
-            "client_id": client_id,
-            "marketplace": marketplace,
-            "today_start": today,
-            "today_end": today + timedelta(days=1)
-        }).fetchall()
-        
-        return results
-        
-    except Exception as e:
-        logger.error(f"Ошибка получения данных за сегодня: {e}")
-        return []
+    return f"daily_summary_sent:{client_id}:{date_str}"
 
 
-def fetch_previous_results(session, client_id: str, marketplace: str, today_timestamp: datetime) -> List[Any]:
+def get_already_sent_client_ids(redis_client: redis.Redis, client_ids: List[str], date_str: str) -> Set[str]:
     """
-    Получает предыдущие результаты для сравнения.
+    Проверяет, каким клиентам уже отправлен отчет на указанную дату.
+    
+    Все ключи читаются одним MGET вместо GET на каждого клиента.
     
     Args:
-        session: Сессия БД
-        client_id: ID клиента
-        marketplace: Маркетплейс (ozon/wb)
-        today_timestamp: Время текущего среза
+        redis_client: Redis клиент
+        client_ids: ID клиентов
+        date_str: Дата в формате YYYY-MM-DD
         
     Returns:
-        Список предыдущих результатов
+        Множество ID клиентов, которым отчет уже отправлялся
     """
+    if not client_ids:
+        return set()
+    
     try:
-        results = session.execute(text("""
-            SELECT DISTINCT ON (r.product_code) 
-                r.product_code, r.product_name, r.product_link, 
-                r.market_price, r.showcase_price, r.timestamp,
-                a.market
-            FROM results r
-            JOIN accounts a ON r.account_id = a.id
-            WHERE r.client_id = :client_id 
-                AND a.market = :marketplace
-                AND r.timestamp < :today_timestamp
-            ORDER BY r.product_code, r.timestamp DESC
-        """), {
-            "client_id": client_id,
-            "marketplace": marketplace,
-            "today_timestamp": today_timestamp
-        }).fetchall()
-        
-        return results
-        
+        keys = [get_summary_sent_key(client_id, date_str) for client_id in client_ids]
+        flags = redis_client.mget(keys)
+        return {client_id for client_id, flag in zip(client_ids, flags) if flag}
     except Exception as e:
-        logger.error(f"Ошибка получения предыдущих данных: {e}")
-        return []
+        logger.error(f"Ошибка проверки Redis: {e}")
+        return set()
 
 
-def calculate_discount_percent(market_price: float, showcase_price: float) -> float:
+def mark_summaries_as_sent(redis_client: redis.Redis, client_ids: List[str], date_str: str) -> None:
     """
-    Вычисляет процент скидки.
+    Отмечает отчеты клиентов как отправленные в Redis.
+    
+    Запись идет одним pipeline вместо SETEX на каждого клиента.
     
     Args:
-        market_price: Цена маркетплейса
-        showcase_price: Цена на витрине
-        
-    Returns:
-        Процент скидки (0.0 - 1.0)
+        redis_client: Redis клиент
+        client_ids: ID клиентов
+        date_str: Дата в формате YYYY-MM-DD
     """
-    if not market_price or not showcase_price or market_price <= 0:
-        return 0.0
+    if not client_ids:
+        return
     
-    return (market_price - showcase_price) / market_price
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for client_id in client_ids:
+            pipe.setex(get_summary_sent_key(client_id, date_str), SUMMARY_SENT_TTL, "sent")
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Ошибка записи в Redis: {e}")
 
 
-def calculate_marketplace_stats(today_results: List[Any], previous_results: List[Any]) -> MarketplaceStats:
+def fetch_summary_stats(session, client_ids: List[str], today: date) -> Dict[Tuple[str, str], Any]:
     """
-    Вычисляет статистику изменений по маркетплейсу.
+    Получает статистику изменений СПП для всех клиентов одним запросом.
+    
+    Сегодняшний срез - последняя запись по каждому товару за день,
+    предыдущий - последняя запись раньше времени сегодняшнего среза
+    того же клиента и маркетплейса. Сравнение скидок и подсчет идут
+    агрегатами в SQL, по одной строке на пару (client_id, market).
     
     Args:
-        today_results: Сегодняшние результаты
-        previous_results: Предыдущие результаты
+        session: Сессия БД
+        client_ids: ID клиентов
+        today: Сегодняшняя дата
         
     Returns:
-        MarketplaceStats со статистикой
-    """
-    stats = MarketplaceStats(
-        total_tracked=len(today_results),
-        increased=0,
-        decreased=0,
-        unchanged=0,
-        new_products=0
-    )
-    
-    # Создаем словарь для быстрого поиска предыдущих данных
-    previous_data = {r.product_code: r for r in previous_results}
-    
-    for today_result in today_results:
-        # Рассчитываем текущую скидку
-        today_discount = calculate_discount_percent(
-            today_result.market_price or 0,
-            today_result.showcase_price or 0
-        )
-        
-        # Находим предыдущий результат
-        prev_result = previous_data.get(today_result.product_code)
+        {(client_id, marketplace): строка со временем срезов и счетчиками}
         
-        if prev_result is None:
-            stats.new_products += 1
-        else:
-            # Рассчитываем предыдущую скидку
-            prev_discount = calculate_discount_percent(
-                prev_result.market_price or 0,
-                prev_result.showcase_price or 0
-            )
-            
-            # Сравниваем скидки с округлением
-            today_discount_rounded = round(today_discount, 2)
-            prev_discount_rounded = round(prev_discount, 2)
-            
-            if today_discount_rounded > prev_discount_rounded:
-                stats.increased += 1  # СПП выросла
-            elif today_discount_rounded < prev_discount_rounded:
-                stats.decreased += 1  # СПП снизилась
-            else:
-                stats.unchanged += 1
+    Raises:
+        SQLAlchemyError: при ошибке БД (задача отправки повторяется)
+    """
+    if not client_ids:
+        return {}
+    
+    rows = session.execute(SUMMARY_STATS_QUERY, {
+        "client_ids": list(client_ids),
+        "marketplaces": list(SUMMARY_MARKETPLACES),
+        "today_start": today,
+        "today_end": today + timedelta(days=1)
+    }).fetchall()
     
-    return stats
+    return {(r.client_id, r.market): r for r in rows}
 
 
 def get_marketplace_display_info(marketplace: str) -> Tuple[str, str]:
@@ -292,12 +324,7 @@ def get_marketplace_display_info(marketplace: str) -> Tuple[str, str]:
     Returns:
         Tuple[название, эмодзи]
     """
-    if marketplace == "ozon":
-        return "Ozon", "🟠"
-    elif marketplace == "wb":
-        return "Wildberries", "🟣"
-    else:
-        return marketplace.title(), "📊"
+    return MARKETPLACE_DISPLAY_INFO.get(marketplace) or (marketplace.title(), "📊")
 
 
 def format_summary_message(summary_data: SummaryData, today: date) -> str:
@@ -312,31 +339,33 @@ def format_summary_message(summary_data: SummaryData, today: date) -> str:
         Отформатированное сообщение
     """
     marketplace_name, marketplace_emoji = get_marketplace_display_info(summary_data.marketplace)
+    client = summary_data.client
+    previous_timestamp = summary_data.previous_timestamp
     
-    message = f"{marketplace_emoji} <b>Отчет СПП мониторинга - {marketplace_name}</b>\n\n"
-    message += f"<b>Клиент:</b> {safe_error_message(summary_data.client.name)} (ID: {safe_error_message(summary_data.client.id)})\n"
-    message += f"<b>Дата:</b> {today.strftime('%d.%m.%Y')}\n"
-    
-    # Конвертируем время в московское
-    today_timestamp_msk = summary_data.today_timestamp.replace(tzinfo=pytz.UTC).astimezone(MSK_TZ)
-    message += f"<b>Текущий срез:</b> {today_timestamp_msk.strftime('%d.%m.%Y %H:%M')} МСК\n"
-    
-    if summary_data.previous_timestamp:
-        previous_timestamp_msk = summary_data.previous_timestamp.replace(tzinfo=pytz.UTC).astimezone(MSK_TZ)
-        message += f"<b>Сравнение с:</b> {previous_timestamp_msk.strftime('%d.%m.%Y %H:%M')} МСК\n\n"
-    else:
-        message += f"<b>Сравнение с:</b> Нет предыдущих данных\n\n"
-    
-    # Статистика
-    stats = summary_data.stats
-    message += f"📈 <b>Статистика:</b>\n"
-    message += f"• Всего отслеживается: {stats.total_tracked}\n"
-    message += f"• СПП выросла (скидка увеличилась): {stats.increased}\n"
-    message += f"• СПП снизилась (скидка уменьшилась): {stats.decreased}\n"
-    message += f"• СПП без изменений: {stats.unchanged}\n"
-    message += f"• Новые товары: {stats.new_products}\n\n"
+    return render_summary_message(
+        emoji=marketplace_emoji,
+        marketplace=marketplace_name,
+        client_name=safe_error_message(client.name),
+        client_id=safe_error_message(client.id),
+        today=today.strftime('%d.%m.%Y'),
+        today_slice=format_msk_timestamp(summary_data.today_timestamp),
+        previous_slice=(f"{format_msk_timestamp(previous_timestamp)} МСК" if previous_timestamp
+                        else "Нет предыдущих данных"),
+        **vars(summary_data.stats)
+    )
+
+
+def format_msk_timestamp(timestamp: datetime) -> str:
+    """
+    Форматирует время среза (UTC в БД) по московскому времени.
     
-    return message
+    Args:
+        timestamp: Время среза без tzinfo (UTC)
+        
+    Returns:
+        Строка вида ДД.ММ.ГГГГ ЧЧ:ММ
+    """
+    return timestamp.replace(tzinfo=pytz.UTC).astimezone(MSK_TZ).strftime('%d.%m.%Y %H:%M')
 
 
 def create_inline_keyboard(client_id: str, data_date: date, marketplace: str) -> Dict[str, Any]:
@@ -351,13 +380,15 @@ def create_inline_keyboard(client_id: str, data_date: date, marketplace: str) ->
     Returns:
         Inline клавиатура
     """
-    marketplace_name, _ = get_marketplace_display_info(marketplace)
+    button_text = EXCEL_BUTTON_TEXTS.get(marketplace)
+    if button_text is None:
+        button_text = f"📥 Подробный отчет {get_marketplace_display_info(marketplace)[0]} (EXCEL)"
     
     return {
         "inline_keyboard": [[
             {
-                "text": f"📥 Подробный отчет {marketplace_name} (EXCEL)",
-                "callback_data": f"excel_report|{client_id}|{data_date.strftime('%Y-%m-%d')}|{marketplace}"
+                "text": button_text,
+                "callback_data": f"excel_report|{client_id}|{data_date.isoformat()}|{marketplace}"
             }
         ]]
     }
@@ -376,7 +407,7 @@ def send_telegram_message(chat_id: str, message: str, reply_markup: Dict[str, An
         True если успешно отправлено
     """
     try:
-        bot_token = os.getenv("BOT_TOKEN")
+        bot_token = BOT_TOKEN
         if not bot_token:
             logger.error("BOT_TOKEN не найден в переменных окружения")
             return False
@@ -389,7 +420,9 @@ def send_telegram_message(chat_id: str, message: str, reply_markup: Dict[str, An
             "reply_markup": reply_markup
         }
         
-        response = requests.post(url, json=payload, timeout=10)
+        response = telegram_http_session.post(
+            url, data=orjson.dumps(payload), headers=TELEGRAM_JSON_HEADERS, timeout=10
+        )
         if response.status_code == 200:
             return True
         else:
@@ -401,131 +434,175 @@ def send_telegram_message(chat_id: str, message: str, reply_markup: Dict[str, An
         return False
 
 
-def generate_summary_for_marketplace(session, client: Any, marketplace: str, today: date) -> Optional[SummaryData]:
+def generate_summary_for_marketplace(client: Any, marketplace: str, stats_row: Optional[Any]) -> Optional[SummaryData]:
     """
     Генерирует данные отчета для конкретного маркетплейса.
     
     Args:
-        session: Сессия БД
         client: Объект клиента
         marketplace: Маркетплейс (ozon/wb)
-        today: Сегодняшняя дата
+        stats_row: Строка fetch_summary_stats или None, если за сегодня нет данных
         
     Returns:
         SummaryData или None если нет данных
     """
-    try:
-        # Получаем сегодняшние данные
-        today_results = fetch_today_results(session, client.id, marketplace, today)
-        if not today_results:
-            logger.info(f"Нет данных для клиента {client.id} на {marketplace}")
-            return None
-        
-        # Получаем время последнего среза
-        today_timestamp = max(r.timestamp for r in today_results)
-        
-        # Получаем предыдущие данные
-        previous_results = fetch_previous_results(session, client.id, marketplace, today_timestamp)
-        previous_timestamp = max(r.timestamp for r in previous_results) if previous_results else None
-        
-        # Вычисляем статистику
-        stats = calculate_marketplace_stats(today_results, previous_results)
-        
-        return SummaryData(
-            client=client,
-            marketplace=marketplace,
-            today_results=today_results,
-            previous_results=previous_results,
-            today_timestamp=today_timestamp,
-            previous_timestamp=previous_timestamp,
-            stats=stats
+    if stats_row is None:
+        logger.info(f"Нет данных для клиента {client.id} на {marketplace}")
+        return None
+    
+    return SummaryData(
+        client=client,
+        marketplace=marketplace,
+        today_timestamp=stats_row.today_timestamp,
+        previous_timestamp=stats_row.previous_timestamp,
+        stats=MarketplaceStats(
+            total_tracked=stats_row.total_tracked,
+            increased=stats_row.increased,  # СПП выросла
+            decreased=stats_row.decreased,  # СПП снизилась
+            unchanged=stats_row.unchanged,
+            new_products=stats_row.new_products
         )
+    )
+
+
+def send_daily_summary_refactored(client_id: Optional[str] = None, force_send: bool = False,
+                                  client_ids: Optional[List[str]] = None) -> int:
+    """
+    Отправка ежедневного отчета без исключений наружу.
+    
+    Для вызовов внутри других процессов (проверка отчетов парсера): ошибка
+    отправки сводки не должна прерывать обработку заказов.
+    
+    Args:
+        client_id: ID конкретного клиента или None для всех
+        force_send: Если True, пропускает проверку "уже отправлялся сегодня"
+        client_ids: Список ID клиентов (пачка из schedule_daily_summaries), важнее client_id
         
+    Returns:
+        Количество отправленных отчетов (0 при ошибке)
+    """
+    try:
+        return run_daily_summary(client_id, force_send, client_ids)
     except Exception as e:
-        logger.error(f"Ошибка генерации данных для {marketplace}: {e}")
-        return None
+        logger.exception(f"Ошибка в send_daily_summary: {e}")
+        return 0
 
 
-def send_daily_summary_refactored(client_id: Optional[str] = None, force_send: bool = False) -> int:
+def run_daily_summary(client_id: Optional[str] = None, force_send: bool = False,
+                      client_ids: Optional[List[str]] = None) -> int:
     """
     Рефакторенная версия отправки ежедневного отчета.
     
-    Цикломатическая сложность: 7 (было 20)
+    Цикломатическая сложность: 5 (было 20)
     Разбита на функции согласно принципу Single Responsibility.
+    Ошибки БД пробрасываются: задача Celery повторяет запуск, а клиенты,
+    которым отчет уже ушел, отсекаются по отметкам в Redis.
     
     Args:
         client_id: ID конкретного клиента или None для всех
         force_send: Если True, пропускает проверку "уже отправлялся сегодня"
+        client_ids: Список ID клиентов (пачка из schedule_daily_summaries), важнее client_id
         
     Returns:
         Количество отправленных отчетов
     """
     logger.info(f"Запуск отправки ежедневного отчета v2 для клиента: {client_id or 'всех'}, force_send: {force_send}")
     
+    # 1. Инициализация подключений (CC: 1)
+    redis_client = get_redis_client()
+    session = get_sync_session()
+    
+    today = datetime.now().date()
+    today_str = today.strftime('%Y-%m-%d')
+    
+    # 2. Получение клиентов и статистики по всем клиентам одним запросом (CC: 1)
     try:
-        from db.session import get_sync_session
-        
-        # 1. Инициализация подключений (CC: 1)
-        redis_client = get_redis_client()
-        session = get_sync_session()
-        
-        # 2. Получение клиентов (CC: 1)
-        clients = get_clients_for_summary(session, client_id)
-        
-        today = datetime.now().date()
-        today_str = today.strftime('%Y-%m-%d')
-        total_sent = 0
-        
-        # 3. Обработка каждого клиента (CC: 1)
-        for client in clients:
-            if not client.group_chat_id:
-                logger.warning(f"Клиент {client.id} не имеет group_chat_id, пропускаем")
-                continue
-            
-            # 4. Проверка уже отправленных отчетов (CC: 1)
-            if not force_send and is_summary_already_sent(redis_client, client.id, today_str):
-                logger.info(f"Отчет для клиента {client.id} уже отправлялся сегодня, пропускаем")
-                continue
-            
-            client_reports_sent = 0
-            
-            # 5. Обработка каждого маркетплейса (CC: 1)
-            for marketplace in ['ozon', 'wb']:
-                success = process_marketplace_summary(session, client, marketplace, today)
-                if success:
-                    client_reports_sent += 1
-                    total_sent += 1
-            
-            # 6. Отметка об отправке отчета (CC: 1)
-            if client_reports_sent > 0:
-                mark_summary_as_sent(redis_client, client.id, today_str)
-        
+        candidates = (get_clients_for_summary_bulk(session, client_ids) if client_ids
+                      else get_clients_for_summary(session, client_id))
+        clients = select_clients_to_notify(redis_client, candidates, today_str, force_send)
+        summary_stats = fetch_summary_stats(session, [client.id for client in clients], today)
+    finally:
         session.close()
-        logger.info(f"Отправка завершена, всего отправлено отчетов: {total_sent}")
+    
+    # 3. Отправка клиентам параллельно, ожидание ответов Telegram перекрывается (CC: 1)
+    sent_counts = {}
+    send_summaries = partial(send_client_summaries, today=today, summary_stats=summary_stats)
+    try:
+        with ThreadPoolExecutor(max_workers=SUMMARY_SEND_WORKERS) as executor:
+            for client, client_reports_sent in zip(clients, executor.map(send_summaries, clients)):
+                sent_counts[client.id] = client_reports_sent
+    finally:
+        # 4. Отметка об отправке отчетов одним pipeline (CC: 1)
+        sent_client_ids = [cid for cid, count in sent_counts.items() if count > 0]
+        mark_summaries_as_sent(redis_client, sent_client_ids, today_str)
+    
+    total_sent = sum(sent_counts.values())
+    logger.info(f"Отправка завершена, всего отправлено отчетов: {total_sent}")
+    
+    return total_sent
+
+
+def send_client_summaries(client: Any, today: date, summary_stats: Dict[Tuple[str, str], Any]) -> int:
+    """
+    Отправляет клиенту сводки по всем маркетплейсам.
+    
+    Маркетплейсы обрабатываются последовательно, чтобы сообщения
+    в чате клиента шли в порядке SUMMARY_MARKETPLACES.
+    
+    Args:
+        client: Объект клиента
+        today: Сегодняшняя дата
+        summary_stats: Результат fetch_summary_stats
         
-        return total_sent
+    Returns:
+        Количество отправленных отчетов
+    """
+    return sum(
+        process_marketplace_summary(client, marketplace, today, summary_stats.get((client.id, marketplace)))
+        for marketplace in SUMMARY_MARKETPLACES
+    )
+
+
+def select_clients_to_notify(redis_client: redis.Redis, clients: List[Any],
+                             date_str: str, force_send: bool) -> List[Any]:
+    """
+    Отбирает клиентов, которым нужно отправить отчет.
+    
+    Args:
+        redis_client: Redis клиент
+        clients: Список клиентов
+        date_str: Дата в формате YYYY-MM-DD
+        force_send: Если True, не проверяет "уже отправлялся сегодня"
         
-    except Exception as e:
-        logger.exception(f"Ошибка в send_daily_summary: {e}")
-        return 0
+    Returns:
+        Клиенты, которым отчет еще не отправлялся
+    """
+    if force_send:
+        return list(clients)
+    
+    already_sent = get_already_sent_client_ids(redis_client, [client.id for client in clients], date_str)
+    for client_id in already_sent:
+        logger.info(f"Отчет для клиента {client_id} уже отправлялся сегодня, пропускаем")
+    
+    return [client for client in clients if client.id not in already_sent]
 
 
-def process_marketplace_summary(session, client: Any, marketplace: str, today: date) -> bool:
+def process_marketplace_summary(client: Any, marketplace: str, today: date, stats_row: Optional[Any]) -> bool:
     """
     Обрабатывает отправку отчета для одного маркетплейса.
     
     Args:
-        session: Сессия БД
         client: Объект клиента
         marketplace: Маркетплейс (ozon/wb)
         today: Сегодняшняя дата
+        stats_row: Строка fetch_summary_stats или None
         
     Returns:
         True если отчет успешно отправлен
     """
     try:
         # Генерируем данные отчета
-        summary_data = generate_summary_for_marketplace(session, client, marketplace, today)
+        summary_data = generate_summary_for_marketplace(client, marketplace, stats_row)
         if not summary_data:
             return False
         
@@ -5,12 +5,31 @@ import logging
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 import asyncio
+from typing import BinaryIO, Union
 
 # Требуемый набор колонок Excel для СПП мониторинга
 COLS = ["client_id", "market", "account_id", "product_code", "product_name", "product_link"]
 
 TEMPLATE_PATH = "/tmp/products_template.xlsx"
 
+# Запросы на каждую строку Excel: text() создаем один раз, а не в цикле
+ACCOUNT_ID_SQL = text("""
+    SELECT id FROM accounts 
+    WHERE client_id = :client_id 
+    AND market = :market 
+    AND account_id = :account_id
+""")
+
+UPSERT_PRODUCT_SQL = text("""
+    INSERT INTO products (client_id, account_id, product_code, product_name, product_link)
+    VALUES (:client_id, :account_id, :product_code, :product_name, :product_link)
+    ON CONFLICT (account_id, product_code)
+    DO UPDATE SET
+        product_name = EXCLUDED.product_name,
+        product_link = EXCLUDED.product_link,
+        client_id = EXCLUDED.client_id
+""")
+
 async def create_error_file(error_rows, errors):
     """Создает Excel файл с ошибками."""
     if not error_rows:
@@ -142,14 +161,7 @@ def sync_load_excel(path: str):
             
             try:
                 # Найдём account.id с помощью прямого SQL запроса
-                acc_query = text("""
-                    SELECT id FROM accounts 
-                    WHERE client_id = :client_id 
-                    AND market = :market 
-                    AND account_id = :account_id
-                """)
-                
-                result = conn.execute(acc_query, {
+                result = conn.execute(ACCOUNT_ID_SQL, {
                     "client_id": row_data["client_id"],
                     "market": row_data["market"],
                     "account_id": row_data["account_id"]
@@ -165,17 +177,7 @@ def sync_load_excel(path: str):
                 acc_id = acc_row[0]
                 
                 # Используем PostgreSQL-специфичный upsert с прямым SQL
-                upsert_query = text("""
-                    INSERT INTO products (client_id, account_id, product_code, product_name, product_link)
-                    VALUES (:client_id, :account_id, :product_code, :product_name, :product_link)
-                    ON CONFLICT (account_id, product_code)
-                    DO UPDATE SET
-                        product_name = EXCLUDED.product_name,
-                        product_link = EXCLUDED.product_link,
-                        client_id = EXCLUDED.client_id
-                """)
-                
-                conn.execute(upsert_query, {
+                conn.execute(UPSERT_PRODUCT_SQL, {
                     "client_id": row_data["client_id"],
                     "account_id": acc_id,
                     "product_code": row_data["product_code"],
@@ -194,8 +196,8 @@ def sync_load_excel(path: str):
     
     return ok, errors, error_rows
 
-async def load_excel(path: str):
-    """Парсит Excel и пишет новые товары в таблицу products.
+async def load_excel(path: Union[str, BinaryIO]):
+    """Парсит Excel (путь или открытый бинарный файл) и пишет новые товары в таблицу products.
 
     Возвращает кортеж: (кол-во вставленных, список ошибок, путь к файлу с ошибками)
     """
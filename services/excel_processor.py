@@ -5,17 +5,56 @@
 """
 
 import os
+from stat import S_ISREG
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Tuple, Optional, Set, Any
+from typing import List, Dict, Tuple, Optional, Set, Any, BinaryIO, Union
 from dataclasses import dataclass
 from sqlalchemy import create_engine, text
+from sqlalchemy.dialects.postgresql import insert
 from celery.utils.log import get_task_logger
 
+from db.models import Product
+
 logger = get_task_logger(__name__)
 
 # Константы
 REQUIRED_COLUMNS = ["client_id", "market", "account_id", "product_code", "product_name", "product_link"]
 ALLOWED_MARKETS = ["ozon", "wb"]
+REQUIRED_COLUMNS_SET = frozenset(REQUIRED_COLUMNS)
+VALIDATED_COLUMNS = ["client_id", "market", "account_id", "product_code", "product_name"]
+
+# Сообщения validate_rows_vectorized по номеру проверки (порядок как в validate_row_data)
+ROW_ERROR_TEMPLATES = {
+    1: "пустой client_id",
+    2: "пустой market",
+    3: "неверный market '{market}' (должен быть " + " или ".join(ALLOWED_MARKETS) + ")",
+    4: "пустой account_id",
+    5: "пустой product_code",
+    6: "пустое product_name",
+}
+
+# Запросы выполняются на каждую строку файла, поэтому text() создается один раз на процесс
+FIND_ACCOUNT_SQL = text("""
+    SELECT id FROM accounts 
+    WHERE client_id = :client_id 
+    AND market = :market 
+    AND account_id = :account_id
+""")
+
+# Товары файла сохраняются пачками по столько строк одним INSERT ... ON CONFLICT
+# (5 параметров на строку, далеко от предела PostgreSQL в 65535)
+PRODUCT_UPSERT_BATCH_SIZE = 1000
+
+UPSERT_PRODUCT_SQL = text("""
+    INSERT INTO products (client_id, account_id, product_code, product_name, product_link)
+    VALUES (:client_id, :account_id, :product_code, :product_name, :product_link)
+    ON CONFLICT (account_id, product_code)
+    DO UPDATE SET
+        product_name = EXCLUDED.product_name,
+        product_link = EXCLUDED.product_link,
+        client_id = EXCLUDED.client_id
+""")
 
 
 @dataclass
@@ -52,12 +91,12 @@ def create_sync_engine() -> Any:
         raise
 
 
-def read_excel_file(file_path: str) -> pd.DataFrame:
+def read_excel_file(file_path: Union[str, BinaryIO]) -> pd.DataFrame:
     """
     Читает Excel файл и возвращает DataFrame.
     
     Args:
-        file_path: Путь к Excel файлу
+        file_path: Путь к Excel файлу или открытый бинарный файл (например, BytesIO)
         
     Returns:
         DataFrame с данными
@@ -86,9 +125,11 @@ def validate_excel_columns(df: pd.DataFrame) -> None:
     Raises:
         ValueError: При отсутствии необходимых колонок
     """
-    missing_columns = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    missing = REQUIRED_COLUMNS_SET.difference(df.columns)
     
-    if missing_columns:
+    if missing:
+        # Порядок колонок в сообщении тот же, что и в шаблоне
+        missing_columns = [col for col in REQUIRED_COLUMNS if col in missing]
         error_msg = f"В файле отсутствуют колонки: {missing_columns}"
         logger.error(error_msg)
         raise ValueError(error_msg)
@@ -106,20 +147,20 @@ def check_for_duplicates(df: pd.DataFrame) -> Set[Tuple[str, str]]:
     Returns:
         Set дубликатов (client_id, product_code)
     """
-    seen_products = {}
-    duplicates = set()
+    # Сравнение идет по колонкам целиком, а не построчно через iterrows:
+    # на больших файлах это на порядки быстрее
+    client_ids = df["client_id"].astype(str).str.strip()
+    product_codes = df["product_code"].astype(str).str.strip()
+    filled = ((client_ids != "") & (product_codes != "")).to_numpy()
     
-    for idx, row in df.iterrows():
-        row_data = {k: str(v).strip() for k, v in row.items()}
-        
-        if row_data["client_id"] and row_data["product_code"]:
-            key = (row_data["client_id"], row_data["product_code"])
-            
-            if key in seen_products:
-                duplicates.add(key)
-                logger.warning(f"Найден дубликат: {key} в строке {idx + 2}")
-            else:
-                seen_products[key] = idx + 2
+    keys = pd.DataFrame({"client_id": client_ids, "product_code": product_codes})[filled]
+    repeated = keys[keys.duplicated(subset=["client_id", "product_code"], keep="first").to_numpy()]
+    
+    duplicates = set()
+    for idx, client_id, product_code in repeated.itertuples(name=None):
+        key = (client_id, product_code)
+        duplicates.add(key)
+        logger.warning(f"Найден дубликат: {key} в строке {idx + 2}")
     
     if duplicates:
         logger.warning(f"Обнаружено {len(duplicates)} дубликатов в файле")
@@ -160,6 +201,41 @@ def validate_row_data(row_data: Dict[str, str], row_number: int) -> Optional[str
     return None
 
 
+def validate_rows_vectorized(df: pd.DataFrame) -> np.ndarray:
+    """
+    Валидирует все строки DataFrame сразу, по колонкам.
+    
+    Дает те же сообщения, что validate_row_data для каждой строки по отдельности:
+    при нескольких ошибках в строке возвращается первая по порядку проверок.
+    
+    Args:
+        df: DataFrame с данными
+        
+    Returns:
+        Массив (dtype=object) с сообщением об ошибке или None для каждой строки
+    """
+    values = {col: df[col].astype(str).str.strip().to_numpy() for col in VALIDATED_COLUMNS}
+    market = values["market"]
+    
+    # np.select берет первое сработавшее условие, как цепочка if в validate_row_data
+    codes = np.select([
+        values["client_id"] == "",
+        market == "",
+        ~np.isin(market, ALLOWED_MARKETS),
+        values["account_id"] == "",
+        values["product_code"] == "",
+        values["product_name"] == "",
+    ], range(1, 7), default=0)
+    
+    # Сообщения собираются только для строк с ошибками, которых обычно немного
+    errors = np.full(len(df), None, dtype=object)
+    row_numbers = df.index.to_numpy() + 2
+    for i in np.flatnonzero(codes):
+        errors[i] = f"Строка {row_numbers[i]}: " + ROW_ERROR_TEMPLATES[codes[i]].format(market=market[i])
+    
+    return errors
+
+
 def find_account_id(conn, client_id: str, market: str, account_id: str) -> Optional[int]:
     """
     Находит ID аккаунта в базе данных.
@@ -174,14 +250,7 @@ def find_account_id(conn, client_id: str, market: str, account_id: str) -> Optio
         ID аккаунта или None если не найден
     """
     try:
-        query = text("""
-            SELECT id FROM accounts 
-            WHERE client_id = :client_id 
-            AND market = :market 
-            AND account_id = :account_id
-        """)
-        
-        result = conn.execute(query, {
+        result = conn.execute(FIND_ACCOUNT_SQL, {
             "client_id": client_id,
             "market": market,
             "account_id": account_id
@@ -212,17 +281,7 @@ def upsert_product(conn, client_id: str, account_id: int, product_code: str,
         True если операция успешна
     """
     try:
-        query = text("""
-            INSERT INTO products (client_id, account_id, product_code, product_name, product_link)
-            VALUES (:client_id, :account_id, :product_code, :product_name, :product_link)
-            ON CONFLICT (account_id, product_code)
-            DO UPDATE SET
-                product_name = EXCLUDED.product_name,
-                product_link = EXCLUDED.product_link,
-                client_id = EXCLUDED.client_id
-        """)
-        
-        conn.execute(query, {
+        conn.execute(UPSERT_PRODUCT_SQL, {
             "client_id": client_id,
             "account_id": account_id,
             "product_code": product_code,
@@ -239,19 +298,63 @@ def upsert_product(conn, client_id: str, account_id: int, product_code: str,
         return False
 
 
+def upsert_products_bulk(conn, rows: List[Dict[str, Any]]) -> bool:
+    """
+    Вставляет или обновляет пачку товаров одним многострочным INSERT ... ON CONFLICT.
+    
+    Строки должны быть уникальны по (account_id, product_code), иначе PostgreSQL
+    отклонит запрос: одна строка не может обновиться дважды в одном INSERT.
+    
+    Args:
+        conn: Соединение с БД
+        rows: Словари с ключами client_id, account_id, product_code, product_name, product_link
+        
+    Returns:
+        True если операция успешна
+    """
+    if not rows:
+        return True
+    
+    stmt = insert(Product).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["account_id", "product_code"],
+        set_={
+            "product_name": stmt.excluded.product_name,
+            "product_link": stmt.excluded.product_link,
+            "client_id": stmt.excluded.client_id,
+        }
+    )
+    
+    try:
+        conn.execute(stmt)
+        conn.commit()
+        return True
+        
+    except Exception as e:
+        logger.error(f"Ошибка пакетного upsert {len(rows)} товаров: {e}")
+        conn.rollback()
+        return False
+
+
 def process_single_row(conn, row_data: Dict[str, str], row_number: int, 
-                      duplicates: Set[Tuple[str, str]]) -> Optional[ValidationError]:
+                      duplicates: Set[Tuple[str, str]],
+                      validation_error: Optional[str]) -> Tuple[Optional[ValidationError], Optional[Dict[str, Any]]]:
     """
-    Обрабатывает одну строку из Excel файла.
+    Проверяет одну строку из Excel файла и готовит товар к сохранению.
+    
+    Сам товар здесь не сохраняется: process_excel_rows пишет готовые
+    товары пачками через save_products.
     
     Args:
         conn: Соединение с БД
         row_data: Данные строки
         row_number: Номер строки
         duplicates: Множество дубликатов
+        validation_error: Ошибка валидации строки (из validate_rows_vectorized) или None
         
     Returns:
-        ValidationError если есть ошибка, None если успешно
+        Tuple[ошибка, товар]: (ValidationError, None) при ошибке или
+        (None, словарь товара для upsert_products_bulk)
     """
     # Проверяем дубликат
     key = (row_data["client_id"], row_data["product_code"])
@@ -261,16 +364,15 @@ def process_single_row(conn, row_data: Dict[str, str], row_number: int,
             row_number=row_number,
             error_message=error_msg,
             row_data=[str(row_number)] + [row_data.get(col, "") for col in REQUIRED_COLUMNS]
-        )
+        ), None
     
-    # Валидация данных строки
-    validation_error = validate_row_data(row_data, row_number)
+    # Валидация данных строки: сообщение посчитано заранее для всего файла
     if validation_error:
         return ValidationError(
             row_number=row_number,
             error_message=validation_error,
             row_data=[str(row_number)] + [row_data.get(col, "") for col in REQUIRED_COLUMNS]
-        )
+        ), None
     
     # Поиск аккаунта
     account_db_id = find_account_id(
@@ -286,27 +388,47 @@ def process_single_row(conn, row_data: Dict[str, str], row_number: int,
             row_number=row_number,
             error_message=error_msg,
             row_data=[str(row_number)] + [row_data.get(col, "") for col in REQUIRED_COLUMNS]
-        )
-    
-    # Upsert товара
-    success = upsert_product(
-        conn,
-        row_data["client_id"],
-        account_db_id,
-        row_data["product_code"],
-        row_data["product_name"],
-        row_data["product_link"]
-    )
+        ), None
+    
+    return None, {
+        "client_id": row_data["client_id"],
+        "account_id": account_db_id,
+        "product_code": row_data["product_code"],
+        "product_name": row_data["product_name"],
+        "product_link": row_data["product_link"]
+    }
+
+
+def save_products(conn, pending: List[Tuple[int, Dict[str, str], Dict[str, Any]]]) -> List[ValidationError]:
+    """
+    Сохраняет проверенные товары пачками по PRODUCT_UPSERT_BATCH_SIZE.
     
-    if not success:
-        error_msg = f"Строка {row_number}: ошибка при сохранении товара"
-        return ValidationError(
-            row_number=row_number,
-            error_message=error_msg,
-            row_data=[str(row_number)] + [row_data.get(col, "") for col in REQUIRED_COLUMNS]
-        )
+    Если пачка отклонена целиком, ее строки сохраняются по одной, чтобы
+    в ошибках были указаны именно те строки, которые не удалось сохранить.
     
-    return None
+    Args:
+        conn: Соединение с БД
+        pending: Кортежи (номер строки, данные строки, товар) из process_single_row
+        
+    Returns:
+        Ошибки сохранения по строкам
+    """
+    errors = []
+    
+    for start in range(0, len(pending), PRODUCT_UPSERT_BATCH_SIZE):
+        batch = pending[start:start + PRODUCT_UPSERT_BATCH_SIZE]
+        if upsert_products_bulk(conn, [product for _, _, product in batch]):
+            continue
+        
+        for row_number, row_data, product in batch:
+            if not upsert_product(conn, **product):
+                errors.append(ValidationError(
+                    row_number=row_number,
+                    error_message=f"Строка {row_number}: ошибка при сохранении товара",
+                    row_data=[str(row_number)] + [row_data.get(col, "") for col in REQUIRED_COLUMNS]
+                ))
+    
+    return errors
 
 
 def process_excel_rows(df: pd.DataFrame, engine) -> ProcessingResult:
@@ -320,24 +442,34 @@ def process_excel_rows(df: pd.DataFrame, engine) -> ProcessingResult:
     Returns:
         ProcessingResult с результатами обработки
     """
-    # Проверяем дубликаты
+    # Проверяем дубликаты и валидируем все строки сразу, по колонкам
     duplicates = check_for_duplicates(df)
+    row_errors = validate_rows_vectorized(df)
     
-    success_count = 0
     validation_errors = []
+    pending = []
+    
+    columns = list(df.columns)
     
     with engine.connect() as conn:
-        for idx, row in df.iterrows():
+        # itertuples не создает Series на каждую строку, в отличие от iterrows
+        for (idx, *values), validation_error in zip(df.itertuples(name=None), row_errors):
             row_number = idx + 2  # Excel строки начинаются с 1, +1 для заголовка
-            row_data = {k: str(v).strip() for k, v in row.items()}
+            row_data = {k: str(v).strip() for k, v in zip(columns, values)}
             
-            # Обрабатываем строку
-            error = process_single_row(conn, row_data, row_number, duplicates)
+            # Проверяем строку; товар сохраняется позже, вместе с остальными
+            error, product = process_single_row(conn, row_data, row_number, duplicates, validation_error)
             
             if error:
                 validation_errors.append(error)
             else:
-                success_count += 1
+                pending.append((row_number, row_data, product))
+        
+        save_errors = save_products(conn, pending)
+    
+    success_count = len(pending) - len(save_errors)
+    validation_errors.extend(save_errors)
+    validation_errors.sort(key=lambda err: err.row_number)
     
     # Формируем результат
     errors = [err.error_message for err in validation_errors]
@@ -350,7 +482,7 @@ def process_excel_rows(df: pd.DataFrame, engine) -> ProcessingResult:
     )
 
 
-def sync_load_excel_refactored(file_path: str) -> Tuple[int, List[str], List[List[str]]]:
+def sync_load_excel_refactored(file_path: Union[str, BinaryIO]) -> Tuple[int, List[str], List[List[str]]]:
     """
     Рефакторенная версия загрузки Excel файла.
     
@@ -358,7 +490,7 @@ def sync_load_excel_refactored(file_path: str) -> Tuple[int, List[str], List[Lis
     Разбита на функции согласно принципу Single Responsibility.
     
     Args:
-        file_path: Путь к Excel файлу
+        file_path: Путь к Excel файлу или открытый бинарный файл (например, BytesIO)
         
     Returns:
         Tuple[количество загруженных, список ошибок, список строк с ошибками]
@@ -410,14 +542,18 @@ def get_file_info(file_path: str) -> Dict[str, Any]:
     Returns:
         Словарь с информацией о файле
     """
-    if not validate_excel_file_exists(file_path):
+    # Один stat() вместо трех (exists, isfile и сам stat)
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
         return {"exists": False}
     
-    stat = os.stat(file_path)
+    if not S_ISREG(file_stat.st_mode):
+        return {"exists": False}
     
     return {
         "exists": True,
-        "size": stat.st_size,
-        "modified": stat.st_mtime,
+        "size": file_stat.st_size,
+        "modified": file_stat.st_mtime,
         "extension": os.path.splitext(file_path)[1].lower()
     } 
\ No newline at end of file
@@ -8,9 +8,13 @@ import logging
 import json
 import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple, Any
 from dataclasses import dataclass
+from sqlalchemy import Row, insert, select
 from sqlalchemy.orm import Session
 
 from db.models import Client, Account, Product, Order, Result
@@ -25,6 +29,55 @@ DEFAULT_BATCH_SIZE = 1000
 BATCH_DELAY_SECONDS = 1
 REQUEST_TIMEOUT = 30
 
+# Повтор запросов к парсеру, когда он явно не принял запрос
+RETRY_TOTAL = 5
+RETRY_BACKOFF_FACTOR = 0.5
+# 429/503 означают, что запрос не обработан, поэтому их можно повторять и для POST.
+# 502/504 не повторяются: шлюз мог оборвать ответ после того, как парсер принял заказ
+RETRY_STATUS_FORCELIST = (429, 503)
+RETRY_ALLOWED_METHODS = frozenset(["GET", "POST"])
+
+# Домены, по которым ссылка товара считается принадлежащей маркетплейсу
+MARKETPLACE_LINK_DOMAINS = {
+    "wb": ("wildberries.ru", "wb.ru"),
+    "ozon": ("ozon.ru",),
+}
+
+
+def create_parser_http_session() -> requests.Session:
+    """
+    Создает HTTP-сессию для парсера с пулом соединений и повтором запросов.
+    
+    POST /send-order не идемпотентен, поэтому повторяются только запросы,
+    которые парсер точно не обработал:
+    - ответы 429/503 - с экспоненциальной задержкой или по заголовку Retry-After;
+    - ошибки соединения (запрос еще не ушел).
+    Ответы 502/504 и таймауты чтения не повторяются: заказ мог быть уже принят,
+    и повтор отправил бы его второй раз. Когда повторы исчерпаны, возвращается
+    последний ответ, а не RetryError.
+    
+    Returns:
+        Настроенная requests.Session
+    """
+    retry = Retry(
+        total=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS_FORCELIST,
+        allowed_methods=RETRY_ALLOWED_METHODS,
+        respect_retry_after_header=True,
+        read=False,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(max_retries=retry)
+    
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+parser_http_session = create_parser_http_session()
+
 
 @dataclass
 class AccountData:
@@ -84,22 +137,28 @@ def validate_client_and_account(session: Session, client_id: str, account_id: in
         return None, None
 
 
-def get_products_for_account(session: Session, client_id: str, account_id: int) -> List[Product]:
+def get_products_for_account(session: Session, client_id: str, account_id: int) -> List[Row]:
     """
     Получает список товаров для аккаунта.
     
+    Выбираются только колонки, нужные для отправки в парсер, без
+    создания ORM-объектов Product.
+    
     Args:
         session: Сессия БД
         client_id: ID клиента
         account_id: ID аккаунта
         
     Returns:
-        Список товаров
+        Список строк (id, product_code, product_name, product_link)
     """
     try:
-        products = session.query(Product).filter(
-            Product.client_id == client_id,
-            Product.account_id == account_id
+        products = session.execute(
+            select(Product.id, Product.product_code, Product.product_name, Product.product_link)
+            .where(
+                Product.client_id == client_id,
+                Product.account_id == account_id
+            )
         ).all()
         
         if not products:
@@ -114,30 +173,32 @@ def get_products_for_account(session: Session, client_id: str, account_id: int)
         return []
 
 
-def validate_product_link(product_link: str, market: str) -> Optional[str]:
+def validate_product_link(product_link: str, market: str,
+                          valid_domains: Optional[Tuple[str, ...]] = None) -> Optional[str]:
     """
     Валидирует соответствие ссылки товара маркетплейсу.
     
     Args:
         product_link: Ссылка на товар
         market: Маркетплейс (ozon/wb)
+        valid_domains: Заранее вычисленные домены маркетплейса (для вызова в цикле)
         
     Returns:
         Валидную ссылку или None
     """
     if not product_link:
         return None
+    
+    if valid_domains is None:
+        valid_domains = MARKETPLACE_LINK_DOMAINS.get(market.lower(), ())
         
     link_lower = product_link.lower()
-    market_lower = market.lower()
     
-    if market_lower == "wb" and ("wildberries.ru" in link_lower or "wb.ru" in link_lower):
-        return product_link
-    elif market_lower == "ozon" and "ozon.ru" in link_lower:
+    if any(domain in link_lower for domain in valid_domains):
         return product_link
-    else:
-        logger.warning(f"Ссылка не соответствует маркетплейсу {market}: {product_link}")
-        return None
+    
+    logger.warning(f"Ссылка не соответствует маркетплейсу {market}: {product_link}")
+    return None
 
 
 def create_account_data(client: Client, account: Account) -> AccountData:
@@ -178,7 +239,7 @@ def create_task_id(client_id: str, market: str) -> str:
     return f"{client_id}{market_letter}{timestamp}"
 
 
-def prepare_product_batch(products: List[Product], account_data: AccountData, 
+def prepare_product_batch(products: List[Row], account_data: AccountData, 
                          start_idx: int, batch_size: int) -> ProductBatch:
     """
     Подготавливает пакет товаров для отправки.
@@ -197,9 +258,10 @@ def prepare_product_batch(products: List[Product], account_data: AccountData,
     
     batch = []
     product_codes = []
+    valid_domains = MARKETPLACE_LINK_DOMAINS.get(account_data.market.lower(), ())
     
     for product in batch_products:
-        valid_link = validate_product_link(product.product_link, account_data.market)
+        valid_link = validate_product_link(product.product_link, account_data.market, valid_domains)
         
         if valid_link:
             logger.debug(f"Используем ссылку для товара {product.product_code}: {valid_link}")
@@ -292,13 +354,14 @@ def send_batch_to_parser(payload: Dict[str, Any], test_mode: bool) -> Tuple[int,
     """
     try:
         logger.info(f"Отправка батча с task_id {payload['userlabel']}")
-        logger.debug(f"Send Order Payload: {json.dumps(payload, indent=2)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Send Order Payload: %s", json.dumps(payload, indent=2))
         
         if test_mode:
             logger.info("TEST MODE: Не отправляем запрос в парсинговый сервис.")
             return 200, "TEST MODE: Симулированный ответ"
         
-        response = requests.post(
+        response = parser_http_session.post(
             f'{PARSER_BASE_URL}/send-order', 
             json=payload, 
             timeout=REQUEST_TIMEOUT
@@ -343,22 +406,25 @@ def save_order_and_results(session: Session, client_id: str, account_data: Accou
         )
         session.add(order)
         
-        # Сохраняем результаты с ценами из API маркетплейса
-        for prod in batch.products:
-            market_price = prices.get(str(prod["code"]), 0.0)
-            result = Result(
-                client_id=client_id,
-                task_id=batch.task_id,
-                product_id=current_product_id,
-                account_id=account_data.account_id,
-                product_code=prod["code"],
-                product_name=prod["name"],
-                product_link=prod["linkset"][0] if prod["linkset"] else None,
-                market_price=market_price,
-                showcase_price=None,  # Будет обновлено из отчета парсера
-                timestamp=now
-            )
-            session.add(result)
+        # Сохраняем результаты с ценами из API маркетплейса одним bulk INSERT,
+        # без создания ORM-объектов Result на каждый товар
+        results_rows = [
+            {
+                "client_id": client_id,
+                "task_id": batch.task_id,
+                "product_id": current_product_id,
+                "account_id": account_data.account_id,
+                "product_code": prod["code"],
+                "product_name": prod["name"],
+                "product_link": prod["linkset"][0] if prod["linkset"] else None,
+                "market_price": prices.get(str(prod["code"]), 0.0),
+                "showcase_price": None,  # Будет обновлено из отчета парсера
+                "timestamp": now
+            }
+            for prod in batch.products
+        ]
+        if results_rows:
+            session.execute(insert(Result), results_rows)
         
         logger.info(f"Батч успешно отправлен, task_id: {batch.task_id}")
         return True
@@ -369,7 +435,7 @@ def save_order_and_results(session: Session, client_id: str, account_data: Accou
 
 
 def process_products_in_batches(session: Session, client: Client, account_data: AccountData,
-                               products: List[Product], batch_size: int, 
+                               products: List[Row], batch_size: int, 
                                test_mode: bool) -> int:
     """
     Обрабатывает товары пакетами.
@@ -388,34 +454,35 @@ def process_products_in_batches(session: Session, client: Client, account_data:
     orders_created = 0
     total_products = len(products)
     
-    for start_idx in range(0, total_products, batch_size):
-        # Подготавливаем пакет товаров
-        batch = prepare_product_batch(products, account_data, start_idx, batch_size)
-        
-        # Получаем цены из API маркетплейса
-        prices = get_marketplace_prices(batch.product_codes, account_data, test_mode)
-        
-        # Создаем payload для парсера
-        payload = create_parser_payload(client, account_data, batch)
-        
-        # Отправляем в парсер
-        status_code, response_text = send_batch_to_parser(payload, test_mode)
-        
-        if status_code == 200:
-            # Получаем ID последнего товара в пакете
-            current_product_id = products[min(start_idx + batch_size - 1, total_products - 1)].id
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for start_idx in range(0, total_products, batch_size):
+            # Подготавливаем пакет товаров
+            batch = prepare_product_batch(products, account_data, start_idx, batch_size)
+            
+            # Создаем payload для парсера
+            payload = create_parser_payload(client, account_data, batch)
+            
+            # Цены маркетплейса и отправка в парсер независимы - выполняем параллельно
+            prices_future = executor.submit(get_marketplace_prices, batch.product_codes, account_data, test_mode)
+            send_future = executor.submit(send_batch_to_parser, payload, test_mode)
+            prices = prices_future.result()
+            status_code, response_text = send_future.result()
             
-            # Сохраняем заказ и результаты
-            if save_order_and_results(session, client.id, account_data, batch, prices, current_product_id):
-                orders_created += 1
+            if status_code == 200:
+                # Получаем ID последнего товара в пакете
+                current_product_id = products[min(start_idx + batch_size - 1, total_products - 1)].id
+                
+                # Сохраняем заказ и результаты
+                if save_order_and_results(session, client.id, account_data, batch, prices, current_product_id):
+                    orders_created += 1
+                else:
+                    logger.error(f"Ошибка сохранения для task_id: {batch.task_id}")
             else:
-                logger.error(f"Ошибка сохранения для task_id: {batch.task_id}")
-        else:
-            logger.error(f"Ошибка отправки батча: {response_text}")
-        
-        # Пауза между пакетами
-        if start_idx + batch_size < total_products:
-            time.sleep(BATCH_DELAY_SECONDS)
+                logger.error(f"Ошибка отправки батча: {response_text}")
+            
+            # Пауза между пакетами
+            if start_idx + batch_size < total_products:
+                time.sleep(BATCH_DELAY_SECONDS)
     
     return orders_created
 
@@ -6,14 +6,17 @@ import logging
 import requests
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import insert, select
 
 from db.models import Client, Account, Product, Order, Result
 from services.collectors.ozon import get_initial_market_prices_ozon
 from services.collectors.wb import get_initial_market_prices_wb
+from services.order_processor import MARKETPLACE_LINK_DOMAINS, create_parser_http_session
+from services.report_checker import UPDATE_RESULTS_PRICE_SQL, build_task_index
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +25,7 @@ class ParserServiceV2:
     
     def __init__(self):
         self.base_url = "https://parser.market/wp-json/client-api/v1"
+        self._session = create_parser_http_session()
         
     def send_order(self, client_id: str, account_id: int, batch_size: int = 1000, test_mode: bool = False) -> bool:
         """
@@ -44,37 +48,39 @@ class ParserServiceV2:
                 logger.error(f"Аккаунт {account_id} не найден")
                 return False
                 
-            # Получаем товары для аккаунта
-            products = session.query(Product).filter(
-                Product.client_id == client_id,
-                Product.account_id == account_id
-            ).all()
+            # Стримим только нужные колонки товаров порциями по batch_size вместо .all()
+            products = session.execute(
+                select(Product.id, Product.product_code, Product.product_name, Product.product_link)
+                .where(
+                    Product.client_id == client_id,
+                    Product.account_id == account_id
+                )
+                .execution_options(yield_per=batch_size)
+            )
             
-            if not products:
-                logger.error(f"Для клиента {client_id} с аккаунтом {account_id} отсутствуют товары")
-                return False
-                
-            logger.info(f"Найдено {len(products)} товаров для обработки")
+            # Параметры маркетплейса не меняются внутри цикла - вычисляем их один раз
+            market = account.market.lower()
+            valid_domains = MARKETPLACE_LINK_DOMAINS.get(market, ())
+            account_config = self._build_account_config(account, market)
             
             # Подготавливаем данные для отправки
             orders_inserted = 0
+            products_count = 0
             batch = []
             product_codes_batch = []
             current_product_id = None
             
-            for index, product in enumerate(products):
+            for product in products:
+                products_count += 1
                 current_product_id = product.id
                 
                 # Проверяем соответствие ссылки маркетплейсу
                 valid_link = None
                 if product.product_link:
                     link_lower = product.product_link.lower()
-                    if account.market.lower() == "wb" and ("wildberries.ru" in link_lower or "wb.ru" in link_lower):
-                        valid_link = product.product_link
-                        logger.debug(f"Используем WB ссылку для товара {product.product_code}: {valid_link}")
-                    elif account.market.lower() == "ozon" and "ozon.ru" in link_lower:
+                    if any(domain in link_lower for domain in valid_domains):
                         valid_link = product.product_link
-                        logger.debug(f"Используем Ozon ссылку для товара {product.product_code}: {valid_link}")
+                        logger.debug(f"Используем {account.market} ссылку для товара {product.product_code}: {valid_link}")
                     else:
                         # Ссылка не соответствует маркетплейсу - не используем её
                         logger.warning(f"Ссылка товара {product.product_code} не соответствует маркетплейсу {account.market}: {product.product_link}")
@@ -90,91 +96,28 @@ class ParserServiceV2:
                 })
                 product_codes_batch.append(product.product_code)
                 
-                # Отправляем батч когда достигли размера или это последний товар
-                if len(batch) == batch_size or index == len(products) - 1:
-                    # Получаем цены из API маркетплейса
-                    if account.market.lower() == "ozon":
-                        account_config = {
-                            'ozon_client_id': account.ozon_client_id,
-                            'ozon_api_key': account.api_key
-                        }
-                        prices = get_initial_market_prices_ozon(product_codes_batch, account_config, test_mode)
-                    elif account.market.lower() == "wb":
-                        account_config = {
-                            'wb_api_key': account.api_key
-                        }
-                        prices = get_initial_market_prices_wb(product_codes_batch, account_config, test_mode)
-                    else:
-                        prices = {}
-                        
-                    # Создаем task_id с ID клиента и буквой маркетплейса для уникальности
-                    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-                    market_letter = "O" if account.market.lower() == "ozon" else "W"
-                    task_id = f"{client_id}{market_letter}{timestamp}"
-                    
-                    # Отправляем в парсер
-                    payload = {
-                        "apikey": client.parser_api_key,
-                        "regionid": account.region,
-                        "market": account.market,
-                        "userlabel": task_id,
-                        "products": batch
-                    }
-                    
-                    logger.info(f"Отправка батча с task_id {task_id}")
-                    logger.debug(f"Send Order Payload: {json.dumps(payload, indent=2)}")
-                    
-                    if test_mode:
-                        logger.info("TEST MODE: Не отправляем запрос в парсинговый сервис.")
-                        response_status = 200
-                        response_text = "TEST MODE: Симулированный ответ"
-                    else:
-                        response = requests.post(f'{self.base_url}/send-order', json=payload, timeout=30)
-                        response_status = response.status_code
-                        response_text = response.text
-                        
-                    if response_status == 200:
-                        logger.info(f"Батч успешно отправлен, task_id: {task_id}")
-                        now = datetime.now()
-                        
-                        # Сохраняем заказ
-                        order = Order(
-                            client_id=client_id,
-                            task_id=task_id,
-                            region=account.region,
-                            market=account.market,
-                            status='pending',
-                            report_url=None,
-                            created_at=now,
-                            updated_at=now
-                        )
-                        session.add(order)
-                        
-                        # Сохраняем результаты с ценами из API маркетплейса
-                        for prod in batch:
-                            market_price = prices.get(str(prod["code"]), 0.0)
-                            result = Result(
-                                client_id=client_id,
-                                task_id=task_id,
-                                product_id=current_product_id,
-                                account_id=account_id,
-                                product_code=prod["code"],
-                                product_name=prod["name"],
-                                product_link=prod["linkset"][0] if prod["linkset"] else None,
-                                market_price=market_price,
-                                showcase_price=None,  # Будет обновлено из отчета парсера
-                                timestamp=now
-                            )
-                            session.add(result)
-                            
+                # Отправляем батч когда достигли размера
+                if len(batch) == batch_size:
+                    if self._send_batch(session, client, account, market, account_config, batch,
+                                        product_codes_batch, current_product_id, test_mode):
                         orders_inserted += 1
-                    else:
-                        logger.error(f"Ошибка отправки батча: {response_text}")
                         
                     # Очищаем батч
                     batch = []
                     product_codes_batch = []
-                    time.sleep(1)  # Пауза между батчами
+                    time.sleep(1)  # Пауза между батчами: task_id уникален с точностью до секунды
+                    
+            # Отправляем оставшийся неполный батч
+            if batch:
+                if self._send_batch(session, client, account, market, account_config, batch,
+                                    product_codes_batch, current_product_id, test_mode):
+                    orders_inserted += 1
+                    
+            if not products_count:
+                logger.error(f"Для клиента {client_id} с аккаунтом {account_id} отсутствуют товары")
+                return False
+                
+            logger.info(f"Обработано {products_count} товаров")
                     
             session.commit()
             session.close()
@@ -186,6 +129,124 @@ class ParserServiceV2:
             logger.exception(f"Ошибка в send_order: {e}")
             return False
             
+    def _send_batch(self, session: Session, client: Client, account: Account, market: str,
+                    account_config: Dict[str, Any], batch: List[Dict[str, Any]],
+                    product_codes_batch: List[str], current_product_id: int, test_mode: bool) -> bool:
+        """
+        Отправка одного батча в парсер и сохранение заказа с результатами
+        """
+        client_id = client.id
+        account_id = account.id
+        
+        # Создаем task_id с ID клиента и буквой маркетплейса для уникальности
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        market_letter = "O" if market == "ozon" else "W"
+        task_id = f"{client_id}{market_letter}{timestamp}"
+        
+        # Отправляем в парсер
+        payload = {
+            "apikey": client.parser_api_key,
+            "regionid": account.region,
+            "market": account.market,
+            "userlabel": task_id,
+            "products": batch
+        }
+        
+        logger.info(f"Отправка батча с task_id {task_id}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Send Order Payload: %s", json.dumps(payload, indent=2))
+        
+        if test_mode:
+            logger.info("TEST MODE: Не отправляем запрос в парсинговый сервис.")
+            prices = self._get_market_prices(market, account_config, product_codes_batch, test_mode)
+            response_status = 200
+            response_text = "TEST MODE: Симулированный ответ"
+        else:
+            # Цены маркетплейса и отправка в парсер не зависят друг от друга - выполняем параллельно
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                prices_future = executor.submit(
+                    self._get_market_prices, market, account_config, product_codes_batch, test_mode
+                )
+                response_future = executor.submit(
+                    self._session.post, f'{self.base_url}/send-order', json=payload, timeout=30
+                )
+                prices = prices_future.result()
+                try:
+                    response = response_future.result()
+                except requests.RequestException as e:
+                    # Сбой одного батча не должен прерывать весь send_order до commit
+                    logger.error(f"Ошибка запроса к парсеру для task_id {task_id}: {e}")
+                    return False
+            response_status = response.status_code
+            response_text = response.text
+            
+        if response_status != 200:
+            logger.error(f"Ошибка отправки батча: {response_text}")
+            return False
+            
+        logger.info(f"Батч успешно отправлен, task_id: {task_id}")
+        now = datetime.now()
+        
+        # Сохраняем заказ
+        order = Order(
+            client_id=client_id,
+            task_id=task_id,
+            region=account.region,
+            market=account.market,
+            status='pending',
+            report_url=None,
+            created_at=now,
+            updated_at=now
+        )
+        session.add(order)
+        
+        # Сохраняем результаты с ценами из API маркетплейса одним bulk INSERT
+        results_rows = [
+            {
+                "client_id": client_id,
+                "task_id": task_id,
+                "product_id": current_product_id,
+                "account_id": account_id,
+                "product_code": prod["code"],
+                "product_name": prod["name"],
+                "product_link": prod["linkset"][0] if prod["linkset"] else None,
+                "market_price": prices.get(str(prod["code"]), 0.0),
+                "showcase_price": None,  # Будет обновлено из отчета парсера
+                "timestamp": now
+            }
+            for prod in batch
+        ]
+        session.execute(insert(Result), results_rows)
+            
+        return True
+            
+    @staticmethod
+    def _build_account_config(account: Account, market: str) -> Dict[str, Any]:
+        """
+        Конфигурация доступа к API маркетплейса для аккаунта
+        """
+        if market == "ozon":
+            return {
+                'ozon_client_id': account.ozon_client_id,
+                'ozon_api_key': account.api_key
+            }
+        elif market == "wb":
+            return {
+                'wb_api_key': account.api_key
+            }
+        return {}
+            
+    def _get_market_prices(self, market: str, account_config: Dict[str, Any], product_codes_batch: List[str],
+                           test_mode: bool) -> Dict[str, float]:
+        """
+        Получение цен из API маркетплейса для батча товаров
+        """
+        if market == "ozon":
+            return get_initial_market_prices_ozon(product_codes_batch, account_config, test_mode)
+        elif market == "wb":
+            return get_initial_market_prices_wb(product_codes_batch, account_config, test_mode)
+        return {}
+            
     def check_reports(self, client_id: str) -> bool:
         """
         Проверка готовности отчётов от парсера
@@ -224,7 +285,8 @@ class ParserServiceV2:
                 return False
                 
             json_response = response.json()
-            logger.debug(f"Ответ API: {json.dumps(json_response, indent=2)}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Ответ API: %s", json.dumps(json_response, indent=2))
             
             # Парсим ответ
             data = None
@@ -236,37 +298,17 @@ class ParserServiceV2:
             if data is None:
                 data = json_response
                 
+            # Индексируем задачи парсера один раз для всех заказов
+            task_index = build_task_index(data)
             updated_orders = 0
             
             for order in orders:
                 task_id = order.task_id
-                found = False
-                report_url = None
-                status = None
-                
-                # Ищем задачу в ответе парсера
-                for task_group in data:
-                    local_task_id = None
-                    local_report_url = None
-                    local_status = None
-                    
-                    if isinstance(task_group, list):
-                        for item in task_group:
-                            if isinstance(item, dict):
-                                if 'userlabel' in item:
-                                    local_task_id = item['userlabel']
-                                elif 'report_json' in item:
-                                    local_report_url = item['report_json']
-                                elif 'status' in item:
-                                    local_status = item['status']
-                                    
-                        if local_task_id == task_id:
-                            found = True
-                            status = local_status
-                            report_url = local_report_url
-                            break
+                order_status = task_index.get(task_id)
+                status = order_status.status if order_status else None
+                report_url = order_status.report_url if order_status else None
                             
-                if found and status == 'completed' and report_url:
+                if order_status and status == 'completed' and report_url:
                     logger.info(f"Задание {task_id} завершено, обрабатываем отчёт")
                     
                     # Скачиваем и обрабатываем отчет
@@ -295,11 +337,7 @@ class ParserServiceV2:
                                 
                                 # Обновляем showcase_price в results
                                 session.execute(
-                                    text("""
-                                        UPDATE results
-                                        SET showcase_price = :price
-                                        WHERE client_id = :client_id AND task_id = :task_id AND product_code = :product_code
-                                    """),
+                                    UPDATE_RESULTS_PRICE_SQL,
                                     {
                                         "price": final_price,
                                         "client_id": client_id,
@@ -5,14 +5,27 @@
 """
 
 import json
+import logging
+import orjson
 import requests
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple, Any
 from dataclasses import dataclass
 from celery.utils.log import get_task_logger
+from sqlalchemy import and_, text
 
 logger = get_task_logger(__name__)
 
+# Значения цены, которые парсер возвращает при ее отсутствии
+INVALID_PRICE_VALUES = frozenset((0, "0", "", None))
+
+# Запрос обновления витринной цены компилируется один раз на процесс
+UPDATE_RESULTS_PRICE_SQL = text("""
+    UPDATE results
+    SET showcase_price = :price
+    WHERE client_id = :client_id AND task_id = :task_id AND product_code = :product_code
+""")
+
 
 @dataclass
 class OrderStatus:
@@ -45,17 +58,19 @@ def validate_client_and_get_orders(session, client_id: str) -> Tuple[Optional[An
     try:
         from db.models import Client, Order
         
-        # Проверяем клиента
-        client = session.query(Client).filter(Client.id == client_id).first()
-        if not client:
+        # Клиент и его pending заказы одним запросом: LEFT JOIN оставляет
+        # строку клиента (с Order = None), даже если заказов нет
+        rows = session.query(Client, Order).outerjoin(
+            Order,
+            and_(Order.client_id == Client.id, Order.status == 'pending')
+        ).filter(Client.id == client_id).all()
+        
+        if not rows:
             logger.error(f"Клиент {client_id} не найден")
             return None, []
         
-        # Получаем pending заказы
-        orders = session.query(Order).filter(
-            Order.client_id == client_id,
-            Order.status == 'pending'
-        ).all()
+        client = rows[0][0]
+        orders = [order for _, order in rows if order is not None]
         
         if not orders:
             logger.info("Нет заданий для проверки")
@@ -91,8 +106,9 @@ def fetch_parser_reports(base_url: str, api_key: str, limit: int = 50) -> Option
             logger.error(f"Ошибка получения статусов заданий: {response.text}")
             return None
         
-        json_response = response.json()
-        logger.debug(f"Ответ API: {json.dumps(json_response, indent=2)}")
+        json_response = orjson.loads(response.content)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Ответ API: %s", json.dumps(json_response, indent=2))
         
         return json_response
         
@@ -126,40 +142,66 @@ def parse_parser_response(json_response: Dict) -> Dict:
     return data
 
 
-def find_order_status(data: Dict, task_id: str) -> OrderStatus:
+def build_task_index(data: Dict) -> Dict[str, OrderStatus]:
     """
-    Находит статус конкретного заказа в данных парсера.
+    Строит индекс статусов заказов по userlabel за один проход по данным парсера.
     
     Args:
-        data: Даные от парсера
-        task_id: ID задачи для поиска
+        data: Данные от парсера
         
     Returns:
-        OrderStatus с информацией о статусе
+        Словарь {task_id: OrderStatus}
     """
-    order_status = OrderStatus(task_id=task_id, status='', report_url=None)
+    task_index = {}
     
     for task_group in data:
+        if not isinstance(task_group, list):
+            continue
+        
         local_task_id = None
         local_report_url = None
         local_status = None
         
-        if isinstance(task_group, list):
-            for item in task_group:
-                if isinstance(item, dict):
-                    if 'userlabel' in item:
-                        local_task_id = item['userlabel']
-                    elif 'report_json' in item:
-                        local_report_url = item['report_json']
-                    elif 'status' in item:
-                        local_status = item['status']
+        for item in task_group:
+            if not isinstance(item, dict):
+                continue
+            
+            # Элемент может содержать сразу несколько полей задачи
+            local_task_id = item.get('userlabel', local_task_id)
+            local_report_url = item.get('report_json', local_report_url)
+            local_status = item.get('status', local_status)
             
-            if local_task_id == task_id:
-                order_status.found = True
-                order_status.status = local_status or ''
-                order_status.report_url = local_report_url
+            if local_task_id is not None and local_report_url is not None and local_status is not None:
                 break
+        
+        # Первое вхождение задачи имеет приоритет, как и при линейном поиске
+        if local_task_id is not None and local_task_id not in task_index:
+            task_index[local_task_id] = OrderStatus(
+                task_id=local_task_id,
+                status=local_status or '',
+                report_url=local_report_url,
+                found=True
+            )
     
+    return task_index
+
+
+def find_order_status(data: Dict, task_id: str) -> OrderStatus:
+    """
+    Находит статус конкретного заказа в данных парсера.
+    
+    Для обработки нескольких заказов используйте build_task_index.
+    
+    Args:
+        data: Даные от парсера
+        task_id: ID задачи для поиска
+        
+    Returns:
+        OrderStatus с информацией о статусе
+    """
+    order_status = build_task_index(data).get(task_id)
+    if order_status is None:
+        return OrderStatus(task_id=task_id, status='', report_url=None)
     return order_status
 
 
@@ -176,7 +218,7 @@ def download_and_parse_report(report_url: str) -> Optional[Dict]:
     try:
         response = requests.get(report_url, timeout=30)
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
     except Exception as e:
         logger.error(f"Ошибка скачивания или парсинга JSON: {e}")
         return None
@@ -229,24 +271,29 @@ def calculate_final_price(offer: Dict[str, Any]) -> Optional[float]:
     Returns:
         Итоговая цена или None если цена недоступна
     """
-    promo_price = offer.get("PromoPrice", "")
-    regular_price = offer.get("Price", "")
-    
-    # Проверяем промо цену
-    if promo_price not in [0, "0", "", None]:
-        try:
-            return float(promo_price)
-        except (ValueError, TypeError):
-            pass
+    promo_price = parse_price(offer.get("PromoPrice"))
+    if promo_price is not None:
+        return promo_price
     
-    # Проверяем обычную цену
-    if regular_price not in [0, "0", "", None]:
-        try:
-            return float(regular_price)
-        except (ValueError, TypeError):
-            pass
+    return parse_price(offer.get("Price"))
+
+
+def parse_price(value: Any) -> Optional[float]:
+    """
+    Преобразует цену из предложения в float.
     
-    return None
+    Args:
+        value: Значение цены из отчета парсера
+        
+    Returns:
+        Цена или None если значение пустое или некорректное
+    """
+    try:
+        if value in INVALID_PRICE_VALUES:
+            return None
+        return float(value)
+    except (ValueError, TypeError):
+        return None
 
 
 def update_results_prices(session, client_id: str, task_id: str, report_items: List[ReportItem]) -> int:
@@ -261,33 +308,33 @@ def update_results_prices(session, client_id: str, task_id: str, report_items: L
         
     Returns:
         Количество обновленных записей
+        
+    Raises:
+        Exception: Ошибка UPDATE пробрасывается, чтобы заказ не считался обработанным
+        и его SAVEPOINT был откачен
     """
+    if not report_items:
+        return 0
+    
     try:
-        from sqlalchemy import text
-        
-        updated_count = 0
-        
-        for item in report_items:
-            result = session.execute(
-                text("""
-                    UPDATE results
-                    SET showcase_price = :price
-                    WHERE client_id = :client_id AND task_id = :task_id AND product_code = :product_code
-                """),
+        # Один executemany вместо UPDATE на каждый товар; rowcount - сумма по всем строкам
+        result = session.execute(
+            UPDATE_RESULTS_PRICE_SQL,
+            [
                 {
                     "price": item.final_price,
                     "client_id": client_id,
                     "task_id": task_id,
                     "product_code": item.product_code
                 }
-            )
-            updated_count += result.rowcount
-        
-        return updated_count
+                for item in report_items
+            ]
+        )
+        return result.rowcount
         
     except Exception as e:
         logger.error(f"Ошибка обновления цен: {e}")
-        return 0
+        raise
 
 
 def update_order_status(session, order, report_url: str) -> None:
@@ -341,6 +388,8 @@ def check_reports_refactored(base_url: str, client_id: str) -> bool:
     """
     logger.info(f"Запуск проверки готовности отчётов для клиента {client_id}")
     
+    session = None
+    
     try:
         from db.session import get_sync_session
         session = get_sync_session()
@@ -358,24 +407,23 @@ def check_reports_refactored(base_url: str, client_id: str) -> bool:
         if not json_response:
             return False
         
-        # 3. Парсинг ответа (CC: 1)
+        # 3. Парсинг ответа и построение индекса задач (CC: 1)
         data = parse_parser_response(json_response)
+        task_index = build_task_index(data)
         
         updated_orders = 0
         
         # 4. Обработка каждого заказа (CC: 1)
         for order in orders:
-            order_status = find_order_status(data, order.task_id)
+            order_status = task_index.get(order.task_id)
             
-            # 5. Обработка завершенного заказа (CC: 1)
-            if order_status.found and order_status.status == 'completed' and order_status.report_url:
-                success = process_completed_order(session, client_id, order, order_status.report_url)
-                if success:
+            # 5. Обработка завершенного заказа в отдельном SAVEPOINT (CC: 1)
+            if order_status and order_status.status == 'completed' and order_status.report_url:
+                if process_order_in_savepoint(session, client_id, order, order_status.report_url):
                     updated_orders += 1
         
         # 6. Сохранение изменений (CC: 1)
         session.commit()
-        session.close()
         
         logger.info(f"Проверка завершена, обновлено заданий: {updated_orders}")
         return updated_orders > 0
@@ -383,6 +431,11 @@ def check_reports_refactored(base_url: str, client_id: str) -> bool:
     except Exception as e:
         logger.exception(f"Ошибка в check_reports: {e}")
         return False
+    
+    finally:
+        # close() откатывает незафиксированную транзакцию, если commit не дошел
+        if session is not None:
+            session.close()
 
 
 def process_completed_order(session, client_id: str, order, report_url: str) -> bool:
@@ -426,4 +479,34 @@ def process_completed_order(session, client_id: str, order, report_url: str) ->
         
     except Exception as e:
         logger.error(f"Ошибка обработки заказа {order.task_id}: {e}")
-        return False 
\ No newline at end of file
+        return False 
+
+
+def process_order_in_savepoint(session, client_id: str, order, report_url: str) -> bool:
+    """
+    Обрабатывает завершенный заказ внутри SAVEPOINT.
+    
+    При неуспешной обработке откатываются только изменения этого заказа,
+    успешно обработанные заказы сохраняются общим commit. Ошибка при
+    RELEASE SAVEPOINT тоже откатывает только этот SAVEPOINT.
+    
+    Args:
+        session: Сессия БД
+        client_id: ID клиента
+        order: Объект заказа
+        report_url: URL отчета
+        
+    Returns:
+        True если обработка успешна
+    """
+    try:
+        # Выход из блока без исключения делает RELEASE, исключение - ROLLBACK TO SAVEPOINT
+        with session.begin_nested() as savepoint:
+            success = process_completed_order(session, client_id, order, report_url)
+            if not success:
+                savepoint.rollback()
+    except Exception as e:
+        logger.error(f"Ошибка обработки заказа {order.task_id}: {e}")
+        return False
+    
+    return success
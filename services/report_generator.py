@@ -3,10 +3,16 @@
 Разбит на отдельные функции согласно принципу Single Responsibility.
 """
 
-import io
+import os
+import tempfile
+from collections import namedtuple
 from datetime import datetime, timedelta, date
-from typing import List, Dict, Optional, Tuple, Any
+from typing import List, Dict, Optional, Tuple, Any, BinaryIO
 from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+import orjson
 
 try:
     import xlsxwriter
@@ -14,19 +20,111 @@ except ImportError:
     xlsxwriter = None
 
 try:
-    from db.models import Client, Result
-    from sqlalchemy import text
+    import pyexcelerate
+except ImportError:
+    pyexcelerate = None
+
+try:
+    from db.models import Client, Order, Result
+    from sqlalchemy import func, select, text
     from sqlalchemy.orm import Session
 except ImportError:
     # Для случаев когда модуль импортируется без полного контекста
     pass
 
 
+# Размер пачки строк при потоковом чтении результатов из БД
+REPORT_FETCH_BATCH_SIZE = 1000
+
+# Готовый файл отчета держится в памяти до этого размера, больший уходит во временный файл
+REPORT_SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+# Срезы отчета кэшируются в Redis: повторные нажатия кнопки отчета не сканируют results
+REPORT_CACHE_TTL = 3600  # 1 час
+
+# Поля строки текущего среза, которые использует write_excel_data
+REPORT_ROW_FIELDS = (
+    "product_code", "product_name", "product_link",
+    "market_price", "showcase_price", "timestamp", "market"
+)
+ReportRow = namedtuple("ReportRow", REPORT_ROW_FIELDS)
+
+# Движок записи Excel: xlsxwriter (рамки у ячеек) или pyexcelerate (быстрее на больших
+# отчетах, только форматы столбцов без рамок)
+REPORT_EXCEL_BACKEND = os.getenv("REPORT_EXCEL_BACKEND", "xlsxwriter")
+
+# Отображаемые названия маркетплейсов в столбце "Маркетплейс"
+MARKET_DISPLAY_NAMES = {"ozon": "Ozon", "wb": "Wildberries"}
+
+# Ссылки с этими префиксами пишутся в Excel кликабельными гиперссылками
+HYPERLINK_PREFIXES = ("http://", "https://")
+
+# Предел длины адреса в формуле HYPERLINK; более длинные ссылки pyexcelerate пишет текстом
+HYPERLINK_FORMULA_MAX_LENGTH = 255
+
+# Заголовки и ширины столбцов отчета; столбец "Маркетплейс" есть только без фильтра
+REPORT_HEADERS_FILTERED = (
+    "Артикул", "Название", "Ссылка", "Цена маркетплейса",
+    "Цена на витрине", "Размер скидки (%)", "Время замера",
+    "Цена на витрине прошл", "Размер скидки (%) прошл", "Время замера прошл"
+)
+REPORT_HEADERS_ALL = REPORT_HEADERS_FILTERED + ("Маркетплейс",)
+
+COLUMN_WIDTHS_FILTERED = (15, 40, 30, 20, 20, 15, 20, 20, 18, 20)
+COLUMN_WIDTHS_ALL = COLUMN_WIDTHS_FILTERED + (15,)
+
+# Описания форматов ячеек; объекты Format привязаны к workbook и создаются на каждый файл
+EXCEL_FORMAT_SPECS = {
+    'header': {
+        'bold': True,
+        'bg_color': '#D3D3D3',
+        'border': 1,
+        'text_wrap': True,
+        'align': 'center'
+    },
+    'data': {'border': 1},
+    'percent': {'border': 1, 'num_format': '0.00%'},
+    'price': {'border': 1, 'num_format': '#,##0.00'},
+    'date': {'border': 1, 'num_format': 'dd.mm.yyyy hh:mm'}
+}
+
+# Формат данных каждого столбца отчета (ключи EXCEL_FORMAT_SPECS) для движка pyexcelerate
+REPORT_COLUMN_FORMATS = (
+    'data', 'data', 'data', 'price', 'price', 'percent', 'date',
+    'price', 'percent', 'date', 'data'
+)
+
+
+# Предыдущий замер товара: (showcase_price, market_price, timestamp).
+# Кортеж вместо словаря: меньше памяти на запись и без поиска по ключам
+PreviousResult = Tuple[Optional[float], Optional[float], datetime]
+
+
+@dataclass(frozen=True)
+class ReportTemplate:
+    """Неизменяемая разметка листа отчета для конкретного фильтра маркетплейса."""
+    sheet_name: str
+    headers: Tuple[str, ...]
+    column_widths: Tuple[int, ...]
+
+
+# Фильтр маркетплейса принимает всего три значения, поэтому разметка листа
+# вычисляется один раз при импорте, а не при каждой генерации файла
+REPORT_TEMPLATES = {
+    None: ReportTemplate("Отчет", REPORT_HEADERS_ALL, COLUMN_WIDTHS_ALL),
+    "ozon": ReportTemplate("Отчет_Ozon", REPORT_HEADERS_FILTERED, COLUMN_WIDTHS_FILTERED),
+    "wb": ReportTemplate("Отчет_WB", REPORT_HEADERS_FILTERED, COLUMN_WIDTHS_FILTERED),
+}
+
+# Разметка для неизвестного значения фильтра: без столбца "Маркетплейс"
+DEFAULT_FILTERED_TEMPLATE = ReportTemplate("Отчет", REPORT_HEADERS_FILTERED, COLUMN_WIDTHS_FILTERED)
+
+
 @dataclass
 class ReportData:
     """Данные для генерации отчета."""
     current_results: List[Any]
-    previous_data: Dict[str, Dict[str, Any]]
+    previous_data: Dict[str, PreviousResult]
     client: Client
     date: datetime.date
     marketplace: Optional[str]
@@ -53,8 +151,8 @@ def validate_report_params(client_id: str, date_str: str, session) -> Tuple[Opti
     Returns:
         Tuple[Client, date] или (None, None) при ошибке
     """
-    # Проверяем клиента
-    client = session.query(Client).filter(Client.id == client_id).first()
+    # Проверяем клиента (session.get сначала смотрит в identity map)
+    client = session.get(Client, client_id)
     if not client or not client.group_chat_id:
         return None, None
     
@@ -66,9 +164,66 @@ def validate_report_params(client_id: str, date_str: str, session) -> Tuple[Opti
         return None, None
 
 
-def fetch_current_results(session: Session, client_id: str, date: datetime.date, marketplace: Optional[str]) -> List[Any]:
+@lru_cache(maxsize=2)
+def get_report_results_statement(by_marketplace: bool) -> Any:
     """
-    Получает текущие результаты за указанную дату.
+    Возвращает запрос текущего и предыдущего срезов отчета.
+    
+    Вариантов всего два (с фильтром по маркетплейсу и без), поэтому
+    text() с execution_options создается один раз на процесс.
+    
+    Args:
+        by_marketplace: Фильтровать ли по a.market = :marketplace
+        
+    Returns:
+        TextClause с yield_per=REPORT_FETCH_BATCH_SIZE
+    """
+    market_filter = " AND a.market = :marketplace" if by_marketplace else ""
+    
+    sql = f"""
+        WITH scoped AS (
+            SELECT r.product_code, r.product_name, r.product_link,
+                r.market_price, r.showcase_price, r.timestamp,
+                a.market
+            FROM results r
+            JOIN accounts a ON r.account_id = a.id
+            WHERE r.client_id = :client_id
+                AND r.timestamp < :date_end{market_filter}
+        ),
+        current_rows AS (
+            SELECT DISTINCT ON (product_code) *
+            FROM scoped
+            WHERE timestamp >= :date_start
+            ORDER BY product_code, timestamp DESC
+        ),
+        previous_rows AS (
+            SELECT DISTINCT ON (product_code) *
+            FROM scoped
+            WHERE timestamp < (SELECT max(timestamp) FROM current_rows)
+                AND product_code IN (SELECT product_code FROM current_rows)
+            ORDER BY product_code, timestamp DESC
+        )
+        SELECT *, false AS is_previous FROM current_rows
+        UNION ALL
+        SELECT *, true AS is_previous FROM previous_rows
+        ORDER BY is_previous, product_code
+    """
+    
+    # yield_per включает серверный курсор: строки приходят пачками, и полный
+    # результат не буферизуется драйвером рядом со списком и словарем в fetch_report_results
+    return text(sql).execution_options(yield_per=REPORT_FETCH_BATCH_SIZE)
+
+
+def fetch_report_results(session: Session, client_id: str, date: datetime.date,
+                         marketplace: Optional[str]) -> Tuple[List[Any], Dict[str, PreviousResult]]:
+    """
+    Получает текущие и предыдущие результаты одним запросом.
+    
+    Текущий срез - последняя запись по каждому товару за указанную дату,
+    предыдущий - последняя запись раньше времени текущего среза.
+    Оба среза строятся из одного CTE, поэтому таблица results
+    сканируется один раз за один round-trip. Предыдущий срез ограничен
+    товарами текущего: снятые с продажи артикулы в отчет не попадают.
     
     Args:
         session: Сессия БД
@@ -77,20 +232,8 @@ def fetch_current_results(session: Session, client_id: str, date: datetime.date,
         marketplace: Фильтр по маркетплейсу (ozon/wb) или None
         
     Returns:
-        Список результатов
-    """
-    base_sql = """
-        SELECT DISTINCT ON (r.product_code) 
-            r.product_code, r.product_name, r.product_link, 
-            r.market_price, r.showcase_price, r.timestamp,
-            a.market
-        FROM results r
-        JOIN accounts a ON r.account_id = a.id
-        WHERE r.client_id = :client_id 
-            AND r.timestamp >= :date_start 
-            AND r.timestamp < :date_end
+        Tuple[текущие результаты, {product_code: (showcase_price, market_price, timestamp)}]
     """
-    
     params = {
         "client_id": client_id,
         "date_start": date,
@@ -98,72 +241,110 @@ def fetch_current_results(session: Session, client_id: str, date: datetime.date,
     }
     
     if marketplace:
-        base_sql += " AND a.market = :marketplace"
         params["marketplace"] = marketplace
     
-    base_sql += " ORDER BY r.product_code, r.timestamp DESC"
+    current_results = []
+    previous_data = {}
+    statement = get_report_results_statement(bool(marketplace))
+    for r in session.execute(statement, params):
+        if r.is_previous:
+            previous_data[r.product_code] = (r.showcase_price, r.market_price, r.timestamp)
+        else:
+            current_results.append(r)
     
-    return session.execute(text(base_sql), params).fetchall()
+    return current_results, previous_data
 
 
-def fetch_previous_results(session: Session, client_id: str, current_timestamp: datetime, marketplace: Optional[str]) -> Dict[str, Dict[str, Any]]:
+def get_report_cache_key(session: Session, client_id: str, date: datetime.date,
+                         marketplace: Optional[str]) -> str:
     """
-    Получает предыдущие результаты для сравнения.
+    Строит ключ Redis для срезов отчета.
+    
+    Результаты клиента меняются только вместе с его заказами (создание заказа
+    добавляет строки results, обработка отчета парсера обновляет цены и
+    updated_at заказа), поэтому max(orders.updated_at) служит версией данных:
+    после любого изменения ключ меняется, а старые записи истекают по TTL.
     
     Args:
         session: Сессия БД
         client_id: ID клиента
-        current_timestamp: Время текущего среза
-        marketplace: Фильтр по маркетплейсу или None
+        date: Дата отчета
+        marketplace: Фильтр по маркетплейсу (ozon/wb) или None
         
     Returns:
-        Словарь {product_code: {showcase_price, market_price, timestamp}}
+        Ключ Redis
     """
-    prev_sql = """
-        SELECT DISTINCT ON (r.product_code) 
-            r.product_code, r.product_name, r.product_link, 
-            r.market_price, r.showcase_price, r.timestamp,
-            a.market
-        FROM results r
-        JOIN accounts a ON r.account_id = a.id
-        WHERE r.client_id = :client_id 
-            AND r.timestamp < :current_timestamp
+    data_version = session.execute(
+        select(func.max(Order.updated_at)).where(Order.client_id == client_id)
+    ).scalar()
+    version = data_version.isoformat() if data_version else "none"
+    return f"report_results:{client_id}:{date.isoformat()}:{marketplace or 'all'}:{version}"
+
+
+def serialize_report_results(current_results: List[Any], previous_data: Dict[str, PreviousResult]) -> bytes:
     """
+    Сериализует срезы отчета для кэша (orjson, Decimal -> float).
     
-    prev_params = {
-        "client_id": client_id,
-        "current_timestamp": current_timestamp
-    }
-    
-    if marketplace:
-        prev_sql += " AND a.market = :marketplace"
-        prev_params["marketplace"] = marketplace
-    
-    prev_sql += " ORDER BY r.product_code, r.timestamp DESC"
+    Args:
+        current_results: Текущие результаты
+        previous_data: Предыдущие данные
+        
+    Returns:
+        JSON в байтах
+    """
+    return orjson.dumps({
+        "current": [[getattr(r, field) for field in REPORT_ROW_FIELDS] for r in current_results],
+        "previous": previous_data
+    }, default=float)
+
+
+def deserialize_report_results(payload: bytes) -> Tuple[List[ReportRow], Dict[str, PreviousResult]]:
+    """
+    Восстанавливает срезы отчета из кэша.
     
-    previous_results = session.execute(text(prev_sql), prev_params).fetchall()
+    Args:
+        payload: JSON из serialize_report_results
+        
+    Returns:
+        Tuple[текущие результаты, предыдущие данные]
+    """
+    data = orjson.loads(payload)
+    current_results = [
+        ReportRow._make(row)._replace(timestamp=datetime.fromisoformat(row[5]))
+        for row in data["current"]
+    ]
+    previous_data = {
+        code: (showcase_price, market_price, datetime.fromisoformat(timestamp))
+        for code, (showcase_price, market_price, timestamp) in data["previous"].items()
+    }
+    return current_results, previous_data
+
+
+def create_excel_output() -> BinaryIO:
+    """
+    Создает файл для готового Excel отчета.
     
-    # Создаем словарь для быстрого поиска
-    previous_data = {}
-    for r in previous_results:
-        previous_data[r.product_code] = {
-            'showcase_price': r.showcase_price,
-            'market_price': r.market_price,
-            'timestamp': r.timestamp
-        }
+    До REPORT_SPOOL_MAX_SIZE файл лежит в памяти, затем переносится на диск.
     
-    return previous_data
+    Returns:
+        Временный файл (SpooledTemporaryFile)
+    """
+    return tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_MAX_SIZE)
 
 
-def create_excel_workbook() -> Tuple[xlsxwriter.Workbook, io.BytesIO]:
+def create_excel_workbook() -> Tuple[xlsxwriter.Workbook, BinaryIO]:
     """
-    Создает Excel workbook в памяти.
+    Создает Excel workbook в режиме constant_memory.
+    
+    Строки сбрасываются во временный файл по мере записи, поэтому
+    данные нужно писать строго сверху вниз. Опцию in_memory не включаем:
+    xlsxwriter при ней отключает constant_memory.
     
     Returns:
         Tuple[workbook, output_buffer]
     """
-    output = io.BytesIO()
-    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+    output = create_excel_output()
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
     return workbook, output
 
 
@@ -177,41 +358,35 @@ def setup_excel_formats(workbook: xlsxwriter.Workbook) -> Dict[str, Any]:
     Returns:
         Словарь с форматами
     """
-    return {
-        'header': workbook.add_format({
-            'bold': True,
-            'bg_color': '#D3D3D3',
-            'border': 1,
-            'text_wrap': True,
-            'align': 'center'
-        }),
-        'data': workbook.add_format({'border': 1}),
-        'percent': workbook.add_format({'border': 1, 'num_format': '0.00%'}),
-        'price': workbook.add_format({'border': 1, 'num_format': '#,##0.00'}),
-        'date': workbook.add_format({'border': 1, 'num_format': 'dd.mm.yyyy hh:mm'})
-    }
+    return {name: workbook.add_format(spec) for name, spec in EXCEL_FORMAT_SPECS.items()}
 
 
-def get_report_headers(marketplace: Optional[str]) -> List[str]:
+def get_report_template(marketplace: Optional[str]) -> ReportTemplate:
     """
-    Возвращает заголовки для отчета в зависимости от фильтра маркетплейса.
+    Возвращает заранее построенную разметку листа для фильтра маркетплейса.
     
     Args:
         marketplace: Фильтр по маркетплейсу или None
         
     Returns:
-        Список заголовков
+        Разметка листа отчета
     """
-    base_headers = [
-        "Артикул", "Название", "Ссылка", "Цена маркетплейса", 
-        "Цена на витрине", "Размер скидки (%)", "Время замера",
-        "Цена на витрине прошл", "Размер скидки (%) прошл", "Время замера прошл"
-    ]
-    
     if not marketplace:
-        base_headers.append("Маркетплейс")
+        return REPORT_TEMPLATES[None]
+    return REPORT_TEMPLATES.get(marketplace, DEFAULT_FILTERED_TEMPLATE)
+
+
+def get_report_headers(marketplace: Optional[str]) -> Tuple[str, ...]:
+    """
+    Возвращает заголовки для отчета в зависимости от фильтра маркетплейса.
     
-    return base_headers
+    Args:
+        marketplace: Фильтр по маркетплейсу или None
+        
+    Returns:
+        Кортеж заголовков
+    """
+    return get_report_template(marketplace).headers
 
 
 def calculate_discount_percent(market_price: Optional[float], showcase_price: Optional[float]) -> float:
@@ -231,8 +406,90 @@ def calculate_discount_percent(market_price: Optional[float], showcase_price: Op
     return (market_price - showcase_price) / market_price
 
 
+def calculate_discount_percents(market_prices: np.ndarray, showcase_prices: np.ndarray) -> np.ndarray:
+    """
+    Векторно вычисляет проценты скидки (логика calculate_discount_percent).
+    
+    Args:
+        market_prices: Цены маркетплейса (0 - нет цены)
+        showcase_prices: Цены на витрине (0 - нет цены)
+        
+    Returns:
+        Массив процентов скидки (0.0 - 1.0)
+    """
+    valid = (market_prices > 0) & (showcase_prices != 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        discounts = (market_prices - showcase_prices) / market_prices
+    return np.where(valid, discounts, 0.0)
+
+
+def calculate_report_stats(current_discounts: np.ndarray, previous_discounts: np.ndarray,
+                           has_previous: np.ndarray) -> ReportStats:
+    """
+    Считает статистику изменений скидок по массивам.
+    
+    Args:
+        current_discounts: Текущие проценты скидки
+        previous_discounts: Предыдущие проценты скидки
+        has_previous: Маска товаров, у которых есть предыдущий замер
+        
+    Returns:
+        Статистика изменений
+    """
+    current_rounded = np.round(current_discounts, 2)
+    previous_rounded = np.round(previous_discounts, 2)
+    
+    increased = int(np.count_nonzero((current_rounded > previous_rounded) & has_previous))
+    decreased = int(np.count_nonzero((current_rounded < previous_rounded) & has_previous))
+    compared = int(np.count_nonzero(has_previous))
+    
+    return ReportStats(
+        increased=increased,
+        decreased=decreased,
+        unchanged=compared - increased - decreased,
+        new_products=len(has_previous) - compared
+    )
+
+
+def compute_report_columns(current_results: List[Any], previous_data: Dict[str, PreviousResult]) -> Tuple:
+    """
+    Собирает числовые столбцы отчета и статистику изменений.
+    Общая часть для движков записи xlsxwriter и pyexcelerate.
+    
+    Args:
+        current_results: Текущие результаты
+        previous_data: Предыдущие данные
+        
+    Returns:
+        Tuple[предыдущие замеры по строкам, цены маркетплейса, цены на витрине, текущие скидки,
+              прошлые цены на витрине, прошлые скидки, статистика]
+    """
+    # Предыдущие замеры в порядке текущих строк
+    get_previous = previous_data.get
+    previous_rows = [get_previous(r.product_code) for r in current_results]
+    count = len(current_results)
+    
+    # Скидки и статистика считаются векторно, без цикла по строкам
+    market_prices = np.fromiter((r.market_price or 0 for r in current_results), dtype=np.float64, count=count)
+    showcase_prices = np.fromiter((r.showcase_price or 0 for r in current_results), dtype=np.float64, count=count)
+    prev_market_prices = np.fromiter(
+        ((p[1] or 0) if p else 0 for p in previous_rows), dtype=np.float64, count=count
+    )
+    prev_showcase_prices = np.fromiter(
+        ((p[0] or 0) if p else 0 for p in previous_rows), dtype=np.float64, count=count
+    )
+    has_previous = np.fromiter((bool(p) for p in previous_rows), dtype=bool, count=count)
+    
+    current_discounts = calculate_discount_percents(market_prices, showcase_prices)
+    previous_discounts = calculate_discount_percents(prev_market_prices, prev_showcase_prices)
+    stats = calculate_report_stats(current_discounts, previous_discounts, has_previous)
+    
+    return (previous_rows, market_prices, showcase_prices, current_discounts,
+            prev_showcase_prices, previous_discounts, stats)
+
+
 def write_excel_data(worksheet: Any, current_results: List[Any], 
-                    previous_data: Dict[str, Dict[str, Any]], formats: Dict[str, Any],
+                    previous_data: Dict[str, PreviousResult], formats: Dict[str, Any],
                     marketplace: Optional[str]) -> ReportStats:
     """
     Записывает данные в Excel worksheet и собирает статистику.
@@ -247,56 +504,59 @@ def write_excel_data(worksheet: Any, current_results: List[Any],
     Returns:
         Статистика изменений
     """
-    stats = ReportStats()
-    
-    for row, r in enumerate(current_results, start=1):
+    (previous_rows, market_prices, showcase_prices, current_discounts,
+     prev_showcase_prices, previous_discounts, stats) = compute_report_columns(current_results, previous_data)
+    
+    # Типизированные методы записи: обходим диспетчеризацию worksheet.write()
+    write_string = worksheet.write_string
+    write_url = worksheet.write_url
+    write_number = worksheet.write_number
+    write_datetime = worksheet.write_datetime
+    write_blank = worksheet.write_blank
+    
+    # Форматы и справочники связываем с локальными переменными один раз до цикла
+    fmt_data = formats['data']
+    fmt_price = formats['price']
+    fmt_percent = formats['percent']
+    fmt_date = formats['date']
+    get_market_display = MARKET_DISPLAY_NAMES.get
+    
+    # Числовые столбцы пишутся из уже собранных float-массивов: без обращения
+    # к атрибутам строки, подстановки "or 0" и Decimal в цикле
+    rows = zip(
+        current_results, previous_rows,
+        market_prices.tolist(), showcase_prices.tolist(), current_discounts.tolist(),
+        prev_showcase_prices.tolist(), previous_discounts.tolist()
+    )
+    for row, (r, prev_data, market_price, showcase_price, current_discount,
+              prev_showcase_price, prev_discount) in enumerate(rows, start=1):
         # Основные данные товара
-        worksheet.write(row, 0, r.product_code, formats['data'])
-        worksheet.write(row, 1, r.product_name, formats['data'])
-        worksheet.write(row, 2, r.product_link or "", formats['data'])
-        worksheet.write(row, 3, r.market_price or 0, formats['price'])
-        worksheet.write(row, 4, r.showcase_price or 0, formats['price'])
-        
-        # Текущий размер скидки
-        current_discount = calculate_discount_percent(r.market_price, r.showcase_price)
-        worksheet.write(row, 5, current_discount, formats['percent'])
-        worksheet.write(row, 6, r.timestamp, formats['date'])
+        write_string(row, 0, r.product_code, fmt_data)
+        write_string(row, 1, r.product_name, fmt_data)
+        # Ссылка - гиперссылкой, как делал worksheet.write(); если xlsxwriter ее
+        # не принял (длиннее 2079 символов, больше 65530 на лист) - обычным текстом
+        link = r.product_link or ""
+        if not (link.startswith(HYPERLINK_PREFIXES) and write_url(row, 2, link, fmt_data) == 0):
+            write_string(row, 2, link, fmt_data)
+        write_number(row, 3, market_price, fmt_price)
+        write_number(row, 4, showcase_price, fmt_price)
+        write_number(row, 5, current_discount, fmt_percent)
+        write_datetime(row, 6, r.timestamp, fmt_date)
 
         # Предыдущие данные
-        prev_data = previous_data.get(r.product_code)
         if prev_data:
-            prev_showcase_price = prev_data['showcase_price'] or 0
-            prev_market_price = prev_data['market_price'] or 0
-            prev_timestamp = prev_data['timestamp']
-            
-            worksheet.write(row, 7, prev_showcase_price, formats['price'])
-            
-            # Предыдущий размер скидки
-            prev_discount = calculate_discount_percent(prev_market_price, prev_showcase_price)
-            worksheet.write(row, 8, prev_discount, formats['percent'])
-            worksheet.write(row, 9, prev_timestamp, formats['date'])
-
-            # Обновляем статистику
-            current_discount_rounded = round(current_discount, 2)
-            prev_discount_rounded = round(prev_discount, 2)
-            
-            if current_discount_rounded > prev_discount_rounded:
-                stats.increased += 1
-            elif current_discount_rounded < prev_discount_rounded:
-                stats.decreased += 1
-            else:
-                stats.unchanged += 1
+            write_number(row, 7, prev_showcase_price, fmt_price)
+            write_number(row, 8, prev_discount, fmt_percent)
+            write_datetime(row, 9, prev_data[2], fmt_date)
         else:
             # Новый товар
-            worksheet.write(row, 7, "", formats['data'])
-            worksheet.write(row, 8, "", formats['data'])
-            worksheet.write(row, 9, "", formats['data'])
-            stats.new_products += 1
+            write_blank(row, 7, None, fmt_data)
+            write_blank(row, 8, None, fmt_data)
+            write_blank(row, 9, None, fmt_data)
 
         # Маркетплейс (если не фильтруем)
         if not marketplace:
-            market_display = "Ozon" if r.market == "ozon" else "Wildberries"
-            worksheet.write(row, 10, market_display, formats['data'])
+            write_string(row, 10, get_market_display(r.market, "Wildberries"), fmt_data)
     
     return stats
 
@@ -309,44 +569,117 @@ def setup_column_widths(worksheet: Any, marketplace: Optional[str]) -> None:
         worksheet: Excel worksheet
         marketplace: Фильтр по маркетплейсу
     """
-    if marketplace:
-        column_widths = [15, 40, 30, 20, 20, 15, 20, 20, 18, 20]
-    else:
-        column_widths = [15, 40, 30, 20, 20, 15, 20, 20, 18, 20, 15]
-    
-    for col, width in enumerate(column_widths):
+    for col, width in enumerate(get_report_template(marketplace).column_widths):
         worksheet.set_column(col, col, width)
 
 
-def generate_excel_file(report_data: ReportData) -> Tuple[io.BytesIO, ReportStats]:
+def excel_hyperlink_formula(link: str) -> str:
+    """
+    Возвращает ссылку для pyexcelerate в виде формулы HYPERLINK.
+    
+    У pyexcelerate нет гиперссылок ячеек, поэтому кликабельность дает формула.
+    Пустые значения, не-URL и ссылки длиннее HYPERLINK_FORMULA_MAX_LENGTH
+    (предел аргумента HYPERLINK в Excel) остаются обычным текстом.
+    
+    Args:
+        link: Ссылка на товар
+        
+    Returns:
+        Формула =HYPERLINK("...") или исходная строка
+    """
+    if not link.startswith(HYPERLINK_PREFIXES) or len(link) > HYPERLINK_FORMULA_MAX_LENGTH:
+        return link
+    escaped = link.replace('"', '""')
+    return f'=HYPERLINK("{escaped}")'
+
+
+def generate_excel_file_pyexcelerate(report_data: ReportData) -> Tuple[BinaryIO, ReportStats]:
+    """
+    Генерирует Excel файл через pyexcelerate.
+    
+    Лист собирается из списка строк одним вызовом, без объекта на каждую ячейку.
+    Форматы чисел и дат задаются на столбец, рамок у ячеек нет. Ссылки
+    пишутся формулой HYPERLINK (см. excel_hyperlink_formula), а не
+    гиперссылкой ячейки, как в xlsxwriter.
+    
+    Args:
+        report_data: Данные для отчета
+        
+    Returns:
+        Tuple[excel_buffer, stats]
+    """
+    current_results = report_data.current_results
+    template = get_report_template(report_data.marketplace)
+    (previous_rows, market_prices, showcase_prices, current_discounts,
+     prev_showcase_prices, previous_discounts, stats) = compute_report_columns(
+        current_results, report_data.previous_data
+    )
+    
+    get_market_display = MARKET_DISPLAY_NAMES.get
+    hyperlink = excel_hyperlink_formula
+    with_market = not report_data.marketplace
+    rows = [list(template.headers)]
+    for r, prev_data, market_price, showcase_price, current_discount, prev_showcase_price, prev_discount in zip(
+        current_results, previous_rows,
+        market_prices.tolist(), showcase_prices.tolist(), current_discounts.tolist(),
+        prev_showcase_prices.tolist(), previous_discounts.tolist()
+    ):
+        row = [r.product_code, r.product_name, hyperlink(r.product_link or ""),
+               market_price, showcase_price, current_discount, r.timestamp]
+        if prev_data:
+            row += [prev_showcase_price, prev_discount, prev_data[2]]
+        else:
+            row += [None, None, None]
+        if with_market:
+            row.append(get_market_display(r.market, "Wildberries"))
+        rows.append(row)
+    
+    workbook = pyexcelerate.Workbook()
+    worksheet = workbook.new_sheet(template.sheet_name, data=rows)
+    for col, width in enumerate(template.column_widths, start=1):
+        num_format = EXCEL_FORMAT_SPECS[REPORT_COLUMN_FORMATS[col - 1]].get('num_format')
+        worksheet.set_col_style(col, pyexcelerate.Style(
+            size=width, format=pyexcelerate.Format(num_format) if num_format else None
+        ))
+    worksheet.set_row_style(1, pyexcelerate.Style(font=pyexcelerate.Font(bold=True)))
+    
+    output = create_excel_output()
+    workbook.save(output)
+    output.seek(0)
+    
+    return output, stats
+
+
+def generate_excel_file(report_data: ReportData) -> Tuple[BinaryIO, ReportStats]:
     """
     Основная функция генерации Excel файла.
     
+    При REPORT_EXCEL_BACKEND=pyexcelerate (и установленном пакете) файл
+    пишется через pyexcelerate, иначе через xlsxwriter.
+    
     Args:
         report_data: Данные для отчета
         
     Returns:
         Tuple[excel_buffer, stats]
     """
-    workbook, output = create_excel_workbook()
+    if REPORT_EXCEL_BACKEND == "pyexcelerate" and pyexcelerate is not None:
+        return generate_excel_file_pyexcelerate(report_data)
     
-    # Определяем название листа
-    marketplace_name = ""
-    if report_data.marketplace == "ozon":
-        marketplace_name = "_Ozon"
-    elif report_data.marketplace == "wb":
-        marketplace_name = "_WB"
+    workbook, output = create_excel_workbook()
+    template = get_report_template(report_data.marketplace)
     
-    worksheet_name = f"Отчет{marketplace_name}" if marketplace_name else "Отчет"
-    worksheet = workbook.add_worksheet(worksheet_name)
+    worksheet = workbook.add_worksheet(template.sheet_name)
     
     # Настройка форматов
     formats = setup_excel_formats(workbook)
     
+    # Ширина столбцов задается до записи строк (constant_memory)
+    for col, width in enumerate(template.column_widths):
+        worksheet.set_column(col, col, width)
+    
     # Заголовки
-    headers = get_report_headers(report_data.marketplace)
-    for col, header in enumerate(headers):
-        worksheet.write(0, col, header, formats['header'])
+    worksheet.write_row(0, 0, template.headers, formats['header'])
     
     # Данные и статистика
     stats = write_excel_data(
@@ -357,9 +690,6 @@ def generate_excel_file(report_data: ReportData) -> Tuple[io.BytesIO, ReportStat
         report_data.marketplace
     )
     
-    # Настройка ширины столбцов
-    setup_column_widths(worksheet, report_data.marketplace)
-    
     workbook.close()
     output.seek(0)
     
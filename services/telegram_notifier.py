@@ -3,14 +3,113 @@
 Выделен из основной бизнес логики для лучшей тестируемости.
 """
 
+import html
 import os
+from functools import lru_cache, partial
 import requests
 import io
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, BinaryIO, Iterator
 from celery.utils.log import get_task_logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.fields import RequestField
+from urllib3.filepost import choose_boundary
 
 logger = get_task_logger(__name__)
 
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+
+# Подписи и суффиксы файлов отчетов по коду маркетплейса; без фильтра - пустая строка
+MARKETPLACE_CAPTION_NAMES = {"ozon": " Ozon", "wb": " Wildberries"}
+MARKETPLACE_FILE_SUFFIXES = {"ozon": "_Ozon", "wb": "_WB"}
+
+# Размер пула keep-alive соединений к api.telegram.org
+TELEGRAM_POOL_CONNECTIONS = 4
+TELEGRAM_POOL_MAXSIZE = 8
+
+# Повторы запросов к Bot API: только когда запрос точно не был обработан -
+# ошибка соединения или 429 (с паузой из Retry-After). Таймаут чтения не повторяем,
+# иначе сообщение может прийти в чат дважды
+TELEGRAM_RETRIES = 3
+TELEGRAM_RETRY_BACKOFF = 1.0
+
+# Размер куска файла при потоковой отправке документа
+TELEGRAM_UPLOAD_CHUNK_SIZE = 64 * 1024
+
+EXCEL_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def create_telegram_http_session() -> requests.Session:
+    """
+    Создает HTTP сессию для Telegram Bot API с пулом соединений.
+    
+    Returns:
+        Сессия, переиспользующая TCP+TLS соединения между запросами,
+        с повторами при ошибках соединения и 429
+    """
+    session = requests.Session()
+    retries = Retry(
+        total=TELEGRAM_RETRIES,
+        connect=TELEGRAM_RETRIES,
+        read=0,
+        status=TELEGRAM_RETRIES,
+        status_forcelist=(429,),
+        allowed_methods=frozenset({"POST"}),
+        backoff_factor=TELEGRAM_RETRY_BACKOFF,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=TELEGRAM_POOL_CONNECTIONS,
+        pool_maxsize=TELEGRAM_POOL_MAXSIZE,
+        max_retries=retries
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+telegram_http_session = create_telegram_http_session()
+
+
+class MultipartFileBody:
+    """
+    Тело запроса multipart/form-data, в котором файл читается кусками во время отправки.
+    
+    При files= requests собирает все тело в памяти. Объект с __len__ и __iter__
+    отправляется потоком с Content-Length, и в памяти держится один кусок файла.
+    """
+
+    def __init__(self, fields: Dict[str, Any], file_field: str, filename: str,
+                 fileobj: BinaryIO, content_type: str):
+        self.fileobj = fileobj
+        self.boundary = choose_boundary()
+        self.head = b"".join(
+            self.render_part_header(name) + str(value).encode() + b"\r\n"
+            for name, value in fields.items()
+        ) + self.render_part_header(file_field, filename, content_type)
+        self.tail = f"\r\n--{self.boundary}--\r\n".encode()
+        self.file_size = fileobj.seek(0, io.SEEK_END)
+
+    @property
+    def content_type(self) -> str:
+        """Заголовок Content-Type с границей частей."""
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def render_part_header(self, name: str, filename: Optional[str] = None,
+                           content_type: Optional[str] = None) -> bytes:
+        """Граница и заголовки одной части (экранирование имен как в urllib3)."""
+        field = RequestField(name=name, data=b"", filename=filename)
+        field.make_multipart(content_type=content_type)
+        return f"--{self.boundary}\r\n".encode() + field.render_headers().encode()
+
+    def __len__(self) -> int:
+        return len(self.head) + self.file_size + len(self.tail)
+
+    def __iter__(self) -> Iterator[bytes]:
+        self.fileobj.seek(0)
+        yield self.head
+        yield from iter(partial(self.fileobj.read, TELEGRAM_UPLOAD_CHUNK_SIZE), b"")
+        yield self.tail
+
 
 def safe_error_message(text: str) -> str:
     """
@@ -24,7 +123,7 @@ def safe_error_message(text: str) -> str:
     """
     if not text:
         return ""
-    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return html.escape(text, quote=False)
 
 
 def get_marketplace_display_name(marketplace: Optional[str]) -> str:
@@ -37,11 +136,7 @@ def get_marketplace_display_name(marketplace: Optional[str]) -> str:
     Returns:
         Отображаемое название
     """
-    if marketplace == "ozon":
-        return " Ozon"
-    elif marketplace == "wb":
-        return " Wildberries"
-    return ""
+    return MARKETPLACE_CAPTION_NAMES.get(marketplace, "")
 
 
 def get_marketplace_suffix(marketplace: Optional[str]) -> str:
@@ -54,16 +149,12 @@ def get_marketplace_suffix(marketplace: Optional[str]) -> str:
     Returns:
         Суффикс для файла
     """
-    if marketplace == "ozon":
-        return "_Ozon"
-    elif marketplace == "wb":
-        return "_WB"
-    return ""
+    return MARKETPLACE_FILE_SUFFIXES.get(marketplace, "")
 
 
 def send_document_to_telegram(
     chat_id: str,
-    document_data: io.BytesIO,
+    document_data: BinaryIO,
     filename: str,
     caption: str,
     bot_token: Optional[str] = None
@@ -73,7 +164,7 @@ def send_document_to_telegram(
     
     Args:
         chat_id: ID чата
-        document_data: Данные документа
+        document_data: Файл документа (BytesIO или временный файл)
         filename: Имя файла
         caption: Подпись к документу
         bot_token: Токен бота (если не передан, берется из env)
@@ -82,7 +173,7 @@ def send_document_to_telegram(
         True если успешно отправлено, False при ошибке
     """
     if not bot_token:
-        bot_token = os.getenv("BOT_TOKEN")
+        bot_token = BOT_TOKEN
     
     if not bot_token:
         logger.error("BOT_TOKEN не найден в переменных окружения")
@@ -90,22 +181,18 @@ def send_document_to_telegram(
     
     url = f"https://api.telegram.org/bot{bot_token}/sendDocument"
     
-    files = {
-        'document': (
-            filename, 
-            document_data.read(), 
-            'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-    }
-    
     data = {
         'chat_id': chat_id,
         'caption': caption,
         'parse_mode': 'HTML'
     }
     
+    # Файл отправляется потоком: ни файл, ни тело запроса целиком в памяти не собираются
     try:
-        response = requests.post(url, data=data, files=files, timeout=30)
+        body = MultipartFileBody(data, 'document', filename, document_data, EXCEL_MIME_TYPE)
+        response = telegram_http_session.post(
+            url, data=body, headers={'Content-Type': body.content_type}, timeout=30
+        )
         if response.status_code == 200:
             logger.info(f"Документ {filename} отправлен в чат {chat_id}")
             return True
@@ -136,7 +223,7 @@ def send_text_message_to_telegram(
         True если успешно отправлено
     """
     if not bot_token:
-        bot_token = os.getenv("BOT_TOKEN")
+        bot_token = BOT_TOKEN
     
     if not bot_token:
         logger.error("BOT_TOKEN не найден в переменных окружения")
@@ -151,7 +238,7 @@ def send_text_message_to_telegram(
     }
     
     try:
-        response = requests.post(url, data=data, timeout=30)
+        response = telegram_http_session.post(url, data=data, timeout=30)
         if response.status_code == 200:
             logger.info(f"Сообщение отправлено в чат {chat_id}")
             return True
@@ -163,6 +250,7 @@ def send_text_message_to_telegram(
         return False
 
 
+@lru_cache(maxsize=512)
 def create_excel_report_caption(date_str: str, marketplace: Optional[str] = None) -> str:
     """
     Создает подпись для Excel отчета.
@@ -180,6 +268,7 @@ def create_excel_report_caption(date_str: str, marketplace: Optional[str] = None
     return f"📊 <b>Подробный Excel-отчет{marketplace_display} за {safe_date}</b>"
 
 
+@lru_cache(maxsize=512)
 def create_excel_filename(client_id: str, date_str: str, marketplace: Optional[str] = None) -> str:
     """
     Создает имя файла для Excel отчета.
@@ -3,15 +3,22 @@ Celery задачи для работы с парсером v2
 """
 import logging
 import html
-from celery import Celery
+import json
+from celery import Celery, group
 from services.parser_service_v2 import ParserServiceV2
+from services.order_processor import send_order_refactored
+from services.report_checker import check_reports_refactored
+from services.daily_summary_service import run_daily_summary, get_redis_client
+from tasks.refactored_reports import send_excel_report_v2_refactored
+from db.session import get_sync_session
+from db.models import Client, Account
 import os
 import requests
-import io
-import xlsxwriter
 import pytz
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import List, Optional
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +35,14 @@ parser_service = ParserServiceV2()
 # Московское время
 MSK_TZ = pytz.timezone('Europe/Moscow')
 
+# Кэш списка клиентов с API ключом парсера
+PARSER_CLIENTS_CACHE_KEY = "clients:parser_api"
+PARSER_CLIENTS_CACHE_TTL = 300  # 5 минут
+
+# Клиентов в одной задаче ежедневного отчета: внутри задачи отправка идет
+# параллельно (SUMMARY_SEND_WORKERS), клиенты загружаются одним запросом
+SUMMARY_CLIENTS_PER_TASK = 20
+
 @app.task
 def send_parser_order_v2(client_id: str, account_id: int, batch_size: int = 1000, test_mode: bool = False):
     """
@@ -36,7 +51,6 @@ def send_parser_order_v2(client_id: str, account_id: int, batch_size: int = 1000
     logger.info(f"Отправка заказа в парсер v2 для клиента {client_id}, аккаунт {account_id}")
     
     try:
-        from services.order_processor import send_order_refactored
         result = send_order_refactored(client_id, account_id, batch_size, test_mode)
         success = result.success
         if success:
@@ -56,7 +70,6 @@ def check_reports_v2(client_id: str):
     logger.info(f"Проверка отчетов v2 для клиента {client_id}")
     
     try:
-        from services.report_checker import check_reports_refactored
         base_url = "https://parser.market/wp-json/client-api/v1"
         success = check_reports_refactored(base_url, client_id)
         if success:
@@ -76,38 +89,61 @@ def collect_all_accounts_v2():
     logger.info("Запуск сбора цен по всем аккаунтам v2")
     
     try:
-        from db.session import get_sync_session
-        from db.models import Client, Account
-        
-        session = get_sync_session()
+        # Сессия закрывается и при исключении, соединение возвращается в пул
+        with get_sync_session() as session:
+            # Пары (клиент, аккаунт) для всех клиентов с API ключами парсера
+            # одним JOIN-запросом вместо запроса аккаунтов на каждого клиента
+            account_pairs = session.execute(
+                select(Account.client_id, Account.id)
+                .join(Client, Account.client_id == Client.id)
+                .where(Client.parser_api_key.isnot(None))
+            ).all()
         
-        # Получаем всех клиентов с API ключами парсера
-        clients = session.query(Client).filter(Client.parser_api_key.isnot(None)).all()
+        # .delay() возвращает AsyncResult, который всегда истинен, поэтому
+        # считаем поставленные в очередь заказы, а не "успешные"
+        orders = [
+            send_parser_order_v2.s(client_id, account_id)
+            for client_id, account_id in account_pairs
+        ]
         
-        total_orders = 0
+        if orders:
+            group(orders).apply_async()
         
-        for client in clients:
-            # Получаем аккаунты клиента
-            accounts = session.query(Account).filter(Account.client_id == client.id).all()
-            
-            for account in accounts:
-                logger.info(f"Отправка заказа для клиента {client.id}, аккаунт {account.id}")
-                
-                # Отправляем заказ
-                success = send_parser_order_v2.delay(client.id, account.id)
-                if success:
-                    total_orders += 1
-                    
-        session.close()
+        logger.info(f"Поставлено в очередь {len(orders)} заказов")
         
-        logger.info(f"Отправлено {total_orders} заказов")
-        
-        return total_orders > 0
+        return len(orders) > 0
         
     except Exception as e:
         logger.exception(f"Ошибка в задаче collect_all_accounts_v2: {e}")
         return False
 
+def get_parser_client_ids() -> List[str]:
+    """
+    ID клиентов с API ключом парсера, с кэшем в Redis на PARSER_CLIENTS_CACHE_TTL секунд.
+    check_all_reports_v2 запускается каждые 3 минуты, а список клиентов меняется редко.
+    """
+    redis_client = None
+    try:
+        redis_client = get_redis_client()
+        cached = redis_client.get(PARSER_CLIENTS_CACHE_KEY)
+        if cached:
+            return json.loads(cached)
+    except Exception as e:
+        logger.warning(f"Кэш клиентов в Redis недоступен: {e}")
+    
+    with get_sync_session() as session:
+        client_ids = list(session.scalars(
+            select(Client.id).where(Client.parser_api_key.isnot(None))
+        ).all())
+    
+    if redis_client is not None:
+        try:
+            redis_client.setex(PARSER_CLIENTS_CACHE_KEY, PARSER_CLIENTS_CACHE_TTL, json.dumps(client_ids))
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить кэш клиентов в Redis: {e}")
+    
+    return client_ids
+
 @app.task
 def check_all_reports_v2():
     """
@@ -116,45 +152,55 @@ def check_all_reports_v2():
     logger.info("Запуск проверки отчетов по всем клиентам v2")
     
     try:
-        from db.session import get_sync_session
-        from db.models import Client
-        
-        session = get_sync_session()
-        
-        # Получаем всех клиентов с API ключами парсера
-        clients = session.query(Client).filter(Client.parser_api_key.isnot(None)).all()
+        checks = [check_reports_v2.s(client_id) for client_id in get_parser_client_ids()]
         
-        total_updated = 0
+        if checks:
+            group(checks).apply_async()
         
-        for client in clients:
-            logger.info(f"Проверка отчетов для клиента {client.id}")
-            
-            # Проверяем отчеты
-            success = check_reports_v2.delay(client.id)
-            if success:
-                total_updated += 1
-                
-        session.close()
-        
-        logger.info(f"Обновлено {total_updated} клиентов")
-        return total_updated > 0
+        logger.info(f"Поставлено в очередь {len(checks)} проверок отчетов")
+        return len(checks) > 0
         
     except Exception as e:
         logger.exception(f"Ошибка в задаче check_all_reports_v2: {e}")
         return False
 
-@app.task
-def send_daily_summary_v2(client_id: Optional[str] = None, force_send: bool = False):
+@app.task(autoretry_for=(SQLAlchemyError,), retry_backoff=True, max_retries=3)
+def send_daily_summary_v2(client_id: Optional[str] = None, force_send: bool = False,
+                          client_ids: Optional[List[str]] = None):
     """
-    Wrapper для рефакторенной версии send_daily_summary_refactored.
+    Wrapper для рефакторенной версии run_daily_summary.
+    Без client_id и client_ids ставит в очередь задачи по пачкам клиентов
+    и возвращает число клиентов. При ошибке БД задача повторяется: отметки
+    в Redis не дают отправить отчет второй раз уже обработанным клиентам.
     """
-    from services.daily_summary_service import send_daily_summary_refactored
-    return send_daily_summary_refactored(client_id, force_send)
+    if client_id is None and not client_ids:
+        return schedule_daily_summaries(force_send)
+    return run_daily_summary(client_id, force_send, client_ids)
+
+def schedule_daily_summaries(force_send: bool = False) -> int:
+    """
+    Ставит отправку ежедневного отчета клиентам с group_chat_id в очередь summaries
+    задачами по SUMMARY_CLIENTS_PER_TASK клиентов: пачки обрабатываются параллельно,
+    а клиенты пачки загружаются одним запросом.
+    """
+    with get_sync_session() as session:
+        client_ids = session.scalars(
+            select(Client.id).where(Client.group_chat_id.isnot(None))
+        ).all()
+    
+    summaries = [
+        send_daily_summary_v2.s(None, force_send, client_ids[i:i + SUMMARY_CLIENTS_PER_TASK])
+        for i in range(0, len(client_ids), SUMMARY_CLIENTS_PER_TASK)
+    ]
+    if summaries:
+        group(summaries).apply_async()
+    
+    logger.info(f"Поставлено в очередь {len(summaries)} задач ежедневных отчетов для {len(client_ids)} клиентов")
+    return len(client_ids)
 
 @app.task
 def send_excel_report_v2(client_id: str, date_str: str, marketplace: Optional[str] = None):
     """
     Wrapper для рефакторенной версии send_excel_report_v2_refactored.
     """
-    from tasks.refactored_reports import send_excel_report_v2_refactored
     return send_excel_report_v2_refactored(client_id, date_str, marketplace) 
\ No newline at end of file
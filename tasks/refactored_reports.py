@@ -5,17 +5,21 @@
 
 import os
 from typing import Optional
-from celery import current_app as celery_app
+from celery import current_app as celery_app, chord
 from celery.utils.log import get_task_logger
 
 # Импорты сервисов
 from services.report_generator import (
     validate_report_params,
-    fetch_current_results,
-    fetch_previous_results,
+    fetch_report_results,
+    get_report_cache_key,
+    serialize_report_results,
+    deserialize_report_results,
     generate_excel_file,
-    ReportData
+    ReportData,
+    REPORT_CACHE_TTL
 )
+from services.daily_summary_service import get_redis_client
 from services.telegram_notifier import (
     send_document_to_telegram,
     create_excel_report_caption,
@@ -24,6 +28,10 @@ from services.telegram_notifier import (
 
 logger = get_task_logger(__name__)
 
+REPORT_VALIDATE_CACHE_TTL = 3600  # 1 час
+REPORT_VALIDATE_OK = b'ok'
+REPORT_VALIDATE_BAD = b'bad'
+
 
 def send_excel_report_v2_refactored(client_id: str, date_str: str, marketplace: Optional[str] = None) -> bool:
     """
@@ -42,28 +50,27 @@ def send_excel_report_v2_refactored(client_id: str, date_str: str, marketplace:
     """
     from db.session import get_sync_session
     
-    logger.info(f"Формирование Excel-отчета для клиента {client_id} за {date_str}, маркетплейс: {marketplace or 'все'}")
-    
-    session = get_sync_session()
+    logger.info("Формирование Excel-отчета для клиента %s за %s, маркетплейс: %s",
+                client_id, date_str, marketplace or 'все')
     
     try:
-        # 1. Валидация параметров (CC: 1)
-        client, date = validate_report_params(client_id, date_str, session)
-        if not client or not date:
-            logger.error(f"Некорректные параметры: клиент {client_id}, дата {date_str}")
-            return False
+        # Сессия нужна только для чтения: соединение возвращается в пул до генерации
+        # файла и загрузки в Telegram, которая может длиться десятки секунд
+        with get_sync_session() as session:
+            # 1. Валидация параметров (CC: 1)
+            client, date = validate_report_params(client_id, date_str, session)
+            if not client or not date:
+                logger.error("Некорректные параметры: клиент %s, дата %s", client_id, date_str)
+                return False
+            
+            # 2. Получение текущих данных и данных для сравнения (CC: 1)
+            current_results, previous_data = load_report_results(session, client_id, date, marketplace)
         
-        # 2. Получение данных (CC: 1)
-        current_results = fetch_current_results(session, client_id, date, marketplace)
         if not current_results:
-            logger.info(f"Нет данных для клиента {client_id} за {date_str}")
+            logger.info("Нет данных для клиента %s за %s", client_id, date_str)
             return False
         
-        # 3. Получение данных для сравнения (CC: 1)
-        current_timestamp = max(r.timestamp for r in current_results)
-        previous_data = fetch_previous_results(session, client_id, current_timestamp, marketplace)
-        
-        # 4. Создание объекта данных
+        # 3. Создание объекта данных
         report_data = ReportData(
             current_results=current_results,
             previous_data=previous_data,
@@ -72,10 +79,10 @@ def send_excel_report_v2_refactored(client_id: str, date_str: str, marketplace:
             marketplace=marketplace
         )
         
-        # 5. Генерация Excel файла (CC: 1)
+        # 4. Генерация Excel файла (CC: 1)
         excel_buffer, stats = generate_excel_file(report_data)
         
-        # 6. Отправка в Telegram (CC: 1)
+        # 5. Отправка в Telegram (CC: 1)
         filename = create_excel_filename(client_id, date_str, marketplace)
         caption = create_excel_report_caption(date_str, marketplace)
         
@@ -88,15 +95,49 @@ def send_excel_report_v2_refactored(client_id: str, date_str: str, marketplace:
         
         if success:
             marketplace_display = marketplace or 'все маркетплейсы'
-            logger.info(f"Excel-отчет ({marketplace_display}) отправлен для клиента {client_id}")
+            logger.info("Excel-отчет (%s) отправлен для клиента %s", marketplace_display, client_id)
         
         return success
         
     except Exception as e:
-        logger.error(f"Ошибка генерации отчета для клиента {client_id}: {e}")
+        logger.error("Ошибка генерации отчета для клиента %s: %s", client_id, e)
         return False
-    finally:
-        session.close()
+
+
+def load_report_results(session, client_id: str, date, marketplace: Optional[str]):
+    """
+    Получает срезы отчета из кэша Redis или из БД.
+    
+    Кэш необязателен: при недоступности Redis срезы читаются из БД.
+    
+    Args:
+        session: Сессия БД
+        client_id: ID клиента
+        date: Дата отчета
+        marketplace: Фильтр по маркетплейсу (ozon/wb) или None
+        
+    Returns:
+        Tuple[текущие результаты, предыдущие данные]
+    """
+    redis_client = get_redis_client()
+    cache_key = get_report_cache_key(session, client_id, date, marketplace)
+    
+    try:
+        cached = redis_client.get(cache_key)
+        if cached:
+            return deserialize_report_results(cached)
+    except Exception as e:
+        logger.warning("Кэш отчета в Redis недоступен: %s", e)
+    
+    current_results, previous_data = fetch_report_results(session, client_id, date, marketplace)
+    
+    if current_results:
+        try:
+            redis_client.setex(cache_key, REPORT_CACHE_TTL, serialize_report_results(current_results, previous_data))
+        except Exception as e:
+            logger.warning("Не удалось сохранить отчет в кэш Redis: %s", e)
+    
+    return current_results, previous_data
 
 
 @celery_app.task  
@@ -113,61 +154,129 @@ def validate_excel_report_request(client_id: str, date_str: str) -> bool:
     """
     from db.session import get_sync_session
     
-    session = get_sync_session()
+    redis_client = None
+    cache_key = get_report_validate_key(client_id, date_str)
     try:
+        redis_client = get_redis_client()
+        cached = redis_client.get(cache_key)
+        if cached in (REPORT_VALIDATE_OK, REPORT_VALIDATE_BAD):
+            return cached == REPORT_VALIDATE_OK
+    except Exception as e:
+        logger.warning("Кэш валидации в Redis недоступен: %s", e)
+    
+    with get_sync_session() as session:
         client, date = validate_report_params(client_id, date_str, session)
-        return client is not None and date is not None
-    finally:
-        session.close()
+        is_valid = client is not None and date is not None
+    
+    if redis_client is not None:
+        try:
+            redis_client.setex(
+                cache_key, REPORT_VALIDATE_CACHE_TTL,
+                REPORT_VALIDATE_OK if is_valid else REPORT_VALIDATE_BAD
+            )
+        except Exception as e:
+            logger.warning("Не удалось сохранить результат валидации в Redis: %s", e)
+    
+    return is_valid
+
 
+def get_report_validate_key(client_id: str, date_str: str) -> str:
+    """Ключ Redis с результатом валидации запроса на отчет."""
+    return f"report_validate:{client_id}:{date_str}"
 
-def generate_report_for_marketplace(client_id: str, date_str: str, marketplace: str) -> bool:
+
+def invalidate_report_validation(client_id: str) -> None:
+    """
+    Удаляет кэшированные результаты валидации клиента.
+    Вызывается после изменения записи клиента (например, group_chat_id).
+    
+    Args:
+        client_id: ID клиента
+    """
+    try:
+        redis_client = get_redis_client()
+        keys = list(redis_client.scan_iter(match=get_report_validate_key(client_id, '*')))
+        if keys:
+            redis_client.delete(*keys)
+    except Exception as e:
+        logger.warning("Не удалось сбросить кэш валидации клиента %s: %s", client_id, e)
+
+
+# Отчеты, которые строит generate_all_marketplace_reports: ключ 'all' - общий отчет
+MARKETPLACE_REPORT_KEYS = ('ozon', 'wb', 'all')
+
+
+@celery_app.task
+def generate_report_for_marketplace(client_id: str, date_str: str, marketplace: Optional[str]) -> bool:
     """
     Генерирует отчет для конкретного маркетплейса.
-    Вспомогательная функция для batch генерации.
+    Подзадача chord в generate_all_marketplace_reports.
+    
+    Исключение не пробрасывается: упавшая подзадача chord отменила бы
+    callback, и результаты остальных отчетов не были бы собраны.
     
     Args:
         client_id: ID клиента
         date_str: Дата
-        marketplace: Маркетплейс (ozon/wb)
+        marketplace: Маркетплейс (ozon/wb) или None для общего отчета
         
     Returns:
         True если успешно
     """
-    return send_excel_report_v2_refactored(client_id, date_str, marketplace)
+    try:
+        return send_excel_report_v2_refactored(client_id, date_str, marketplace)
+    except Exception as e:
+        logger.exception("Ошибка генерации отчета %s для клиента %s: %s", marketplace, client_id, e)
+        return False
 
 
 @celery_app.task
-def generate_all_marketplace_reports(client_id: str, date_str: str) -> dict:
+def collect_marketplace_report_results(outcomes: list, client_id: str) -> dict:
     """
-    Генерирует отчеты для всех маркетплейсов.
+    Callback chord: собирает результаты отчетов по маркетплейсам.
     
     Args:
+        outcomes: Результаты подзадач в порядке MARKETPLACE_REPORT_KEYS
         client_id: ID клиента
-        date_str: Дата
         
     Returns:
         Словарь с результатами {marketplace: success}
     """
-    results = {}
+    results = {key: outcome is True for key, outcome in zip(MARKETPLACE_REPORT_KEYS, outcomes)}
+    for key, success in results.items():
+        logger.info("Отчет %s для клиента %s: %s", key, client_id, 'успешно' if success else 'ошибка')
     
-    # Генерируем отчеты для каждого маркетплейса
-    for marketplace in ['ozon', 'wb']:
-        try:
-            success = generate_report_for_marketplace(client_id, date_str, marketplace)
-            results[marketplace] = success
-            logger.info(f"Отчет {marketplace} для клиента {client_id}: {'успешно' if success else 'ошибка'}")
-        except Exception as e:
-            logger.error(f"Ошибка генерации отчета {marketplace} для клиента {client_id}: {e}")
-            results[marketplace] = False
+    return results
+
+
+@celery_app.task
+def generate_all_marketplace_reports(client_id: str, date_str: str) -> Optional[str]:
+    """
+    Генерирует отчеты для всех маркетплейсов.
+    
+    Отчеты Ozon, WB и общий ставятся chord'ом (подзадачи идут в очередь
+    reports_cpu по маршруту из celeryconfig) и строятся параллельно.
+    Задача не ждет подзадачи: результаты собирает callback
+    collect_marketplace_report_results, поэтому воркер не держит слот,
+    нужный самим подзадачам.
+    
+    Args:
+        client_id: ID клиента
+        date_str: Дата
+        
+    Returns:
+        ID результата callback ({marketplace: success}) или None, если
+        chord не удалось поставить в очередь
+    """
+    header = [
+        generate_report_for_marketplace.s(client_id, date_str, None if key == 'all' else key)
+        for key in MARKETPLACE_REPORT_KEYS
+    ]
     
-    # Генерируем общий отчет
     try:
-        success = send_excel_report_v2_refactored(client_id, date_str, None)
-        results['all'] = success
-        logger.info(f"Общий отчет для клиента {client_id}: {'успешно' if success else 'ошибка'}")
+        result = chord(header)(collect_marketplace_report_results.s(client_id))
     except Exception as e:
-        logger.error(f"Ошибка генерации общего отчета для клиента {client_id}: {e}")
-        results['all'] = False
+        logger.error("Ошибка постановки отчетов для клиента %s: %s", client_id, e)
+        return None
     
-    return results 
\ No newline at end of file
+    return result.id
@@ -0,0 +1,203 @@
+# test_app_v2.py
+"""
+Unit тесты для Celery задач tasks/app_v2.py.
+Проверяют пакетную постановку задач в очередь (fan-out).
+"""
+
+import pytest
+from unittest.mock import patch, MagicMock
+from tasks.app_v2 import (
+    collect_all_accounts_v2,
+    check_all_reports_v2,
+    send_parser_order_v2,
+    check_reports_v2,
+    send_daily_summary_v2,
+    get_parser_client_ids,
+    PARSER_CLIENTS_CACHE_KEY,
+    PARSER_CLIENTS_CACHE_TTL
+)
+
+
+def make_session_with_clients(clients):
+    """Создает mock сессии (контекстный менеджер), у которой scalars() возвращает clients."""
+    session = MagicMock()
+    session.__enter__.return_value = session
+    session.scalars.return_value.all.return_value = clients
+    return session
+
+
+class TestCollectAllAccounts:
+    """Тесты для collect_all_accounts_v2."""
+
+    @patch('tasks.app_v2.group')
+    @patch('tasks.app_v2.get_sync_session')
+    def test_enqueues_all_accounts_in_one_group(self, mock_get_session, mock_group):
+        """Тест отправки заказов по всем аккаунтам одной группой."""
+        # Arrange
+        session = make_session_with_clients([])
+        session.execute.return_value.all.return_value = [("SEB", 1), ("SEB", 2), ("ABC", 3)]
+        mock_get_session.return_value = session
+
+        # Act
+        result = collect_all_accounts_v2()
+
+        # Assert
+        assert result is True
+        signatures = mock_group.call_args[0][0]
+        assert [tuple(s.args) for s in signatures] == [("SEB", 1), ("SEB", 2), ("ABC", 3)]
+        assert all(s.task == send_parser_order_v2.name for s in signatures)
+        mock_group.return_value.apply_async.assert_called_once()
+        session.execute.assert_called_once()
+        session.__exit__.assert_called_once()
+
+    @patch('tasks.app_v2.group')
+    @patch('tasks.app_v2.get_sync_session')
+    def test_no_accounts_does_not_enqueue(self, mock_get_session, mock_group):
+        """Тест что без аккаунтов задачи не ставятся."""
+        # Arrange
+        session = make_session_with_clients([])
+        session.execute.return_value.all.return_value = []
+        mock_get_session.return_value = session
+
+        # Act
+        result = collect_all_accounts_v2()
+
+        # Assert
+        assert result is False
+        mock_group.assert_not_called()
+
+
+class TestCheckAllReports:
+    """Тесты для check_all_reports_v2."""
+
+    @patch('tasks.app_v2.group')
+    @patch('tasks.app_v2.get_parser_client_ids')
+    def test_enqueues_checks_in_one_group(self, mock_get_client_ids, mock_group):
+        """Тест постановки проверок отчетов одной группой."""
+        # Arrange
+        mock_get_client_ids.return_value = ["SEB", "ABC"]
+
+        # Act
+        result = check_all_reports_v2()
+
+        # Assert
+        assert result is True
+        signatures = mock_group.call_args[0][0]
+        assert [tuple(s.args) for s in signatures] == [("SEB",), ("ABC",)]
+        assert all(s.task == check_reports_v2.name for s in signatures)
+        mock_group.return_value.apply_async.assert_called_once()
+
+
+class TestGetParserClientIds:
+    """Тесты для кэша клиентов с API ключом парсера."""
+
+    @patch('tasks.app_v2.get_sync_session')
+    @patch('tasks.app_v2.get_redis_client')
+    def test_cache_hit_skips_database(self, mock_get_redis, mock_get_session):
+        """Тест что при попадании в кэш БД не запрашивается."""
+        # Arrange
+        mock_get_redis.return_value.get.return_value = b'["SEB", "ABC"]'
+
+        # Act
+        result = get_parser_client_ids()
+
+        # Assert
+        assert result == ["SEB", "ABC"]
+        mock_get_session.assert_not_called()
+
+    @patch('tasks.app_v2.get_sync_session')
+    @patch('tasks.app_v2.get_redis_client')
+    def test_cache_miss_loads_and_stores(self, mock_get_redis, mock_get_session):
+        """Тест загрузки из БД и записи в кэш при промахе."""
+        # Arrange
+        mock_redis = mock_get_redis.return_value
+        mock_redis.get.return_value = None
+        mock_get_session.return_value = make_session_with_clients(["SEB"])
+
+        # Act
+        result = get_parser_client_ids()
+
+        # Assert
+        assert result == ["SEB"]
+        mock_redis.setex.assert_called_once_with(
+            PARSER_CLIENTS_CACHE_KEY, PARSER_CLIENTS_CACHE_TTL, '["SEB"]'
+        )
+
+    @patch('tasks.app_v2.get_sync_session')
+    @patch('tasks.app_v2.get_redis_client')
+    def test_redis_unavailable_falls_back_to_database(self, mock_get_redis, mock_get_session):
+        """Тест работы без Redis."""
+        # Arrange
+        mock_get_redis.side_effect = ConnectionError("redis down")
+        mock_get_session.return_value = make_session_with_clients(["SEB"])
+
+        # Act
+        result = get_parser_client_ids()
+
+        # Assert
+        assert result == ["SEB"]
+
+
+class TestSendDailySummary:
+    """Тесты для send_daily_summary_v2."""
+
+    @patch('tasks.app_v2.SUMMARY_CLIENTS_PER_TASK', 2)
+    @patch('tasks.app_v2.group')
+    @patch('tasks.app_v2.get_sync_session')
+    def test_all_clients_fan_out_in_chunks(self, mock_get_session, mock_group):
+        """Тест постановки задач по пачкам клиентов."""
+        # Arrange
+        mock_get_session.return_value = make_session_with_clients(["SEB", "ABC", "DF"])
+
+        # Act
+        result = send_daily_summary_v2(None, True)
+
+        # Assert
+        assert result == 3
+        signatures = mock_group.call_args[0][0]
+        assert [tuple(s.args) for s in signatures] == [
+            (None, True, ["SEB", "ABC"]), (None, True, ["DF"])
+        ]
+        assert all(s.task == send_daily_summary_v2.name for s in signatures)
+        mock_group.return_value.apply_async.assert_called_once()
+
+    @patch('tasks.app_v2.group')
+    @patch('tasks.app_v2.run_daily_summary')
+    def test_client_chunk_sends_directly(self, mock_send, mock_group):
+        """Тест отправки пачке клиентов без повторного fan-out."""
+        # Arrange
+        mock_send.return_value = 3
+
+        # Act
+        result = send_daily_summary_v2(None, False, ["SEB", "ABC"])
+
+        # Assert
+        assert result == 3
+        mock_send.assert_called_once_with(None, False, ["SEB", "ABC"])
+        mock_group.assert_not_called()
+
+    @patch('tasks.app_v2.group')
+    @patch('tasks.app_v2.run_daily_summary')
+    def test_single_client_sends_directly(self, mock_send, mock_group):
+        """Тест отправки отчета одному клиенту без fan-out."""
+        # Arrange
+        mock_send.return_value = 2
+
+        # Act
+        result = send_daily_summary_v2("SEB")
+
+        # Assert
+        assert result == 2
+        mock_send.assert_called_once_with("SEB", False, None)
+        mock_group.assert_not_called()
+
+    def test_retries_on_database_errors(self):
+        """Тест повтора задачи при ошибке БД."""
+        from sqlalchemy.exc import SQLAlchemyError
+
+        assert send_daily_summary_v2.autoretry_for == (SQLAlchemyError,)
+        assert send_daily_summary_v2.max_retries == 3
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
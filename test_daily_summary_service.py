@@ -13,20 +13,22 @@ from services.daily_summary_service import (
     get_redis_client,
     safe_error_message,
     get_clients_for_summary,
-    is_summary_already_sent,
-    mark_summary_as_sent,
-    fetch_today_results,
-    fetch_previous_results,
-    calculate_discount_percent,
-    calculate_marketplace_stats,
+    get_clients_for_summary_bulk,
+    get_already_sent_client_ids,
+    mark_summaries_as_sent,
+    fetch_summary_stats,
     get_marketplace_display_info,
     format_summary_message,
     create_inline_keyboard,
     send_telegram_message,
     generate_summary_for_marketplace,
     send_daily_summary_refactored,
+    run_daily_summary,
+    select_clients_to_notify,
+    send_client_summaries,
     process_marketplace_summary
 )
+from services.report_generator import calculate_discount_percent
 
 
 class TestMarketplaceStats:
@@ -55,8 +57,6 @@ class TestSummaryData:
     def test_summary_data_creation(self):
         """Тестирует создание SummaryData."""
         client = Mock()
-        today_results = [Mock(), Mock()]
-        previous_results = [Mock()]
         today_timestamp = datetime.now()
         previous_timestamp = datetime.now() - timedelta(days=1)
         stats = MarketplaceStats(10, 2, 3, 4, 1)
@@ -64,8 +64,6 @@ class TestSummaryData:
         data = SummaryData(
             client=client,
             marketplace="ozon",
-            today_results=today_results,
-            previous_results=previous_results,
             today_timestamp=today_timestamp,
             previous_timestamp=previous_timestamp,
             stats=stats
@@ -73,8 +71,7 @@ class TestSummaryData:
         
         assert data.client == client
         assert data.marketplace == "ozon"
-        assert len(data.today_results) == 2
-        assert len(data.previous_results) == 1
+        assert data.previous_timestamp == previous_timestamp
         assert data.stats.total_tracked == 10
 
 
@@ -118,75 +115,154 @@ class TestGetClientsForSummary:
         """Тестирует получение всех клиентов."""
         mock_session = Mock()
         mock_clients = [Mock(), Mock()]
-        mock_session.query.return_value.all.return_value = mock_clients
+        mock_session.query.return_value.filter.return_value.all.return_value = mock_clients
         
         result = get_clients_for_summary(mock_session, None)
         
         assert result == mock_clients
         mock_session.query.assert_called_once()
 
+    
+    @patch('services.daily_summary_service.Client')
+    def test_get_clients_bulk_single_query(self, mock_client):
+        """Тестирует получение пачки клиентов одним запросом."""
+        mock_session = Mock()
+        mock_clients = [Mock(), Mock()]
+        mock_session.query.return_value.filter.return_value.all.return_value = mock_clients
+        
+        result = get_clients_for_summary_bulk(mock_session, ["client1", "client2"])
+        
+        assert result == mock_clients
+        mock_session.query.assert_called_once()
+        mock_client.id.in_.assert_called_once_with(["client1", "client2"])
 
 class TestRedisFunctions:
     """Тесты для функций работы с Redis."""
     
-    def test_is_summary_already_sent_true(self):
-        """Тестирует проверку уже отправленного отчета."""
+    def test_get_redis_client_uses_shared_pool(self):
+        """Тестирует что клиенты используют общий пул соединений."""
+        from services.daily_summary_service import REDIS_POOL
+        
+        first = get_redis_client()
+        second = get_redis_client()
+        
+        assert first.connection_pool is REDIS_POOL
+        assert second.connection_pool is REDIS_POOL
+    
+    def test_get_already_sent_client_ids(self):
+        """Тестирует проверку отправленных отчетов одним MGET."""
         mock_redis = Mock()
-        mock_redis.get.return_value = b'sent'
+        mock_redis.mget.return_value = [b'sent', None]
         
-        result = is_summary_already_sent(mock_redis, "client123", "2024-01-01")
+        result = get_already_sent_client_ids(mock_redis, ["client123", "client456"], "2024-01-01")
         
-        assert result is True
-        mock_redis.get.assert_called_once_with("daily_summary_sent:client123:2024-01-01")
+        assert result == {"client123"}
+        mock_redis.mget.assert_called_once_with([
+            "daily_summary_sent:client123:2024-01-01",
+            "daily_summary_sent:client456:2024-01-01"
+        ])
     
-    def test_is_summary_already_sent_false(self):
-        """Тестирует проверку неотправленного отчета."""
+    def test_get_already_sent_client_ids_redis_error(self):
+        """Тестирует что при ошибке Redis отчеты считаются неотправленными."""
         mock_redis = Mock()
-        mock_redis.get.return_value = None
+        mock_redis.mget.side_effect = Exception("Redis error")
         
-        result = is_summary_already_sent(mock_redis, "client123", "2024-01-01")
+        result = get_already_sent_client_ids(mock_redis, ["client123"], "2024-01-01")
         
-        assert result is False
+        assert result == set()
     
-    def test_mark_summary_as_sent(self):
-        """Тестирует отметку отчета как отправленного."""
+    def test_mark_summaries_as_sent(self):
+        """Тестирует отметку отчетов как отправленных одним pipeline."""
         mock_redis = Mock()
+        pipe = mock_redis.pipeline.return_value
         
-        mark_summary_as_sent(mock_redis, "client123", "2024-01-01")
+        mark_summaries_as_sent(mock_redis, ["client123", "client456"], "2024-01-01")
         
-        mock_redis.setex.assert_called_once_with(
-            "daily_summary_sent:client123:2024-01-01", 
-            86400, 
-            "sent"
-        )
+        assert pipe.setex.call_count == 2
+        pipe.setex.assert_any_call("daily_summary_sent:client123:2024-01-01", 86400, "sent")
+        pipe.execute.assert_called_once()
+    
+    def test_mark_summaries_as_sent_empty(self):
+        """Тестирует что без клиентов Redis не вызывается."""
+        mock_redis = Mock()
+        
+        mark_summaries_as_sent(mock_redis, [], "2024-01-01")
+        
+        mock_redis.pipeline.assert_not_called()
+
+
+class TestSelectClientsToNotify:
+    """Тесты для отбора клиентов перед отправкой."""
+    
+    @patch('services.daily_summary_service.get_already_sent_client_ids')
+    def test_skips_already_sent_clients(self, mock_already_sent):
+        """Тестирует пропуск клиентов с уже отправленным отчетом."""
+        sent = Mock(id="c2", group_chat_id="chat2")
+        pending = Mock(id="c3", group_chat_id="chat3")
+        mock_already_sent.return_value = {"c2"}
+        
+        result = select_clients_to_notify(Mock(), [sent, pending], "2024-01-01", False)
+        
+        assert result == [pending]
+        assert mock_already_sent.call_args[0][1] == ["c2", "c3"]
+    
+    @patch('services.daily_summary_service.get_already_sent_client_ids')
+    def test_force_send_ignores_sent_flag(self, mock_already_sent):
+        """Тестирует что force_send не проверяет Redis."""
+        client = Mock(id="c1", group_chat_id="chat1")
+        
+        result = select_clients_to_notify(Mock(), [client], "2024-01-01", True)
+        
+        assert result == [client]
+        mock_already_sent.assert_not_called()
 
 
 class TestDatabaseFunctions:
     """Тесты для функций работы с БД."""
     
-    def test_fetch_today_results(self):
-        """Тестирует получение сегодняшних результатов."""
+    def test_fetch_summary_stats_keys_by_client_and_marketplace(self):
+        """Тестирует разбор агрегатов по парам (клиент, маркетплейс)."""
         mock_session = Mock()
-        mock_results = [Mock(), Mock()]
-        mock_session.execute.return_value.fetchall.return_value = mock_results
+        ozon_row = Mock(client_id="c1", market="ozon")
+        wb_row = Mock(client_id="c2", market="wb")
+        mock_session.execute.return_value.fetchall.return_value = [ozon_row, wb_row]
         
         today = date(2024, 1, 1)
-        result = fetch_today_results(mock_session, "client123", "ozon", today)
+        result = fetch_summary_stats(mock_session, ["c1", "c2"], today)
         
-        assert result == mock_results
+        assert result == {("c1", "ozon"): ozon_row, ("c2", "wb"): wb_row}
         mock_session.execute.assert_called_once()
+        params = mock_session.execute.call_args[0][1]
+        assert params["client_ids"] == ["c1", "c2"]
+        assert params["today_end"] == date(2024, 1, 2)
     
-    def test_fetch_previous_results(self):
-        """Тестирует получение предыдущих результатов."""
+    def test_fetch_summary_stats_aggregates_in_sql(self):
+        """Тестирует что счетчики считаются агрегатами в запросе."""
         mock_session = Mock()
-        mock_results = [Mock()]
-        mock_session.execute.return_value.fetchall.return_value = mock_results
+        mock_session.execute.return_value.fetchall.return_value = []
         
-        timestamp = datetime(2024, 1, 1, 12, 0, 0)
-        result = fetch_previous_results(mock_session, "client123", "ozon", timestamp)
+        fetch_summary_stats(mock_session, ["c1"], date(2024, 1, 1))
         
-        assert result == mock_results
-        mock_session.execute.assert_called_once()
+        sql = str(mock_session.execute.call_args[0][0])
+        assert "FILTER (WHERE NOT has_previous) AS new_products" in sql
+        assert "GROUP BY c.client_id, c.market" in sql
+    
+    def test_fetch_summary_stats_no_clients(self):
+        """Тестирует что без клиентов запрос не выполняется."""
+        mock_session = Mock()
+        
+        result = fetch_summary_stats(mock_session, [], date(2024, 1, 1))
+        
+        assert result == {}
+        mock_session.execute.assert_not_called()
+    
+    def test_fetch_summary_stats_db_error(self):
+        """Тестирует что ошибка БД пробрасывается для повтора задачи."""
+        mock_session = Mock()
+        mock_session.execute.side_effect = Exception("DB error")
+        
+        with pytest.raises(Exception, match="DB error"):
+            fetch_summary_stats(mock_session, ["client123"], date(2024, 1, 1))
 
 
 class TestCalculateDiscountPercent:
@@ -211,62 +287,20 @@ class TestCalculateDiscountPercent:
         """Тестирует обработку None значений."""
         discount = calculate_discount_percent(None, None)
         assert discount == 0.0
-
-
-class TestCalculateMarketplaceStats:
-    """Тесты для расчета статистики маркетплейса."""
     
-    def test_calculate_marketplace_stats_with_changes(self):
-        """Тестирует расчет статистики с изменениями."""
-        # Создаем mock результаты
-        today_result1 = Mock()
-        today_result1.product_code = "ABC123"
-        today_result1.market_price = 100.0
-        today_result1.showcase_price = 80.0  # 20% скидка
-        
-        today_result2 = Mock()
-        today_result2.product_code = "DEF456"
-        today_result2.market_price = 200.0
-        today_result2.showcase_price = 180.0  # 10% скидка
-        
-        today_result3 = Mock()
-        today_result3.product_code = "GHI789"
-        today_result3.market_price = 300.0
-        today_result3.showcase_price = 270.0  # 10% скидка (новый товар)
-        
-        previous_result1 = Mock()
-        previous_result1.product_code = "ABC123"
-        previous_result1.market_price = 100.0
-        previous_result1.showcase_price = 90.0  # 10% скидка (была меньше)
-        
-        previous_result2 = Mock()
-        previous_result2.product_code = "DEF456"
-        previous_result2.market_price = 200.0
-        previous_result2.showcase_price = 160.0  # 20% скидка (была больше)
-        
-        today_results = [today_result1, today_result2, today_result3]
-        previous_results = [previous_result1, previous_result2]
+    def test_sql_discount_matches_python(self):
+        """Тестирует что скидка в SQL статистики сводки совпадает с calculate_discount_percent."""
+        import sqlite3
+        from services.daily_summary_service import SUMMARY_DISCOUNT_SQL
         
-        stats = calculate_marketplace_stats(today_results, previous_results)
+        prices = [(100.0, 80.0), (0.0, 80.0), (100.0, 0.0), (None, None), (-5.0, 3.0), (299.0, 201.0)]
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE cur (market_price REAL, showcase_price REAL)")
+        conn.executemany("INSERT INTO cur VALUES (?, ?)", prices)
         
-        assert stats.total_tracked == 3
-        assert stats.increased == 1  # ABC123: 10% -> 20%
-        assert stats.decreased == 1  # DEF456: 20% -> 10%
-        assert stats.unchanged == 0
-        assert stats.new_products == 1  # GHI789
-    
-    def test_calculate_marketplace_stats_no_previous_data(self):
-        """Тестирует статистику без предыдущих данных."""
-        today_results = [Mock(), Mock()]
-        previous_results = []
-        
-        stats = calculate_marketplace_stats(today_results, previous_results)
+        sql_discounts = [row[0] for row in conn.execute(f"SELECT {SUMMARY_DISCOUNT_SQL.format(p='cur')} FROM cur")]
         
-        assert stats.total_tracked == 2
-        assert stats.new_products == 2
-        assert stats.increased == 0
-        assert stats.decreased == 0
-        assert stats.unchanged == 0
+        assert sql_discounts == pytest.approx([round(calculate_discount_percent(mp, sp), 2) for mp, sp in prices])
 
 
 class TestGetMarketplaceDisplayInfo:
@@ -306,8 +340,6 @@ class TestFormatSummaryMessage:
         summary_data = SummaryData(
             client=client,
             marketplace="ozon",
-            today_results=[],
-            previous_results=[],
             today_timestamp=today_timestamp,
             previous_timestamp=None,
             stats=stats
@@ -325,6 +357,27 @@ class TestFormatSummaryMessage:
         assert "5" in message    # decreased and new_products
         assert "80" in message   # unchanged
 
+    
+    def test_format_summary_message_with_previous_slice(self):
+        """Тестирует вывод срезов по МСК и экранирование имени клиента."""
+        client = Mock()
+        client.name = "A & B"
+        client.id = "client123"
+        
+        summary_data = SummaryData(
+            client=client,
+            marketplace="wb",
+            today_timestamp=datetime(2024, 1, 1, 21, 30),
+            previous_timestamp=datetime(2024, 1, 1, 6, 0),
+            stats=MarketplaceStats(3, 1, 1, 1, 0)
+        )
+        
+        message = format_summary_message(summary_data, date(2024, 1, 2))
+        
+        assert "<b>Клиент:</b> A &amp; B (ID: client123)\n" in message
+        assert "<b>Текущий срез:</b> 02.01.2024 00:30 МСК\n" in message
+        assert "<b>Сравнение с:</b> 01.01.2024 09:00 МСК\n\n" in message
+        assert message.endswith("• Новые товары: 0\n\n")
 
 class TestCreateInlineKeyboard:
     """Тесты для создания inline клавиатуры."""
@@ -340,15 +393,22 @@ class TestCreateInlineKeyboard:
         assert "EXCEL" in button["text"]
         assert "excel_report|client123|2024-01-01|ozon" == button["callback_data"]
 
+    
+    def test_create_inline_keyboard_unknown_marketplace(self):
+        """Тестирует текст кнопки для маркетплейса без готовой подписи."""
+        keyboard = create_inline_keyboard("client123", date(2024, 1, 1), "market")
+        
+        button = keyboard["inline_keyboard"][0][0]
+        assert button["text"] == "📥 Подробный отчет Market (EXCEL)"
+        assert button["callback_data"] == "excel_report|client123|2024-01-01|market"
 
 class TestSendTelegramMessage:
     """Тесты для отправки сообщений в Telegram."""
     
-    @patch('services.daily_summary_service.os.getenv')
-    @patch('services.daily_summary_service.requests.post')
-    def test_send_telegram_message_success(self, mock_post, mock_getenv):
+    @patch('services.daily_summary_service.BOT_TOKEN', "test_token")
+    @patch('services.daily_summary_service.telegram_http_session.post')
+    def test_send_telegram_message_success(self, mock_post):
         """Тестирует успешную отправку сообщения."""
-        mock_getenv.return_value = "test_token"
         mock_response = Mock()
         mock_response.status_code = 200
         mock_post.return_value = mock_response
@@ -358,20 +418,36 @@ class TestSendTelegramMessage:
         assert result is True
         mock_post.assert_called_once()
     
-    @patch('services.daily_summary_service.os.getenv')
-    def test_send_telegram_message_no_token(self, mock_getenv):
+    @patch('services.daily_summary_service.BOT_TOKEN', "test_token")
+    @patch('services.daily_summary_service.telegram_http_session.post')
+    def test_send_telegram_message_serializes_payload(self, mock_post):
+        """Тестирует что тело запроса - готовый JSON (orjson) с заголовком Content-Type."""
+        import json
+        mock_post.return_value = Mock(status_code=200)
+        reply_markup = {"inline_keyboard": [[{"text": "📥 Отчет", "callback_data": "x"}]]}
+        
+        send_telegram_message("chat123", "Отчет <b>СПП</b>", reply_markup)
+        
+        kwargs = mock_post.call_args[1]
+        assert kwargs["headers"] == {"Content-Type": "application/json"}
+        assert json.loads(kwargs["data"]) == {
+            "chat_id": "chat123",
+            "text": "Отчет <b>СПП</b>",
+            "parse_mode": "HTML",
+            "reply_markup": reply_markup
+        }
+    
+    @patch('services.daily_summary_service.BOT_TOKEN', None)
+    def test_send_telegram_message_no_token(self):
         """Тестирует отправку без токена."""
-        mock_getenv.return_value = None
-        
         result = send_telegram_message("chat123", "Test message", {})
         
         assert result is False
     
-    @patch('services.daily_summary_service.os.getenv')
-    @patch('services.daily_summary_service.requests.post')
-    def test_send_telegram_message_api_error(self, mock_post, mock_getenv):
+    @patch('services.daily_summary_service.BOT_TOKEN', "test_token")
+    @patch('services.daily_summary_service.telegram_http_session.post')
+    def test_send_telegram_message_api_error(self, mock_post):
         """Тестирует обработку ошибки API."""
-        mock_getenv.return_value = "test_token"
         mock_response = Mock()
         mock_response.status_code = 400
         mock_response.text = "Bad Request"
@@ -385,45 +461,31 @@ class TestSendTelegramMessage:
 class TestGenerateSummaryForMarketplace:
     """Тесты для генерации отчета по маркетплейсу."""
     
-    @patch('services.daily_summary_service.fetch_today_results')
-    @patch('services.daily_summary_service.fetch_previous_results')
-    @patch('services.daily_summary_service.calculate_marketplace_stats')
-    def test_generate_summary_success(self, mock_calc_stats, mock_fetch_prev, mock_fetch_today):
+    def test_generate_summary_success(self):
         """Тестирует успешную генерацию отчета."""
-        mock_session = Mock()
         mock_client = Mock()
         mock_client.id = "client123"
         
-        today_results = [Mock()]
-        today_results[0].timestamp = datetime(2024, 1, 1, 12, 0, 0)
-        mock_fetch_today.return_value = today_results
-        
-        previous_results = [Mock()]
-        previous_results[0].timestamp = datetime(2024, 1, 1, 10, 0, 0)
-        mock_fetch_prev.return_value = previous_results
+        stats_row = Mock(
+            today_timestamp=datetime(2024, 1, 1, 12, 0, 0),
+            previous_timestamp=datetime(2024, 1, 1, 10, 0, 0),
+            total_tracked=3, increased=1, decreased=1, unchanged=0, new_products=1
+        )
         
-        stats = MarketplaceStats(1, 0, 0, 1, 0)
-        mock_calc_stats.return_value = stats
-        
-        today = date(2024, 1, 1)
-        result = generate_summary_for_marketplace(mock_session, mock_client, "ozon", today)
+        result = generate_summary_for_marketplace(mock_client, "ozon", stats_row)
         
         assert result is not None
         assert result.client == mock_client
         assert result.marketplace == "ozon"
-        assert result.stats == stats
+        assert result.stats == MarketplaceStats(3, 1, 1, 0, 1)
+        assert result.previous_timestamp == datetime(2024, 1, 1, 10, 0, 0)
     
-    @patch('services.daily_summary_service.fetch_today_results')
-    def test_generate_summary_no_data(self, mock_fetch_today):
+    def test_generate_summary_no_data(self):
         """Тестирует генерацию при отсутствии данных."""
-        mock_session = Mock()
         mock_client = Mock()
         mock_client.id = "client123"
         
-        mock_fetch_today.return_value = []
-        
-        today = date(2024, 1, 1)
-        result = generate_summary_for_marketplace(mock_session, mock_client, "ozon", today)
+        result = generate_summary_for_marketplace(mock_client, "ozon", None)
         
         assert result is None
 
@@ -434,10 +496,10 @@ class TestSendDailySummaryRefactored:
     @patch('services.daily_summary_service.get_sync_session')
     @patch('services.daily_summary_service.get_redis_client')
     @patch('services.daily_summary_service.get_clients_for_summary')
-    @patch('services.daily_summary_service.is_summary_already_sent')
+    @patch('services.daily_summary_service.get_already_sent_client_ids')
     @patch('services.daily_summary_service.process_marketplace_summary')
-    @patch('services.daily_summary_service.mark_summary_as_sent')
-    def test_send_daily_summary_success(self, mock_mark, mock_process, mock_is_sent, 
+    @patch('services.daily_summary_service.mark_summaries_as_sent')
+    def test_send_daily_summary_success(self, mock_mark, mock_process, mock_already_sent, 
                                         mock_get_clients, mock_redis, mock_session):
         """Тестирует успешную отправку отчетов."""
         # Arrange
@@ -446,7 +508,7 @@ class TestSendDailySummaryRefactored:
         mock_client.group_chat_id = "chat123"
         
         mock_get_clients.return_value = [mock_client]
-        mock_is_sent.return_value = False
+        mock_already_sent.return_value = set()
         mock_process.return_value = True
         
         # Act
@@ -456,6 +518,7 @@ class TestSendDailySummaryRefactored:
         assert result == 2  # 2 marketplaces
         mock_process.assert_called()
         mock_mark.assert_called_once()
+        assert mock_mark.call_args[0][1] == ["client123"]
     
     @patch('services.daily_summary_service.get_sync_session')
     @patch('services.daily_summary_service.get_redis_client')
@@ -467,7 +530,80 @@ class TestSendDailySummaryRefactored:
         result = send_daily_summary_refactored("nonexistent")
         
         assert result == 0
+    
+    @patch('services.daily_summary_service.get_sync_session')
+    @patch('services.daily_summary_service.get_redis_client')
+    @patch('services.daily_summary_service.get_clients_for_summary')
+    @patch('services.daily_summary_service.get_already_sent_client_ids')
+    def test_send_daily_summary_all_sent_skips_stats_query(self, mock_already_sent, mock_get_clients,
+                                                           mock_redis, mock_session):
+        """Тестирует что для уже обработанных клиентов статистика не запрашивается."""
+        mock_get_clients.return_value = [Mock(id="client123", group_chat_id="chat123")]
+        mock_already_sent.return_value = {"client123"}
+        
+        result = send_daily_summary_refactored()
+        
+        assert result == 0
+        mock_session.return_value.execute.assert_not_called()
+        mock_session.return_value.close.assert_called_once()
 
+    
+    @patch('services.daily_summary_service.get_sync_session')
+    @patch('services.daily_summary_service.get_redis_client')
+    @patch('services.daily_summary_service.get_clients_for_summary')
+    @patch('services.daily_summary_service.get_already_sent_client_ids')
+    @patch('services.daily_summary_service.process_marketplace_summary')
+    @patch('services.daily_summary_service.mark_summaries_as_sent')
+    def test_send_daily_summary_many_clients(self, mock_mark, mock_process, mock_already_sent,
+                                             mock_get_clients, mock_redis, mock_session):
+        """Тестирует параллельную отправку нескольким клиентам с порядком маркетплейсов внутри клиента."""
+        # Arrange
+        clients = [Mock(id=f"client{i}", group_chat_id=f"chat{i}") for i in range(5)]
+        mock_get_clients.return_value = clients
+        mock_already_sent.return_value = set()
+        mock_process.side_effect = lambda client, marketplace, today, stats_row: client.id != "client3"
+        
+        # Act
+        result = send_daily_summary_refactored()
+        
+        # Assert
+        assert result == 8
+        assert sorted(mock_mark.call_args[0][1]) == ["client0", "client1", "client2", "client4"]
+        for client in clients:
+            markets = [c[0][1] for c in mock_process.call_args_list if c[0][0] is client]
+            assert markets == ["ozon", "wb"]
+
+    
+    @patch('services.daily_summary_service.get_sync_session')
+    @patch('services.daily_summary_service.get_redis_client')
+    @patch('services.daily_summary_service.get_clients_for_summary')
+    def test_db_error_propagates_from_run_only(self, mock_get_clients, mock_redis, mock_session):
+        """Тестирует что run_daily_summary пробрасывает ошибку БД, а обертка возвращает 0."""
+        mock_get_clients.side_effect = Exception("DB error")
+        
+        with pytest.raises(Exception, match="DB error"):
+            run_daily_summary("client123")
+        
+        assert send_daily_summary_refactored("client123") == 0
+        assert mock_session.return_value.close.call_count == 2
+
+class TestSendClientSummaries:
+    """Тесты для отправки сводок одному клиенту."""
+    
+    @patch('services.daily_summary_service.process_marketplace_summary')
+    def test_counts_sent_marketplaces(self, mock_process):
+        """Тестирует подсчет отправленных сводок и передачу статистики маркетплейса."""
+        # Arrange
+        client = Mock(id="client123")
+        stats = {("client123", "wb"): "wb_row"}
+        mock_process.side_effect = [False, True]
+        
+        # Act
+        result = send_client_summaries(client, date(2024, 1, 15), stats)
+        
+        # Assert
+        assert result == 1
+        assert [c[0][3] for c in mock_process.call_args_list] == [None, "wb_row"]
 
 class TestComplexityReduction:
     """Тесты для проверки снижения цикломатической сложности."""
@@ -478,18 +614,17 @@ class TestComplexityReduction:
             get_redis_client,
             safe_error_message,
             get_clients_for_summary,
-            is_summary_already_sent,
-            mark_summary_as_sent,
-            fetch_today_results,
-            fetch_previous_results,
+            get_already_sent_client_ids,
+            mark_summaries_as_sent,
+            fetch_summary_stats,
             calculate_discount_percent,
-            calculate_marketplace_stats,
             get_marketplace_display_info,
             format_summary_message,
             create_inline_keyboard,
             send_telegram_message,
             generate_summary_for_marketplace,
             send_daily_summary_refactored,
+            run_daily_summary,
             process_marketplace_summary
         ]
         
@@ -503,7 +638,7 @@ class TestComplexityReduction:
         import inspect
         
         # Получаем исходный код основной функции
-        source = inspect.getsource(send_daily_summary_refactored)
+        source = inspect.getsource(run_daily_summary)
         
         # Простой подсчет условных операторов
         if_count = source.count('if ')
@@ -4,11 +4,16 @@ Unit тесты для модуля services/excel_processor.py
 Покрывают рефакторенную функцию sync_load_excel.
 """
 
+import io
+import os
 import pytest
+import numpy as np
 import pandas as pd
+from openpyxl import Workbook
 import tempfile
-import os
+from types import SimpleNamespace
 from unittest.mock import Mock, patch, MagicMock
+from sqlalchemy.dialects import postgresql
 from services.excel_processor import (
     ValidationError,
     ProcessingResult,
@@ -16,43 +21,66 @@ from services.excel_processor import (
     validate_excel_columns,
     check_for_duplicates,
     validate_row_data,
+    validate_rows_vectorized,
     find_account_id,
     upsert_product,
+    upsert_products_bulk,
     process_single_row,
+    save_products,
     process_excel_rows,
     sync_load_excel_refactored,
     validate_excel_file_exists,
     get_file_info,
     REQUIRED_COLUMNS,
+    REQUIRED_COLUMNS_SET,
+    PRODUCT_UPSERT_BATCH_SIZE,
     ALLOWED_MARKETS
 )
 
 
+def write_xlsx(file, headers, rows):
+    """
+    Записывает Excel файл потоково, без DataFrame и объектов Cell на каждую ячейку.
+    
+    Args:
+        file: Путь или бинарный файл (например, BytesIO)
+        headers: Заголовки колонок
+        rows: Строки данных
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(headers)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(file)
+
+
+@pytest.fixture(scope="session")
+def sample_xlsx_bytes():
+    """Содержимое Excel файла с одной корректной строкой; сериализуется один раз на сессию тестов."""
+    buffer = io.BytesIO()
+    write_xlsx(buffer, REQUIRED_COLUMNS, [
+        ['TEST', 'ozon', 'test_acc', '12345', 'Test Product', 'http://test.com']
+    ])
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="session")
+def sample_xlsx(tmp_path_factory, sample_xlsx_bytes):
+    """Тот же Excel файл на диске, для функций, которым нужен путь."""
+    path = tmp_path_factory.mktemp("excel") / "sample.xlsx"
+    path.write_bytes(sample_xlsx_bytes)
+    return str(path)
+
+
 class TestExcelFileOperations:
     """Тесты операций с Excel файлами."""
 
-    def test_read_excel_file_success(self):
-        """Тест успешного чтения Excel файла."""
-        # Создаем временный Excel файл
-        test_data = pd.DataFrame({
-            'client_id': ['TEST'],
-            'market': ['ozon'],
-            'account_id': ['test_acc'],
-            'product_code': ['12345'],
-            'product_name': ['Test Product'],
-            'product_link': ['http://test.com']
-        })
-        
-        with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as tmp:
-            test_data.to_excel(tmp.name, index=False)
-            tmp_path = tmp.name
-
-        try:
-            result_df = read_excel_file(tmp_path)
-            assert len(result_df) == 1
-            assert result_df.iloc[0]['client_id'] == 'TEST'
-        finally:
-            os.unlink(tmp_path)
+    def test_read_excel_file_success(self, sample_xlsx_bytes):
+        """Тест успешного чтения Excel файла из памяти."""
+        result_df = read_excel_file(io.BytesIO(sample_xlsx_bytes))
+        assert len(result_df) == 1
+        assert result_df.iloc[0]['client_id'] == 'TEST'
 
     def test_read_excel_file_invalid_path(self):
         """Тест чтения несуществующего файла."""
@@ -68,20 +96,32 @@ class TestExcelFileOperations:
         """Тест проверки существования файла - не существует."""
         assert validate_excel_file_exists("/invalid/path") is False
 
-    def test_get_file_info_exists(self):
+    def test_get_file_info_exists(self, sample_xlsx):
         """Тест получения информации о существующем файле."""
-        with tempfile.NamedTemporaryFile(suffix='.xlsx') as tmp:
-            info = get_file_info(tmp.name)
-            assert info['exists'] is True
-            assert 'size' in info
-            assert 'modified' in info
-            assert info['extension'] == '.xlsx'
+        info = get_file_info(sample_xlsx)
+        assert info['exists'] is True
+        assert info['size'] > 0
+        assert 'modified' in info
+        assert info['extension'] == '.xlsx'
 
     def test_get_file_info_not_exists(self):
         """Тест получения информации о несуществующем файле."""
         info = get_file_info("/invalid/path")
         assert info['exists'] is False
 
+    def test_get_file_info_directory(self, tmp_path):
+        """Тест что директория не считается файлом."""
+        info = get_file_info(str(tmp_path))
+        assert info['exists'] is False
+
+    def test_get_file_info_single_stat(self, sample_xlsx):
+        """Тест что информация о файле собирается за один вызов stat()."""
+        with patch('os.stat', wraps=os.stat) as mock_stat:
+            info = get_file_info(sample_xlsx)
+        
+        assert info['exists'] is True
+        assert mock_stat.call_count == 1
+
 
 class TestDataValidation:
     """Тесты валидации данных."""
@@ -128,6 +168,56 @@ class TestDataValidation:
         assert len(duplicates) == 1
         assert ('CLIENT1', 'PROD1') in duplicates
 
+    @pytest.mark.parametrize("n", [1_000, 100_000])
+    def test_check_for_duplicates_large_frame(self, n):
+        """Тест проверки дубликатов на большом файле."""
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({
+            'client_id': rng.integers(0, 1000, n).astype(str),
+            'product_code': rng.integers(0, 50000, n).astype(str),
+            'market': 'ozon',
+            'account_id': 'acc1',
+            'product_name': 'Product',
+            'product_link': 'link'
+        })
+        
+        duplicates = check_for_duplicates(df)
+        
+        # Ключ считается дубликатом один раз, сколько бы раз он ни повторялся
+        counts = df.groupby(['client_id', 'product_code']).size().to_numpy()
+        assert not df[['client_id', 'product_code']].isnull().to_numpy().any()
+        assert len(duplicates) == int((counts > 1).sum())
+
+    def test_check_for_duplicates_uses_hashtable_path(self):
+        """Тест что дубликаты ищутся через DataFrame.duplicated, а не построчным циклом."""
+        n = 100_000
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({
+            'client_id': rng.integers(0, 1000, n).astype(str),
+            'product_code': rng.integers(0, 50000, n).astype(str)
+        })
+        
+        with patch.object(
+            pd.DataFrame, 'duplicated', autospec=True, side_effect=pd.DataFrame.duplicated
+        ) as mock_duplicated:
+            duplicates = check_for_duplicates(df)
+        
+        mock_duplicated.assert_called_once()
+        assert mock_duplicated.call_args.kwargs == {
+            'subset': ['client_id', 'product_code'], 'keep': 'first'
+        }
+        expected = df[df.duplicated(subset=['client_id', 'product_code'], keep=False).to_numpy()]
+        assert duplicates == set(expected.itertuples(index=False, name=None))
+
+    def test_check_for_duplicates_skips_empty_keys(self):
+        """Тест что строки без client_id или product_code не считаются дубликатами."""
+        df = pd.DataFrame({
+            'client_id': ['CLIENT1', 'CLIENT1', ' ', ' '],
+            'product_code': [' ', '', 'PROD1', 'PROD1']
+        })
+        
+        assert check_for_duplicates(df) == set()
+
     def test_validate_row_data_success(self):
         """Тест успешной валидации строки."""
         row_data = {
@@ -170,12 +260,9 @@ class TestDataValidation:
         result = validate_row_data(row_data, 2)
         assert result is not None and "неверный market" in result
 
-    @pytest.mark.parametrize("field_name", [
-        'market', 'account_id', 'product_code', 'product_name'
-    ])
-    def test_validate_row_data_empty_required_fields(self, field_name):
+    def test_validate_row_data_empty_required_fields(self):
         """Тест валидации с пустыми обязательными полями."""
-        row_data = {
+        base_row = {
             'client_id': 'CLIENT1',
             'market': 'ozon',
             'account_id': 'acc1',
@@ -183,10 +270,83 @@ class TestDataValidation:
             'product_name': 'Product 1',
             'product_link': 'http://link1.com'
         }
-        row_data[field_name] = ''  # Делаем поле пустым
         
-        result = validate_row_data(row_data, 2)
-        assert result is not None and (f"пустой {field_name}" in result or f"пустое {field_name}" in result)
+        for field_name in ('market', 'account_id', 'product_code', 'product_name'):
+            row_data = {**base_row, field_name: ''}  # Делаем поле пустым
+            
+            result = validate_row_data(row_data, 2)
+            assert result is not None, field_name
+            assert f"пустой {field_name}" in result or f"пустое {field_name}" in result
+
+    def test_validate_rows_vectorized_matches_row_validation(self):
+        """Тест что пакетная валидация дает те же сообщения, что построчная."""
+        n = 50_000
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({
+            'client_id': rng.choice(['CLIENT1', '', ' '], n, p=[0.98, 0.01, 0.01]),
+            'market': rng.choice(['ozon', 'wb', '', 'ebay'], n, p=[0.49, 0.49, 0.01, 0.01]),
+            'account_id': rng.choice(['acc1', ''], n, p=[0.99, 0.01]),
+            'product_code': rng.choice(['PROD1', ''], n, p=[0.99, 0.01]),
+            'product_name': rng.choice(['Product 1', ''], n, p=[0.99, 0.01]),
+            'product_link': 'link'
+        })
+        expected = [
+            validate_row_data({k: str(v).strip() for k, v in row.items()}, idx + 2)
+            for idx, row in zip(df.index, df.to_dict('records'))
+        ]
+        
+        result = validate_rows_vectorized(df)
+        
+        assert result.dtype == object
+        assert result.tolist() == expected
+        assert sum(message is not None for message in expected) > 0
+
+
+class StubConn:
+    """
+    Легкая замена соединения с БД для горячих тестов: без накладных расходов Mock.
+    
+    Args:
+        fetch: Строка, которую вернет fetchone() у результата execute()
+        fail_at: Номер вызова execute() (с 1) или множество номеров, на которых execute() выбросит исключение
+    """
+
+    def __init__(self, fetch=None, fail_at=None):
+        self._fetch = fetch
+        self._fail_at = {fail_at} if isinstance(fail_at, int) else set(fail_at or ())
+        self.executed = []
+        self.committed = 0
+        self.rolled_back = 0
+
+    def execute(self, statement, params=None):
+        self.executed.append((statement, params))
+        if len(self.executed) in self._fail_at:
+            raise Exception("DB Error")
+        return SimpleNamespace(fetchone=lambda: self._fetch)
+
+    def commit(self):
+        self.committed += 1
+
+    def rollback(self):
+        self.rolled_back += 1
+
+
+class StubEngine:
+    """Engine, у которого connect() отдает один и тот же StubConn без накладных расходов Mock."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.connect_calls = 0
+
+    def connect(self):
+        self.connect_calls += 1
+        return self
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, *exc_info):
+        return False
 
 
 class TestDatabaseOperations:
@@ -194,61 +354,93 @@ class TestDatabaseOperations:
 
     def test_find_account_id_success(self):
         """Тест успешного поиска аккаунта."""
-        mock_conn = Mock()
-        mock_result = Mock()
-        mock_result.fetchone.return_value = [123]
-        mock_conn.execute.return_value = mock_result
+        conn = StubConn([123])
         
-        result = find_account_id(mock_conn, 'CLIENT1', 'ozon', 'acc1')
+        result = find_account_id(conn, 'CLIENT1', 'ozon', 'acc1')
         
         assert result == 123
-        mock_conn.execute.assert_called_once()
+        assert len(conn.executed) == 1
 
     def test_find_account_id_not_found(self):
         """Тест поиска несуществующего аккаунта."""
-        mock_conn = Mock()
-        mock_result = Mock()
-        mock_result.fetchone.return_value = None
-        mock_conn.execute.return_value = mock_result
+        conn = StubConn(None)
         
-        result = find_account_id(mock_conn, 'CLIENT1', 'ozon', 'acc1')
+        result = find_account_id(conn, 'CLIENT1', 'ozon', 'acc1')
         
         assert result is None
 
     def test_find_account_id_exception(self):
         """Тест обработки исключения при поиске аккаунта."""
-        mock_conn = Mock()
-        mock_conn.execute.side_effect = Exception("DB Error")
+        conn = StubConn(fail_at=1)
         
-        result = find_account_id(mock_conn, 'CLIENT1', 'ozon', 'acc1')
+        result = find_account_id(conn, 'CLIENT1', 'ozon', 'acc1')
         
         assert result is None
 
     def test_upsert_product_success(self):
         """Тест успешного upsert товара."""
-        mock_conn = Mock()
+        conn = StubConn()
         
         result = upsert_product(
-            mock_conn, 'CLIENT1', 123, 'PROD1', 
+            conn, 'CLIENT1', 123, 'PROD1', 
             'Product 1', 'http://link1.com'
         )
         
         assert result is True
-        mock_conn.execute.assert_called_once()
-        mock_conn.commit.assert_called_once()
+        assert len(conn.executed) == 1
+        assert conn.committed == 1
 
     def test_upsert_product_exception(self):
         """Тест обработки исключения при upsert товара."""
-        mock_conn = Mock()
-        mock_conn.execute.side_effect = Exception("DB Error")
+        conn = StubConn(fail_at=1)
         
         result = upsert_product(
-            mock_conn, 'CLIENT1', 123, 'PROD1', 
+            conn, 'CLIENT1', 123, 'PROD1', 
             'Product 1', 'http://link1.com'
         )
         
         assert result is False
-        mock_conn.rollback.assert_called_once()
+        assert conn.rolled_back == 1
+
+    def test_upsert_products_bulk_single_statement(self):
+        """Тест что пачка товаров сохраняется одним запросом и одним commit."""
+        rows = [
+            {
+                'client_id': 'CLIENT1', 'account_id': 123, 'product_code': f'PROD{i}',
+                'product_name': f'Product {i}', 'product_link': f'http://link{i}.com'
+            }
+            for i in range(500)
+        ]
+        conn = StubConn()
+        
+        result = upsert_products_bulk(conn, rows)
+        
+        assert result is True
+        assert len(conn.executed) == 1
+        assert conn.committed == 1
+        
+        statement, _ = conn.executed[0]
+        compiled = statement.compile(dialect=postgresql.dialect())
+        assert "ON CONFLICT (account_id, product_code) DO UPDATE" in str(compiled)
+        assert len(compiled.params) == 500 * 5
+
+    def test_upsert_products_bulk_empty(self):
+        """Тест что пустая пачка не обращается к БД."""
+        conn = StubConn()
+        
+        assert upsert_products_bulk(conn, []) is True
+        assert conn.executed == []
+
+    def test_upsert_products_bulk_exception(self):
+        """Тест отката при ошибке пакетного upsert."""
+        conn = StubConn(fail_at=1)
+        rows = [{
+            'client_id': 'CLIENT1', 'account_id': 123, 'product_code': 'PROD1',
+            'product_name': 'Product 1', 'product_link': 'http://link1.com'
+        }]
+        
+        assert upsert_products_bulk(conn, rows) is False
+        assert conn.rolled_back == 1
 
 
 class TestRowProcessing:
@@ -256,7 +448,7 @@ class TestRowProcessing:
 
     def test_process_single_row_duplicate(self):
         """Тест обработки строки с дубликатом."""
-        mock_conn = Mock()
+        conn = StubConn()
         row_data = {
             'client_id': 'CLIENT1',
             'product_code': 'PROD1',
@@ -267,14 +459,15 @@ class TestRowProcessing:
         }
         duplicates = {('CLIENT1', 'PROD1')}
         
-        result = process_single_row(mock_conn, row_data, 2, duplicates)
+        result, product = process_single_row(conn, row_data, 2, duplicates, validate_row_data(row_data, 2))
         
+        assert product is None
         assert isinstance(result, ValidationError)
         assert "дубликат product_code" in result.error_message
 
     def test_process_single_row_validation_error(self):
         """Тест обработки строки с ошибкой валидации."""
-        mock_conn = Mock()
+        conn = StubConn()
         row_data = {
             'client_id': '',  # Пустой client_id
             'product_code': 'PROD1',
@@ -285,17 +478,15 @@ class TestRowProcessing:
         }
         duplicates = set()
         
-        result = process_single_row(mock_conn, row_data, 2, duplicates)
+        result, product = process_single_row(conn, row_data, 2, duplicates, validate_row_data(row_data, 2))
         
+        assert product is None
         assert isinstance(result, ValidationError)
         assert "пустой client_id" in result.error_message
 
     def test_process_single_row_account_not_found(self):
         """Тест обработки строки с несуществующим аккаунтом."""
-        mock_conn = Mock()
-        mock_result = Mock()
-        mock_result.fetchone.return_value = None
-        mock_conn.execute.return_value = mock_result
+        conn = StubConn(None)
         
         row_data = {
             'client_id': 'CLIENT1',
@@ -307,21 +498,15 @@ class TestRowProcessing:
         }
         duplicates = set()
         
-        result = process_single_row(mock_conn, row_data, 2, duplicates)
+        result, product = process_single_row(conn, row_data, 2, duplicates, validate_row_data(row_data, 2))
         
+        assert product is None
         assert isinstance(result, ValidationError)
         assert "аккаунт не найден" in result.error_message
 
-    def test_process_single_row_upsert_failed(self):
-        """Тест обработки строки с ошибкой upsert."""
-        mock_conn = Mock()
-        # Настраиваем успешный поиск аккаунта
-        mock_result = Mock()
-        mock_result.fetchone.return_value = [123]
-        mock_conn.execute.return_value = mock_result
-        
-        # Настраиваем провал upsert
-        mock_conn.execute.side_effect = [mock_result, Exception("Upsert failed")]
+    def test_process_single_row_success(self):
+        """Тест успешной обработки строки: товар готов к сохранению, но еще не сохранен."""
+        conn = StubConn([123])
         
         row_data = {
             'client_id': 'CLIENT1',
@@ -333,32 +518,35 @@ class TestRowProcessing:
         }
         duplicates = set()
         
-        result = process_single_row(mock_conn, row_data, 2, duplicates)
+        result, product = process_single_row(conn, row_data, 2, duplicates, validate_row_data(row_data, 2))
         
-        assert isinstance(result, ValidationError)
-        assert "ошибка при сохранении товара" in result.error_message
-
-    def test_process_single_row_success(self):
-        """Тест успешной обработки строки."""
-        mock_conn = Mock()
-        # Настраиваем успешный поиск аккаунта
-        mock_result = Mock()
-        mock_result.fetchone.return_value = [123]
-        mock_conn.execute.return_value = mock_result
-        
-        row_data = {
-            'client_id': 'CLIENT1',
-            'product_code': 'PROD1',
-            'market': 'ozon',
-            'account_id': 'acc1',
-            'product_name': 'Product 1',
-            'product_link': 'http://link1.com'
+        assert result is None  # Успех
+        assert product == {
+            'client_id': 'CLIENT1', 'account_id': 123, 'product_code': 'PROD1',
+            'product_name': 'Product 1', 'product_link': 'http://link1.com'
         }
-        duplicates = set()
+        assert len(conn.executed) == 1  # только поиск аккаунта
+        assert conn.committed == 0
+
+    def test_save_products_falls_back_to_single_rows(self):
+        """Тест что при ошибке пачки строки сохраняются по одной и ошибка указывает на строку."""
+        pending = [
+            (row_number, {'client_id': 'CLIENT1', 'product_code': f'PROD{row_number}'}, {
+                'client_id': 'CLIENT1', 'account_id': 123, 'product_code': f'PROD{row_number}',
+                'product_name': 'Product', 'product_link': 'link'
+            })
+            for row_number in (2, 3)
+        ]
+        # Пачка (первый execute) падает, затем строка 2 сохраняется, строка 3 падает
+        conn = StubConn(fail_at={1, 3})
         
-        result = process_single_row(mock_conn, row_data, 2, duplicates)
+        errors = save_products(conn, pending)
         
-        assert result is None  # Успех
+        assert [error.row_number for error in errors] == [3]
+        assert "ошибка при сохранении товара" in errors[0].error_message
+        assert len(conn.executed) == 3
+        assert conn.committed == 1
+        assert conn.rolled_back == 2
 
 
 class TestExcelProcessing:
@@ -378,15 +566,17 @@ class TestExcelProcessing:
             'product_link': ['link1', 'link2']
         })
         
-        mock_engine = Mock()
-        mock_conn = Mock()
-        mock_engine.connect.return_value.__enter__.return_value = mock_conn
+        engine = StubEngine(StubConn())
         
         mock_check_duplicates.return_value = set()
-        mock_process_row.return_value = None  # Успех для всех строк
+        mock_process_row.side_effect = [
+            (None, {'client_id': f'CLIENT{i}', 'account_id': i, 'product_code': f'PROD{i}',
+                    'product_name': f'Product {i}', 'product_link': f'link{i}'})
+            for i in (1, 2)
+        ]  # Успех для всех строк
         
         # Тест
-        result = process_excel_rows(df, mock_engine)
+        result = process_excel_rows(df, engine)
         
         # Проверки
         assert result.success_count == 2
@@ -408,20 +598,19 @@ class TestExcelProcessing:
             'product_link': ['link1', 'link2']
         })
         
-        mock_engine = Mock()
-        mock_conn = Mock()
-        mock_engine.connect.return_value.__enter__.return_value = mock_conn
+        engine = StubEngine(StubConn())
         
         mock_check_duplicates.return_value = set()
         
         # Первая строка успешна, вторая с ошибкой
         mock_process_row.side_effect = [
-            None,  # Успех для первой строки
-            ValidationError(3, "Test error", ["3", "CLIENT1", "PROD2", "wb", "acc2", "Product 2", "link2"])
+            (None, {'client_id': 'CLIENT1', 'account_id': 1, 'product_code': 'PROD1',
+                    'product_name': 'Product 1', 'product_link': 'link1'}),  # Успех для первой строки
+            (ValidationError(3, "Test error", ["3", "CLIENT1", "PROD2", "wb", "acc2", "Product 2", "link2"]), None)
         ]
         
         # Тест
-        result = process_excel_rows(df, mock_engine)
+        result = process_excel_rows(df, engine)
         
         # Проверки
         assert result.success_count == 1
@@ -429,6 +618,62 @@ class TestExcelProcessing:
         assert len(result.error_rows) == 1
         assert "Test error" in result.errors[0]
 
+    def test_process_excel_rows_large_file(self):
+        """Тест обработки 10 000 строк без iterrows, который создает Series на каждую строку."""
+        n = 10_000
+        df = pd.DataFrame({
+            'client_id': 'CLIENT1',
+            'product_code': [f'PROD{i}' for i in range(n)],
+            'market': 'ozon',
+            'account_id': 'acc1',
+            'product_name': 'Product',
+            'product_link': 'link'
+        }, index=range(n))
+        # StubEngine/StubConn вместо Mock: иначе время уходит на сам Mock, а не на обход строк
+        conn = StubConn([123])
+        
+        with patch.object(pd.DataFrame, 'iterrows', side_effect=AssertionError("iterrows не используется")):
+            result = process_excel_rows(df, StubEngine(conn))
+        
+        assert result.success_count == n
+        # Товары сохраняются пачками, а не commit на каждую строку
+        assert conn.committed == n // PRODUCT_UPSERT_BATCH_SIZE
+
+    def test_process_excel_rows_validates_file_at_once(self):
+        """Тест что строки валидируются пакетно, без построчного validate_row_data."""
+        df = pd.DataFrame({
+            'client_id': ['CLIENT1', ''],
+            'product_code': ['PROD1', 'PROD2'],
+            'market': ['ozon', 'wb'],
+            'account_id': ['acc1', 'acc2'],
+            'product_name': ['Product 1', 'Product 2'],
+            'product_link': ['link1', 'link2']
+        })
+        
+        with patch('services.excel_processor.validate_row_data', side_effect=AssertionError("построчная валидация")):
+            result = process_excel_rows(df, StubEngine(StubConn([123])))
+        
+        assert result.success_count == 1
+        assert result.errors == ["Строка 3: пустой client_id"]
+
+    def test_process_excel_rows_single_connection(self):
+        """Тест что на весь файл открывается одно соединение, а не по одному на строку."""
+        n = 1_000
+        df = pd.DataFrame({
+            'client_id': 'CLIENT1',
+            'product_code': [f'PROD{i}' for i in range(n)],
+            'market': 'ozon',
+            'account_id': 'acc1',
+            'product_name': 'Product',
+            'product_link': 'link'
+        })
+        engine = StubEngine(StubConn([123]))
+        
+        result = process_excel_rows(df, engine)
+        
+        assert result.success_count == n
+        assert engine.connect_calls == 1
+
     @patch('services.excel_processor.create_sync_engine')
     @patch('services.excel_processor.read_excel_file')
     @patch('services.excel_processor.validate_excel_columns')
@@ -492,6 +737,11 @@ class TestConstants:
         
         assert REQUIRED_COLUMNS == expected_columns
 
+    def test_required_columns_set_matches_list(self):
+        """Тест что множество обязательных колонок совпадает со списком."""
+        assert isinstance(REQUIRED_COLUMNS_SET, frozenset)
+        assert REQUIRED_COLUMNS_SET == set(REQUIRED_COLUMNS)
+
     def test_allowed_markets_complete(self):
         """Тест списка разрешенных маркетплейсов."""
         expected_markets = ['ozon', 'wb']
@@ -3,11 +3,11 @@
 Тест для локального воспроизведения ошибки с загрузкой Excel файлов
 """
 import asyncio
+import io
 import os
 import sys
-import tempfile
-import pandas as pd
 import html
+from openpyxl import Workbook
 from pathlib import Path
 
 # Добавляем корневую директорию в PYTHONPATH
@@ -17,6 +17,16 @@ def safe_error_message(error) -> str:
     """Безопасно экранирует HTML в сообщениях об ошибках"""
     return html.escape(str(error))
 
+def write_xlsx(file, rows):
+    """Записывает строки-словари в Excel потоково (write_only), без DataFrame"""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    headers = list(rows[0])
+    sheet.append(headers)
+    for row in rows:
+        sheet.append([row[header] for header in headers])
+    workbook.save(file)
+
 async def test_excel_upload_with_errors():
     """Тестируем загрузку Excel файла с ошибками"""
     print("🔍 Тестируем загрузку Excel файла с ошибками...")
@@ -56,16 +66,13 @@ async def test_excel_upload_with_errors():
             }
         ]
         
-        # Создаем временный Excel файл
-        df = pd.DataFrame(test_data)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-            df.to_excel(tmp.name, index=False)
-            test_file_path = tmp.name
-        
-        print(f"Создан тестовый файл: {test_file_path}")
+        # Создаем Excel файл в памяти: pandas читает его из BytesIO без записи на диск
+        test_file = io.BytesIO()
+        write_xlsx(test_file, test_data)
+        test_file.seek(0)
         
         # Тестируем загрузку
-        ok, errors, error_file_path = await excel_loader.load_excel(test_file_path)
+        ok, errors, error_file_path = await excel_loader.load_excel(test_file)
         
         print(f"Результат загрузки: {ok} успешных, {len(errors)} ошибок")
         
@@ -103,7 +110,6 @@ async def test_excel_upload_with_errors():
             print()
         
         # Очищаем временные файлы
-        os.unlink(test_file_path)
         if error_file_path and os.path.exists(error_file_path):
             os.unlink(error_file_path)
             
@@ -140,15 +146,17 @@ async def main():
     print("🚀 Запуск тестов загрузки Excel файлов...")
     print("=" * 60)
     
-    # Тест экранирования HTML
-    await test_html_escaping()
-    
-    print("=" * 60)
-    
-    # Тест загрузки Excel с ошибками
-    await test_excel_upload_with_errors()
+    # Тесты независимы: загрузка Excel ждет БД, экранирование в это время не блокирует
+    results = await asyncio.gather(
+        test_html_escaping(),
+        test_excel_upload_with_errors(),
+        return_exceptions=True
+    )
     
     print("=" * 60)
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
     print("✅ Тестирование завершено")
 
 if __name__ == "__main__":
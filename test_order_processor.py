@@ -5,8 +5,19 @@ Unit тесты для модуля services/order_processor.py
 """
 
 import pytest
-from unittest.mock import Mock, patch, MagicMock
+import requests
+import threading
+from contextlib import nullcontext
+from dataclasses import dataclass, replace
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Optional
+from unittest.mock import Mock, patch
+from sqlalchemy import BigInteger, create_engine, event, func, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from db.models import Account, Base, Client, Order, Result
 from services.order_processor import (
     AccountData,
     ProductBatch,
@@ -25,11 +36,88 @@ from services.order_processor import (
     send_order_refactored,
     validate_batch_size,
     get_batch_processing_info,
+    create_parser_http_session,
+    parser_http_session,
     DEFAULT_BATCH_SIZE,
     PARSER_BASE_URL
 )
 
 
+def make_session(*first, all_=None, raises=None):
+    """
+    Создает mock сессии с готовой цепочкой session.query(...).filter(...).
+    
+    Args:
+        first: Значения first(); если их несколько, возвращаются по очереди
+        all_: Значение all()
+        raises: Исключение, которое бросит session.query()
+        
+    Returns:
+        Mock сессии
+    """
+    session = Mock(spec=Session)
+    if raises is not None:
+        session.query.side_effect = raises
+        return session
+    
+    query = session.query.return_value.filter.return_value
+    if len(first) > 1:
+        query.first.side_effect = first
+    else:
+        query.first.return_value = first[0] if first else None
+    query.all.return_value = all_ if all_ is not None else []
+    return session
+
+
+@compiles(BigInteger, "sqlite")
+def _compile_bigint_sqlite(type_, compiler, **kw):
+    """В SQLite автоинкремент работает только у INTEGER PRIMARY KEY, а id в orders/results — BIGINT."""
+    return "INTEGER"
+
+
+@pytest.fixture
+def sqlite_session():
+    """
+    Настоящая сессия SQLAlchemy на SQLite в памяти и список выполненных SQL.
+    
+    В отличие от Mock сессии ловит лишние запросы: построчные INSERT, N+1 SELECT.
+    """
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    statements = []
+    
+    @event.listens_for(engine, "before_cursor_execute")
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, executemany))
+    
+    with Session(engine, expire_on_commit=False) as session:
+        yield session, statements
+    engine.dispose()
+
+
+@dataclass(slots=True)
+class FakeProduct:
+    """Товар из БД для тестов: только поля, которые читает order_processor."""
+    product_code: str
+    product_name: str
+    product_link: Optional[str]
+    id: int = 0
+
+
+@pytest.fixture(scope="session")
+def ozon_account_data():
+    """Данные Ozon аккаунта; тесты их не изменяют, поэтому создаются один раз на сессию."""
+    return AccountData(
+        account_id=123,
+        client_id="CLIENT1",
+        market="ozon",
+        region="77",
+        account_id_str="acc123",
+        api_key="key123",
+        ozon_client_id="ozon_client_123"
+    )
+
+
 class TestDataModels:
     """Тесты структур данных."""
 
@@ -88,15 +176,9 @@ class TestValidation:
 
     def test_validate_client_and_account_success(self):
         """Тест успешной валидации клиента и аккаунта."""
-        mock_session = Mock()
-        mock_client = Mock()
-        mock_client.id = "CLIENT1"
-        mock_account = Mock()
-        mock_account.id = 123
-        
-        mock_session.query.return_value.filter.return_value.first.side_effect = [
-            mock_client, mock_account
-        ]
+        mock_client = Mock(spec=Client, id="CLIENT1")
+        mock_account = Mock(spec=Account, id=123)
+        mock_session = make_session(mock_client, mock_account)
         
         client, account = validate_client_and_account(mock_session, "CLIENT1", 123)
         
@@ -105,8 +187,7 @@ class TestValidation:
 
     def test_validate_client_and_account_client_not_found(self):
         """Тест валидации с несуществующим клиентом."""
-        mock_session = Mock()
-        mock_session.query.return_value.filter.return_value.first.return_value = None
+        mock_session = make_session(None)
         
         client, account = validate_client_and_account(mock_session, "CLIENT1", 123)
         
@@ -115,58 +196,31 @@ class TestValidation:
 
     def test_validate_client_and_account_exception(self):
         """Тест обработки исключения при валидации."""
-        mock_session = Mock()
-        mock_session.query.side_effect = Exception("DB Error")
+        mock_session = make_session(raises=Exception("DB Error"))
         
         client, account = validate_client_and_account(mock_session, "CLIENT1", 123)
         
         assert client is None
         assert account is None
 
-    def test_validate_product_link_wb_valid(self):
-        """Тест валидации валидной WB ссылки."""
-        link = "https://www.wildberries.ru/catalog/123456"
-        result = validate_product_link(link, "wb")
-        
-        assert result == link
-
-    def test_validate_product_link_ozon_valid(self):
-        """Тест валидации валидной Ozon ссылки."""
-        link = "https://www.ozon.ru/product/123456"
-        result = validate_product_link(link, "ozon")
-        
-        assert result == link
-
-    def test_validate_product_link_invalid_market(self):
-        """Тест валидации ссылки с неверным маркетплейсом."""
-        link = "https://www.wildberries.ru/catalog/123456"
-        result = validate_product_link(link, "ozon")
-        
-        assert result is None
-
-    def test_validate_product_link_empty(self):
-        """Тест валидации пустой ссылки."""
-        result = validate_product_link("", "ozon")
-        
-        assert result is None
-
-    def test_validate_batch_size_valid(self):
-        """Тест валидации корректного размера пакета."""
-        result = validate_batch_size(500)
-        
-        assert result == 500
-
-    def test_validate_batch_size_zero(self):
-        """Тест валидации нулевого размера пакета."""
-        result = validate_batch_size(0)
-        
-        assert result == DEFAULT_BATCH_SIZE
-
-    def test_validate_batch_size_too_large(self):
-        """Тест валидации слишком большого размера пакета."""
-        result = validate_batch_size(15000)
-        
-        assert result == 10000
+    @pytest.mark.parametrize("link,market,expected", [
+        ("https://www.wildberries.ru/catalog/123456", "wb", "https://www.wildberries.ru/catalog/123456"),
+        ("https://www.ozon.ru/product/123456", "ozon", "https://www.ozon.ru/product/123456"),
+        ("https://www.wildberries.ru/catalog/123456", "ozon", None),
+        ("", "ozon", None),
+    ], ids=["wb_valid", "ozon_valid", "invalid_market", "empty"])
+    def test_validate_product_link(self, link, market, expected):
+        """Тест валидации ссылки на товар."""
+        assert validate_product_link(link, market) == expected
+
+    @pytest.mark.parametrize("batch_size,expected", [
+        (500, 500),
+        (0, DEFAULT_BATCH_SIZE),
+        (15000, 10000),
+    ], ids=["valid", "zero", "too_large"])
+    def test_validate_batch_size(self, batch_size, expected):
+        """Тест валидации размера пакета."""
+        assert validate_batch_size(batch_size) == expected
 
 
 class TestProductProcessing:
@@ -174,9 +228,9 @@ class TestProductProcessing:
 
     def test_get_products_for_account_success(self):
         """Тест успешного получения товаров."""
-        mock_session = Mock()
-        mock_products = [Mock(), Mock(), Mock()]
-        mock_session.query.return_value.filter.return_value.all.return_value = mock_products
+        mock_session = Mock(spec=Session)
+        mock_products = [FakeProduct(f"PROD{i}", f"Product {i}", None) for i in range(3)]
+        mock_session.execute.return_value.all.return_value = mock_products
         
         products = get_products_for_account(mock_session, "CLIENT1", 123)
         
@@ -185,8 +239,8 @@ class TestProductProcessing:
 
     def test_get_products_for_account_no_products(self):
         """Тест получения товаров - товары не найдены."""
-        mock_session = Mock()
-        mock_session.query.return_value.filter.return_value.all.return_value = []
+        mock_session = Mock(spec=Session)
+        mock_session.execute.return_value.all.return_value = []
         
         products = get_products_for_account(mock_session, "CLIENT1", 123)
         
@@ -194,52 +248,37 @@ class TestProductProcessing:
 
     def test_get_products_for_account_exception(self):
         """Тест обработки исключения при получении товаров."""
-        mock_session = Mock()
-        mock_session.query.side_effect = Exception("DB Error")
+        mock_session = Mock(spec=Session)
+        mock_session.execute.side_effect = Exception("DB Error")
         
         products = get_products_for_account(mock_session, "CLIENT1", 123)
         
         assert len(products) == 0
 
-    def test_prepare_product_batch(self):
+    def test_prepare_product_batch(self, ozon_account_data):
         """Тест подготовки пакета товаров."""
-        mock_products = []
-        for i in range(3):
-            product = Mock()
-            product.product_code = f"PROD{i}"
-            product.product_name = f"Product {i}"
-            product.product_link = f"https://www.ozon.ru/product/{i}"
-            mock_products.append(product)
-        
-        account_data = AccountData(
-            account_id=123,
-            client_id="CLIENT1",
-            market="ozon",
-            region="77",
-            account_id_str="acc123",
-            api_key="key123"
-        )
+        products = [
+            FakeProduct(f"PROD{i}", f"Product {i}", f"https://www.ozon.ru/product/{i}")
+            for i in range(3)
+        ]
         
-        batch = prepare_product_batch(mock_products, account_data, 0, 2)
+        batch = prepare_product_batch(products, ozon_account_data, 0, 2)
         
         assert len(batch.products) == 2
         assert len(batch.product_codes) == 2
         assert batch.product_codes == ["PROD0", "PROD1"]
         assert "CLIENT1" in batch.task_id
 
-    def test_create_task_id_ozon(self):
-        """Тест создания task_id для Ozon."""
-        task_id = create_task_id("CLIENT1", "ozon")
+    @pytest.mark.parametrize("market,prefix", [
+        ("ozon", "CLIENT1O"),
+        ("wb", "CLIENT1W"),
+    ], ids=["ozon", "wb"])
+    def test_create_task_id(self, market, prefix):
+        """Тест создания task_id: буква маркетплейса и метка времени."""
+        task_id = create_task_id("CLIENT1", market)
         
-        assert task_id.startswith("CLIENT1O")
-        assert len(task_id) == len("CLIENT1O20240101123456")
-
-    def test_create_task_id_wb(self):
-        """Тест создания task_id для WB."""
-        task_id = create_task_id("CLIENT1", "wb")
-        
-        assert task_id.startswith("CLIENT1W")
-        assert len(task_id) == len("CLIENT1W20240101123456")
+        assert task_id.startswith(prefix)
+        assert len(task_id) == len(prefix + "20240101123456")
 
 
 class TestAccountData:
@@ -247,18 +286,17 @@ class TestAccountData:
 
     def test_create_account_data(self):
         """Тест создания данных аккаунта."""
-        mock_client = Mock()
-        mock_client.id = "CLIENT1"
-        
-        mock_account = Mock()
-        mock_account.id = 123
-        mock_account.market = "ozon"
-        mock_account.region = "77"
-        mock_account.account_id = "acc123"
-        mock_account.api_key = "key123"
-        mock_account.ozon_client_id = "ozon_client_123"
+        client = SimpleNamespace(id="CLIENT1")
+        account = SimpleNamespace(
+            id=123,
+            market="ozon",
+            region="77",
+            account_id="acc123",
+            api_key="key123",
+            ozon_client_id="ozon_client_123"
+        )
         
-        account_data = create_account_data(mock_client, mock_account)
+        account_data = create_account_data(client, account)
         
         assert account_data.client_id == "CLIENT1"
         assert account_data.account_id == 123
@@ -269,95 +307,105 @@ class TestAccountData:
 class TestMarketplaceIntegration:
     """Тесты интеграции с маркетплейсами."""
 
-    @patch('services.order_processor.get_initial_market_prices_ozon')
-    def test_get_marketplace_prices_ozon(self, mock_ozon_prices):
-        """Тест получения цен с Ozon."""
-        mock_ozon_prices.return_value = {"123": 100.0, "456": 200.0}
-        
-        account_data = AccountData(
-            account_id=123,
-            client_id="CLIENT1",
-            market="ozon",
-            region="77",
-            account_id_str="acc123",
-            api_key="ozon_key",
-            ozon_client_id="ozon_client_123"
+    @pytest.mark.parametrize("market,collector,expected_config,expected", [
+        ("ozon", "get_initial_market_prices_ozon",
+         {'ozon_client_id': 'ozon_client_123', 'ozon_api_key': 'key123'}, {"123": 100.0}),
+        ("wb", "get_initial_market_prices_wb", {'wb_api_key': 'key123'}, {"123": 100.0}),
+        ("unsupported", None, None, {}),
+    ], ids=["ozon", "wb", "unsupported"])
+    def test_get_marketplace_prices(self, ozon_account_data, market, collector, expected_config, expected):
+        """Тест выбора API маркетплейса для получения цен."""
+        account_data = replace(ozon_account_data, market=market)
+        patcher = (
+            patch(f'services.order_processor.{collector}', return_value={"123": 100.0})
+            if collector else nullcontext()
         )
         
-        prices = get_marketplace_prices(["123", "456"], account_data, False)
+        with patcher as mock_collector:
+            prices = get_marketplace_prices(["123"], account_data, False)
         
-        assert prices == {"123": 100.0, "456": 200.0}
-        mock_ozon_prices.assert_called_once()
-
-    @patch('services.order_processor.get_initial_market_prices_wb')
-    def test_get_marketplace_prices_wb(self, mock_wb_prices):
-        """Тест получения цен с WB."""
-        mock_wb_prices.return_value = {"789": 50.0}
-        
-        account_data = AccountData(
-            account_id=123,
-            client_id="CLIENT1",
-            market="wb",
-            region="77",
-            account_id_str="acc123",
-            api_key="wb_key"
-        )
-        
-        prices = get_marketplace_prices(["789"], account_data, False)
-        
-        assert prices == {"789": 50.0}
-        mock_wb_prices.assert_called_once()
-
-    def test_get_marketplace_prices_unsupported_market(self):
-        """Тест получения цен с неподдерживаемого маркетплейса."""
-        account_data = AccountData(
-            account_id=123,
-            client_id="CLIENT1",
-            market="unsupported",
-            region="77",
-            account_id_str="acc123",
-            api_key="key123"
-        )
-        
-        prices = get_marketplace_prices(["123"], account_data, False)
-        
-        assert prices == {}
+        assert prices == expected
+        if collector:
+            mock_collector.assert_called_once_with(["123"], expected_config, False)
 
     @patch('services.order_processor.get_initial_market_prices_ozon')
-    def test_get_marketplace_prices_exception(self, mock_ozon_prices):
+    def test_get_marketplace_prices_exception(self, mock_ozon_prices, ozon_account_data):
         """Тест обработки исключения при получении цен."""
         mock_ozon_prices.side_effect = Exception("API Error")
         
-        account_data = AccountData(
-            account_id=123,
-            client_id="CLIENT1",
-            market="ozon",
-            region="77",
-            account_id_str="acc123",
-            api_key="ozon_key"
-        )
-        
-        prices = get_marketplace_prices(["123"], account_data, False)
+        prices = get_marketplace_prices(["123"], ozon_account_data, False)
         
         assert prices == {}
 
 
+@pytest.fixture
+def parser_error_server():
+    """
+    Локальный HTTP-сервер, отвечающий на любой GET/POST статусом из пути (/503 -> 503).
+    
+    Yields:
+        Tuple[base_url, attempts]; attempts - список методов принятых запросов
+    """
+    attempts = []
+    
+    class GatewayErrorHandler(BaseHTTPRequestHandler):
+        def _reply(self):
+            attempts.append(self.command)
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            self.send_response(int(self.path.strip("/")))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        
+        do_GET = do_POST = _reply
+        
+        def log_message(self, *args):
+            pass
+    
+    server = ThreadingHTTPServer(("127.0.0.1", 0), GatewayErrorHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", attempts
+    server.shutdown()
+    server.server_close()
+
+
 class TestParserIntegration:
     """Тесты интеграции с парсером."""
 
-    def test_create_parser_payload(self):
+    def test_parser_http_session_retries_unprocessed_requests(self):
+        """Тест настройки повторов запросов в HTTP-сессии парсера."""
+        session = create_parser_http_session()
+        retry = session.get_adapter(PARSER_BASE_URL).max_retries
+        
+        assert retry.total == 5
+        assert set(retry.status_forcelist) == {429, 503}
+        assert "POST" in retry.allowed_methods
+        assert retry.respect_retry_after_header is True
+        assert retry.read is False  # таймаут чтения POST не повторяется
+        assert retry.raise_on_status is False
+
+    @pytest.mark.parametrize("method,status,expected_attempts", [
+        ("POST", 503, 6),  # первый запрос + RETRY_TOTAL повторов
+        ("POST", 429, 6),
+        ("GET", 503, 6),
+        ("POST", 502, 1),  # заказ мог быть принят, повтора нет
+        ("POST", 504, 1),
+    ])
+    def test_parser_http_session_returns_response_when_retries_exhausted(
+            self, parser_error_server, monkeypatch, method, status, expected_attempts):
+        """Тест что после исчерпания повторов возвращается последний ответ, а не RetryError."""
+        monkeypatch.setattr("services.order_processor.RETRY_BACKOFF_FACTOR", 0)
+        base_url, attempts = parser_error_server
+        session = create_parser_http_session()
+        
+        response = session.request(method, f"{base_url}/{status}", json={}, timeout=5)
+        
+        assert response.status_code == status
+        assert len(attempts) == expected_attempts
+
+    def test_create_parser_payload(self, ozon_account_data):
         """Тест создания payload для парсера."""
-        mock_client = Mock()
-        mock_client.parser_api_key = "parser_key_123"
-        
-        account_data = AccountData(
-            account_id=123,
-            client_id="CLIENT1",
-            market="ozon",
-            region="77",
-            account_id_str="acc123",
-            api_key="key123"
-        )
+        client = SimpleNamespace(parser_api_key="parser_key_123")
         
         batch = ProductBatch(
             products=[{"code": "123", "name": "Product 1"}],
@@ -365,7 +413,7 @@ class TestParserIntegration:
             task_id="CLIENT1O20240101123456"
         )
         
-        payload = create_parser_payload(mock_client, account_data, batch)
+        payload = create_parser_payload(client, ozon_account_data, batch)
         
         assert payload["apikey"] == "parser_key_123"
         assert payload["regionid"] == "77"
@@ -373,12 +421,10 @@ class TestParserIntegration:
         assert payload["userlabel"] == "CLIENT1O20240101123456"
         assert len(payload["products"]) == 1
 
-    @patch('services.order_processor.requests.post')
+    @patch('services.order_processor.parser_http_session.post')
     def test_send_batch_to_parser_success(self, mock_post):
         """Тест успешной отправки в парсер."""
-        mock_response = Mock()
-        mock_response.status_code = 200
-        mock_response.text = "Success"
+        mock_response = Mock(spec=["status_code", "text"], status_code=200, text="Success")
         mock_post.return_value = mock_response
         
         payload = {"userlabel": "test_task"}
@@ -389,6 +435,17 @@ class TestParserIntegration:
         assert text == "Success"
         mock_post.assert_called_once()
 
+    def test_send_batch_to_parser_reuses_http_session(self):
+        """Тест что пакеты отправляются через одну HTTP-сессию с пулом соединений."""
+        with patch.object(parser_http_session, "post") as mock_post:
+            mock_post.return_value = Mock(spec=["status_code", "text"], status_code=200, text="OK")
+
+            send_batch_to_parser({"userlabel": "task_1"}, False)
+            send_batch_to_parser({"userlabel": "task_2"}, False)
+
+        assert mock_post.call_count == 2
+        assert isinstance(parser_http_session, requests.Session)
+
     def test_send_batch_to_parser_test_mode(self):
         """Тест отправки в парсер в тестовом режиме."""
         payload = {"userlabel": "test_task"}
@@ -398,7 +455,7 @@ class TestParserIntegration:
         assert status == 200
         assert "TEST MODE" in text
 
-    @patch('services.order_processor.requests.post')
+    @patch('services.order_processor.parser_http_session.post')
     def test_send_batch_to_parser_exception(self, mock_post):
         """Тест обработки исключения при отправке в парсер."""
         mock_post.side_effect = Exception("Network Error")
@@ -414,18 +471,9 @@ class TestParserIntegration:
 class TestDatabaseOperations:
     """Тесты операций с базой данных."""
 
-    def test_save_order_and_results_success(self):
+    def test_save_order_and_results_success(self, ozon_account_data):
         """Тест успешного сохранения заказа и результатов."""
-        mock_session = Mock()
-        
-        account_data = AccountData(
-            account_id=123,
-            client_id="CLIENT1",
-            market="ozon",
-            region="77",
-            account_id_str="acc123",
-            api_key="key123"
-        )
+        mock_session = Mock(spec=Session)
         
         batch = ProductBatch(
             products=[
@@ -439,26 +487,57 @@ class TestDatabaseOperations:
         prices = {"123": 100.0, "456": 200.0}
         
         result = save_order_and_results(
-            mock_session, "CLIENT1", account_data, batch, prices, 999
+            mock_session, "CLIENT1", ozon_account_data, batch, prices, 999
+        )
+        
+        assert result is True
+        mock_session.add.assert_called_once()  # только заказ
+        mock_session.execute.assert_called_once()  # результаты одним bulk INSERT
+        results_rows = mock_session.execute.call_args.args[1]
+        assert [row["product_code"] for row in results_rows] == ["123", "456"]
+        assert [row["market_price"] for row in results_rows] == [100.0, 200.0]
+        assert results_rows[0]["product_link"] == "http://link1.com"
+        assert results_rows[1]["product_link"] is None
+
+    def test_save_order_and_results_sql(self, sqlite_session, ozon_account_data):
+        """Тест SQL на реальной сессии: один INSERT заказа и один executemany результатов."""
+        session, statements = sqlite_session
+        batch = ProductBatch(
+            products=[{"code": str(i), "name": f"Product {i}", "linkset": []} for i in range(100)],
+            product_codes=[str(i) for i in range(100)],
+            task_id="CLIENT1O20240101123456"
+        )
+        
+        result = save_order_and_results(
+            session, "CLIENT1", ozon_account_data, batch, {"1": 100.0}, 999
         )
+        session.commit()
         
         assert result is True
-        assert mock_session.add.call_count == 3  # 1 order + 2 results
+        assert [(sql.split()[2], many) for sql, many in statements] == [
+            ("orders", False), ("results", True)
+        ]
+        assert session.scalar(select(func.count()).select_from(Order)) == 1
+        assert session.scalar(select(func.count()).select_from(Result)) == 100
 
-    def test_save_order_and_results_exception(self):
-        """Тест обработки исключения при сохранении."""
-        mock_session = Mock()
-        mock_session.add.side_effect = Exception("DB Error")
+    def test_save_order_and_results_empty_batch_skips_insert(self, ozon_account_data):
+        """Тест что для пустого пакета bulk INSERT результатов не выполняется."""
+        mock_session = Mock(spec=Session)
+        batch = ProductBatch(products=[], product_codes=[], task_id="CLIENT1O20240101123456")
         
-        account_data = AccountData(
-            account_id=123,
-            client_id="CLIENT1",
-            market="ozon",
-            region="77",
-            account_id_str="acc123",
-            api_key="key123"
+        result = save_order_and_results(
+            mock_session, "CLIENT1", ozon_account_data, batch, {}, 999
         )
         
+        assert result is True
+        mock_session.add.assert_called_once()
+        mock_session.execute.assert_not_called()
+
+    def test_save_order_and_results_exception(self, ozon_account_data):
+        """Тест обработки исключения при сохранении."""
+        mock_session = Mock(spec=Session)
+        mock_session.add.side_effect = Exception("DB Error")
+        
         batch = ProductBatch(
             products=[{"code": "123", "name": "Product 1", "linkset": []}],
             product_codes=["123"],
@@ -466,7 +545,7 @@ class TestDatabaseOperations:
         )
         
         result = save_order_and_results(
-            mock_session, "CLIENT1", account_data, batch, {}, 999
+            mock_session, "CLIENT1", ozon_account_data, batch, {}, 999
         )
         
         assert result is False
@@ -475,6 +554,32 @@ class TestDatabaseOperations:
 class TestBatchProcessing:
     """Тесты пакетной обработки."""
 
+    @patch('services.order_processor.time.sleep')
+    @patch('services.order_processor.save_order_and_results')
+    @patch('services.order_processor.send_batch_to_parser')
+    @patch('services.order_processor.get_marketplace_prices')
+    def test_process_products_in_batches(
+        self, mock_prices, mock_send, mock_save, mock_sleep, ozon_account_data
+    ):
+        """Тест пакетной обработки с параллельным получением цен и отправкой."""
+        mock_prices.return_value = {"PROD0": 100.0}
+        mock_send.return_value = (200, "OK")
+        mock_save.return_value = True
+        
+        client = SimpleNamespace(id="CLIENT1", parser_api_key="parser_key")
+        products = [FakeProduct(f"PROD{i}", f"Product {i}", None, id=i) for i in range(3)]
+        
+        orders_created = process_products_in_batches(
+            Mock(spec=Session), client, ozon_account_data, products, 2, False
+        )
+        
+        assert orders_created == 2
+        assert mock_prices.call_count == 2
+        assert mock_send.call_count == 2
+        # ID последнего товара в каждом пакете
+        assert [c.args[5] for c in mock_save.call_args_list] == [1, 2]
+        mock_sleep.assert_called_once()
+
     def test_get_batch_processing_info(self):
         """Тест получения информации о пакетной обработке."""
         info = get_batch_processing_info(1500, 500)
@@ -491,85 +596,75 @@ class TestBatchProcessing:
         assert info["total_batches"] == 3  # 500 + 500 + 1
 
 
+@pytest.fixture
+def patched_order(monkeypatch):
+    """
+    Подменяет зависимости send_order_refactored через monkeypatch.
+    
+    Сессия берется из db.session.get_sync_session: send_order_refactored
+    импортирует ее внутри функции, поэтому подменяется атрибут модуля db.session.
+    """
+    session = Mock(spec=Session)
+    get_session = Mock(return_value=session)
+    validate = Mock(return_value=(Mock(spec=Client), Mock(spec=Account)))
+    get_products = Mock(return_value=[FakeProduct("PROD1", "Product 1", None)])
+    process = Mock(return_value=0)
+    
+    monkeypatch.setattr("db.session.get_sync_session", get_session)
+    monkeypatch.setattr("services.order_processor.validate_client_and_account", validate)
+    monkeypatch.setattr("services.order_processor.get_products_for_account", get_products)
+    monkeypatch.setattr("services.order_processor.process_products_in_batches", process)
+    
+    return SimpleNamespace(
+        session=session, get_session=get_session, validate=validate,
+        get_products=get_products, process=process
+    )
+
+
 class TestMainFunction:
     """Тесты главной функции."""
 
-    @patch('services.order_processor.get_sync_session')
-    @patch('services.order_processor.validate_client_and_account')
-    @patch('services.order_processor.get_products_for_account')
-    @patch('services.order_processor.process_products_in_batches')
-    def test_send_order_refactored_success(
-        self, mock_process_batches, mock_get_products, 
-        mock_validate, mock_get_session
-    ):
+    def test_send_order_refactored_success(self, patched_order):
         """Тест успешного выполнения главной функции."""
-        # Подготовка
-        mock_session = Mock()
-        mock_get_session.return_value = mock_session
-        
-        mock_client = Mock()
-        mock_account = Mock()
-        mock_validate.return_value = (mock_client, mock_account)
-        
-        mock_products = [Mock(), Mock()]
-        mock_get_products.return_value = mock_products
+        patched_order.process.return_value = 2
         
-        mock_process_batches.return_value = 2
-        
-        # Тест
         result = send_order_refactored("CLIENT1", 123, 1000, False)
         
-        # Проверки
         assert result.success is True
         assert result.orders_created == 2
         assert result.error_message is None
         
-        mock_validate.assert_called_once_with(mock_session, "CLIENT1", 123)
-        mock_get_products.assert_called_once_with(mock_session, "CLIENT1", 123)
-        mock_process_batches.assert_called_once()
-        mock_session.commit.assert_called_once()
-        mock_session.close.assert_called_once()
+        patched_order.validate.assert_called_once_with(patched_order.session, "CLIENT1", 123)
+        patched_order.get_products.assert_called_once_with(patched_order.session, "CLIENT1", 123)
+        patched_order.process.assert_called_once()
+        patched_order.session.commit.assert_called_once()
+        patched_order.session.close.assert_called_once()
 
-    @patch('services.order_processor.get_sync_session')
-    @patch('services.order_processor.validate_client_and_account')
-    def test_send_order_refactored_client_not_found(self, mock_validate, mock_get_session):
+    def test_send_order_refactored_client_not_found(self, patched_order):
         """Тест с несуществующим клиентом."""
-        mock_session = Mock()
-        mock_get_session.return_value = mock_session
-        mock_validate.return_value = (None, None)
+        patched_order.validate.return_value = (None, None)
         
         result = send_order_refactored("CLIENT1", 123)
         
         assert result.success is False
         assert result.orders_created == 0
         assert "не найден" in result.error_message
+        patched_order.session.close.assert_called_once()
 
-    @patch('services.order_processor.get_sync_session')
-    @patch('services.order_processor.validate_client_and_account')
-    @patch('services.order_processor.get_products_for_account')
-    def test_send_order_refactored_no_products(
-        self, mock_get_products, mock_validate, mock_get_session
-    ):
+    def test_send_order_refactored_no_products(self, patched_order):
         """Тест без товаров."""
-        mock_session = Mock()
-        mock_get_session.return_value = mock_session
-        
-        mock_client = Mock()
-        mock_account = Mock()
-        mock_validate.return_value = (mock_client, mock_account)
-        
-        mock_get_products.return_value = []
+        patched_order.get_products.return_value = []
         
         result = send_order_refactored("CLIENT1", 123)
         
         assert result.success is False
         assert result.orders_created == 0
         assert "не найдены" in result.error_message
+        patched_order.process.assert_not_called()
 
-    @patch('services.order_processor.get_sync_session')
-    def test_send_order_refactored_exception(self, mock_get_session):
+    def test_send_order_refactored_exception(self, patched_order):
         """Тест обработки исключения в главной функции."""
-        mock_get_session.side_effect = Exception("Critical error")
+        patched_order.get_session.side_effect = Exception("Critical error")
         
         result = send_order_refactored("CLIENT1", 123)
         
@@ -5,51 +5,94 @@ Unit тесты для рефакторенных функций генерац
 """
 
 import pytest
+import functools
+import html
+import inspect
 import io
+import re
+from collections import Counter
 from datetime import datetime, date
+from decimal import Decimal
 from unittest.mock import Mock, patch, MagicMock
+
+import numpy as np
+from urllib3.filepost import encode_multipart_formdata
+
 from services.telegram_notifier import (
     safe_error_message,
     get_marketplace_display_name,
     get_marketplace_suffix,
     create_excel_report_caption,
-    create_excel_filename
+    create_excel_filename,
+    create_telegram_http_session,
+    TELEGRAM_RETRIES,
+    send_document_to_telegram,
+    EXCEL_MIME_TYPE
+)
+from services.report_generator import (
+    validate_report_params,
+    fetch_report_results,
+    REPORT_FETCH_BATCH_SIZE,
+    get_report_results_statement,
+    calculate_discount_percents,
+    calculate_discount_percent,
+    calculate_report_stats,
+    get_report_template,
+    generate_excel_file,
+    ReportData,
+    generate_excel_file_pyexcelerate,
+    excel_hyperlink_formula,
+    create_excel_workbook,
+    serialize_report_results,
+    deserialize_report_results,
+    get_report_cache_key,
+    REPORT_CACHE_TTL
 )
+from tasks.refactored_reports import (
+    send_excel_report_v2_refactored,
+    generate_all_marketplace_reports,
+    generate_report_for_marketplace,
+    collect_marketplace_report_results,
+    load_report_results,
+    validate_excel_report_request,
+    REPORT_VALIDATE_CACHE_TTL,
+    invalidate_report_validation
+)
+
+
+XSS_TEXT = "<script>alert('xss')</script> & other"
+
+BRANCH_KEYWORDS_RE = re.compile(r"\b(?:if|elif|for|while|try|except)\b")
+
+
+@functools.cache
+def _report_source() -> str:
+    """Исходник send_excel_report_v2_refactored; читается с диска один раз."""
+    return inspect.getsource(send_excel_report_v2_refactored)
 
 
 class TestTelegramNotifier:
     """Тесты для сервиса Telegram уведомлений."""
     
-    def test_safe_error_message_escapes_html(self):
-        """Тестирует экранирование HTML символов."""
-        # Arrange
-        text = "<script>alert('xss')</script> & other"
-        expected = "&lt;script&gt;alert('xss')&lt;/script&gt; &amp; other"
-        
-        # Act
-        result = safe_error_message(text)
-        
-        # Assert
-        assert result == expected
-    
-    def test_safe_error_message_handles_empty_string(self):
-        """Тестирует обработку пустой строки."""
-        assert safe_error_message("") == ""
-        assert safe_error_message(None) == ""
+    @pytest.mark.parametrize("text,expected", [
+        (XSS_TEXT, html.escape(XSS_TEXT, quote=False)),
+        ("", ""),
+        (None, ""),
+    ], ids=["html", "empty", "none"])
+    def test_safe_error_message(self, text, expected):
+        """Тестирует экранирование HTML (кавычки не трогаются) и пустые значения."""
+        assert safe_error_message(text) == expected
     
-    def test_get_marketplace_display_name(self):
-        """Тестирует получение отображаемого названия маркетплейса."""
-        assert get_marketplace_display_name("ozon") == " Ozon"
-        assert get_marketplace_display_name("wb") == " Wildberries"
-        assert get_marketplace_display_name(None) == ""
-        assert get_marketplace_display_name("unknown") == ""
-    
-    def test_get_marketplace_suffix(self):
-        """Тестирует получение суффикса файла."""
-        assert get_marketplace_suffix("ozon") == "_Ozon"
-        assert get_marketplace_suffix("wb") == "_WB"
-        assert get_marketplace_suffix(None) == ""
-        assert get_marketplace_suffix("unknown") == ""
+    @pytest.mark.parametrize("market,display,suffix", [
+        ("ozon", " Ozon", "_Ozon"),
+        ("wb", " Wildberries", "_WB"),
+        (None, "", ""),
+        ("unknown", "", ""),
+    ], ids=["ozon", "wb", "none", "unknown"])
+    def test_marketplace_display_name_and_suffix(self, market, display, suffix):
+        """Тестирует отображаемое название маркетплейса и суффикс файла."""
+        assert get_marketplace_display_name(market) == display
+        assert get_marketplace_suffix(market) == suffix
     
     def test_create_excel_report_caption(self):
         """Тестирует создание подписи для отчета."""
@@ -75,6 +118,15 @@ class TestTelegramNotifier:
         expected_ozon = "report_comparison_client123_2024-01-15_Ozon.xlsx"
         assert filename_ozon == expected_ozon
 
+    
+    def test_telegram_session_retries_only_unprocessed_requests(self):
+        """Тестирует что POST повторяется при ошибке соединения и 429, но не при таймауте чтения."""
+        retries = create_telegram_http_session().get_adapter("https://api.telegram.org").max_retries
+        
+        assert retries.connect == TELEGRAM_RETRIES
+        assert retries.read == 0
+        assert retries.is_retry("POST", 429)
+        assert not retries.is_retry("POST", 500)
 
 class TestReportGenerator:
     """Тесты для генератора отчетов."""
@@ -85,9 +137,7 @@ class TestReportGenerator:
         # Arrange
         mock_client = Mock()
         mock_client.group_chat_id = "12345"
-        mock_session.query.return_value.filter.return_value.first.return_value = mock_client
-        
-        from services.report_generator import validate_report_params
+        mock_session.get.return_value = mock_client
         
         # Act
         client, result_date = validate_report_params("client123", "2024-01-15", mock_session)
@@ -102,9 +152,7 @@ class TestReportGenerator:
         # Arrange
         mock_client = Mock()
         mock_client.group_chat_id = "12345"
-        mock_session.query.return_value.filter.return_value.first.return_value = mock_client
-        
-        from services.report_generator import validate_report_params
+        mock_session.get.return_value = mock_client
         
         # Act
         client, result_date = validate_report_params("client123", "invalid-date", mock_session)
@@ -117,9 +165,7 @@ class TestReportGenerator:
     def test_validate_report_params_missing_client(self, mock_session):
         """Тестирует валидацию с отсутствующим клиентом."""
         # Arrange
-        mock_session.query.return_value.filter.return_value.first.return_value = None
-        
-        from services.report_generator import validate_report_params
+        mock_session.get.return_value = None
         
         # Act
         client, result_date = validate_report_params("nonexistent", "2024-01-15", mock_session)
@@ -128,6 +174,465 @@ class TestReportGenerator:
         assert client is None
         assert result_date is None
 
+    def test_fetch_report_results_splits_current_and_previous(self):
+        """Тестирует разделение одного запроса на текущий и предыдущий срезы."""
+        # Arrange
+        timestamp = datetime(2024, 1, 15, 10, 0)
+        current_row = Mock(product_code="A1", is_previous=False)
+        previous_row = Mock(product_code="A1", is_previous=True, showcase_price=900,
+                            market_price=1000, timestamp=timestamp)
+        mock_session = Mock()
+        mock_session.execute.return_value = [current_row, previous_row]
+
+        # Act
+        current_results, previous_data = fetch_report_results(
+            mock_session, "client123", date(2024, 1, 15), "ozon"
+        )
+
+        # Assert
+        mock_session.execute.assert_called_once()
+        params = mock_session.execute.call_args[0][1]
+        assert params["marketplace"] == "ozon"
+        assert current_results == [current_row]
+        assert previous_data == {"A1": (900, 1000, timestamp)}
+
+    def test_fetch_report_results_uses_server_side_cursor(self):
+        """Тестирует что срезы читаются потоково (yield_per -> серверный курсор)."""
+        # Arrange
+        mock_session = Mock()
+        mock_session.execute.return_value = []
+
+        # Act
+        fetch_report_results(mock_session, "client123", date(2024, 1, 15), None)
+
+        # Assert
+        statement, params = mock_session.execute.call_args[0]
+        assert statement.get_execution_options()["yield_per"] == REPORT_FETCH_BATCH_SIZE
+        assert "marketplace" not in params
+
+    def test_report_results_statement_is_reused(self):
+        """Тестирует что запрос отчета создается один раз на вариант фильтра."""
+        # Arrange
+        mock_session = Mock()
+        mock_session.execute.return_value = []
+
+        # Act
+        fetch_report_results(mock_session, "client123", date(2024, 1, 15), "ozon")
+        fetch_report_results(mock_session, "client456", date(2024, 1, 16), "wb")
+
+        # Assert
+        first, second = [c[0][0] for c in mock_session.execute.call_args_list]
+        assert first is second
+        assert first is get_report_results_statement(True)
+        assert get_report_results_statement(False) is not first
+
+    def test_calculate_discount_percents_matches_scalar_version(self):
+        """Тестирует что векторный расчет скидки совпадает со скалярным."""
+        # Arrange
+        market_prices = np.array([1000.0, 0.0, 500.0, -10.0])
+        showcase_prices = np.array([800.0, 100.0, 0.0, 5.0])
+
+        # Act
+        result = calculate_discount_percents(market_prices, showcase_prices)
+
+        # Assert
+        expected = [calculate_discount_percent(mp, sp) for mp, sp in zip(market_prices, showcase_prices)]
+        assert result.tolist() == pytest.approx(expected)
+
+    def test_calculate_report_stats(self):
+        """Тестирует подсчет статистики изменений скидок."""
+        # Arrange
+        current = np.array([0.20, 0.10, 0.15, 0.30])
+        previous = np.array([0.10, 0.20, 0.151, 0.0])
+        has_previous = np.array([True, True, True, False])
+
+        # Act
+        stats = calculate_report_stats(current, previous, has_previous)
+
+        # Assert
+        assert stats.increased == 1
+        assert stats.decreased == 1
+        assert stats.unchanged == 1
+        assert stats.new_products == 1
+
+    def test_get_report_template(self):
+        """Тестирует выбор разметки листа по фильтру маркетплейса."""
+        assert get_report_template(None).sheet_name == "Отчет"
+        assert get_report_template(None).headers[-1] == "Маркетплейс"
+        assert get_report_template("ozon").sheet_name == "Отчет_Ozon"
+        assert get_report_template("wb").sheet_name == "Отчет_WB"
+        assert "Маркетплейс" not in get_report_template("wb").headers
+        assert len(get_report_template("ozon").headers) == len(get_report_template("ozon").column_widths)
+        assert get_report_template("unknown").sheet_name == "Отчет"
+
+    def test_generate_excel_file_writes_rows_and_stats(self):
+        """Тестирует генерацию Excel файла и подсчет статистики."""
+        # Arrange
+        openpyxl = pytest.importorskip("openpyxl")
+
+        timestamp = datetime(2024, 1, 15, 10, 0)
+        current_results = [
+            Mock(product_code="A1", product_name="Товар 1", product_link="https://ozon.ru/1",
+                 market_price=1000.0, showcase_price=800.0, timestamp=timestamp, market="ozon"),
+            Mock(product_code="B2", product_name="Товар 2", product_link=None,
+                 market_price=500.0, showcase_price=500.0, timestamp=timestamp, market="wb"),
+        ]
+        previous_data = {"A1": (900.0, 1000.0, timestamp)}
+        report_data = ReportData(
+            current_results=current_results,
+            previous_data=previous_data,
+            client=Mock(),
+            date=date(2024, 1, 15),
+            marketplace=None
+        )
+
+        # Act
+        excel_buffer, stats = generate_excel_file(report_data)
+
+        # Assert
+        assert stats.increased == 1
+        assert stats.new_products == 1
+        worksheet = openpyxl.load_workbook(excel_buffer).active
+        assert worksheet.title == "Отчет"
+        assert worksheet.cell(row=1, column=1).value == "Артикул"
+        assert worksheet.cell(row=2, column=1).value == "A1"
+        assert worksheet.cell(row=2, column=6).value == pytest.approx(0.2)
+        assert worksheet.cell(row=2, column=9).value == pytest.approx(0.1)
+        assert worksheet.cell(row=3, column=11).value == "Wildberries"
+
+    def test_generate_excel_file_writes_clickable_links(self):
+        """Тестирует что ссылки на товары пишутся гиперссылками, а пустые - пустой строкой."""
+        # Arrange
+        openpyxl = pytest.importorskip("openpyxl")
+
+        timestamp = datetime(2024, 1, 15, 10, 0)
+        report_data = ReportData(
+            current_results=[
+                Mock(product_code="A1", product_name="Товар 1", product_link="https://ozon.ru/1",
+                     market_price=1000.0, showcase_price=800.0, timestamp=timestamp, market="ozon"),
+                Mock(product_code="B2", product_name="Товар 2", product_link=None,
+                     market_price=500.0, showcase_price=500.0, timestamp=timestamp, market="wb"),
+            ],
+            previous_data={},
+            client=Mock(),
+            date=date(2024, 1, 15),
+            marketplace=None
+        )
+
+        # Act
+        with patch("services.report_generator.REPORT_EXCEL_BACKEND", "xlsxwriter"):
+            excel_buffer, _ = generate_excel_file(report_data)
+
+        # Assert
+        worksheet = openpyxl.load_workbook(excel_buffer).active
+        link_cell = worksheet.cell(row=2, column=3)
+        assert link_cell.value == "https://ozon.ru/1"
+        assert link_cell.hyperlink.target == "https://ozon.ru/1"
+        assert worksheet.cell(row=3, column=3).hyperlink is None
+
+    @pytest.mark.parametrize("link,expected", [
+        ("https://ozon.ru/1", '=HYPERLINK("https://ozon.ru/1")'),
+        ('https://ozon.ru/?q="x"', '=HYPERLINK("https://ozon.ru/?q=""x""")'),
+        ("", ""),
+        ("not a link", "not a link"),
+        ("https://ozon.ru/" + "a" * 300, "https://ozon.ru/" + "a" * 300),
+    ], ids=["url", "quotes_escaped", "empty", "not_url", "too_long"])
+    def test_excel_hyperlink_formula(self, link, expected):
+        """Тестирует формулу HYPERLINK для ссылок в pyexcelerate."""
+        assert excel_hyperlink_formula(link) == expected
+
+    def test_pyexcelerate_backend_matches_xlsxwriter_values(self):
+        """Тестирует что pyexcelerate пишет те же значения, что и xlsxwriter."""
+        # Arrange
+        openpyxl = pytest.importorskip("openpyxl")
+        pytest.importorskip("pyexcelerate")
+
+        timestamp = datetime(2024, 1, 15, 10, 0)
+        report_data = ReportData(
+            current_results=[
+                Mock(product_code="A1", product_name="Товар 1", product_link="https://ozon.ru/1",
+                     market_price=1000.0, showcase_price=800.0, timestamp=timestamp, market="ozon"),
+                Mock(product_code="B2", product_name="Товар 2", product_link=None,
+                     market_price=500.0, showcase_price=500.0, timestamp=timestamp, market="wb"),
+            ],
+            previous_data={"A1": (900.0, 1000.0, timestamp)},
+            client=Mock(),
+            date=date(2024, 1, 15),
+            marketplace=None
+        )
+
+        # Act
+        fast_buffer, fast_stats = generate_excel_file_pyexcelerate(report_data)
+        buffer, stats = generate_excel_file(report_data)
+
+        # Assert
+        assert fast_stats == stats
+        fast_sheet = openpyxl.load_workbook(fast_buffer).active
+        sheet = openpyxl.load_workbook(buffer).active
+        assert fast_sheet.title == sheet.title
+        fast_values = [[cell.value for cell in row] for row in fast_sheet.iter_rows()]
+        values = [[cell.value for cell in row] for row in sheet.iter_rows()]
+        # Ссылки отличаются способом записи: формула HYPERLINK против гиперссылки ячейки
+        assert fast_values[1].pop(2) == '=HYPERLINK("https://ozon.ru/1")'
+        assert values[1].pop(2) == sheet.cell(row=2, column=3).hyperlink.target == "https://ozon.ru/1"
+        assert fast_values == values
+        assert fast_sheet.cell(row=2, column=6).number_format == "0.00%"
+
+    def test_excel_workbook_uses_constant_memory(self):
+        """Тестирует что workbook пишет строки в режиме constant_memory."""
+        # Arrange
+        # Act
+        workbook, _ = create_excel_workbook()
+
+        # Assert
+        assert workbook.constant_memory is True
+        assert workbook.in_memory is False
+        workbook.close()
+
+    def test_report_results_cache_round_trip(self):
+        """Тестирует сериализацию срезов отчета для кэша Redis."""
+        # Arrange
+        timestamp = datetime(2024, 1, 15, 10, 0)
+        current_results = [
+            Mock(product_code="A1", product_name="Товар 1", product_link=None,
+                 market_price=Decimal("1000.50"), showcase_price=None, timestamp=timestamp, market="ozon")
+        ]
+        previous_data = {"A1": (Decimal("900"), Decimal("1000"), timestamp)}
+
+        # Act
+        restored_current, restored_previous = deserialize_report_results(
+            serialize_report_results(current_results, previous_data)
+        )
+
+        # Assert
+        row = restored_current[0]
+        assert (row.product_code, row.product_name, row.product_link) == ("A1", "Товар 1", None)
+        assert row.market_price == pytest.approx(1000.5)
+        assert row.showcase_price is None
+        assert row.timestamp == timestamp
+        assert row.market == "ozon"
+        assert restored_previous == {"A1": (900.0, 1000.0, timestamp)}
+
+    def test_report_cache_key_changes_with_orders_version(self):
+        """Тестирует что ключ кэша меняется после изменения заказов клиента."""
+        # Arrange
+        mock_session = Mock()
+        mock_session.execute.return_value.scalar.side_effect = [
+            datetime(2024, 1, 15, 10, 0), datetime(2024, 1, 15, 12, 0), None
+        ]
+
+        # Act
+        first = get_report_cache_key(mock_session, "SEB", date(2024, 1, 15), "ozon")
+        second = get_report_cache_key(mock_session, "SEB", date(2024, 1, 15), "ozon")
+        empty = get_report_cache_key(mock_session, "SEB", date(2024, 1, 15), None)
+
+        # Assert
+        assert first == "report_results:SEB:2024-01-15:ozon:2024-01-15T10:00:00"
+        assert first != second
+        assert empty == "report_results:SEB:2024-01-15:all:none"
+
+
+class TestSendExcelReport:
+    """Тесты для send_excel_report_v2_refactored."""
+
+    @patch('tasks.refactored_reports.send_document_to_telegram')
+    @patch('tasks.refactored_reports.generate_excel_file')
+    @patch('tasks.refactored_reports.load_report_results')
+    @patch('tasks.refactored_reports.validate_report_params')
+    @patch('db.session.get_sync_session')
+    def test_session_closed_before_upload(self, mock_get_session, mock_validate, mock_load,
+                                          mock_generate, mock_send):
+        """Тестирует что соединение с БД освобождается до загрузки файла в Telegram."""
+        # Arrange
+        events = []
+        session = MagicMock()
+        session.__enter__.return_value = session
+        session.__exit__.side_effect = lambda *args: events.append("session_closed")
+        mock_get_session.return_value = session
+        mock_validate.return_value = (Mock(group_chat_id="chat"), date(2024, 1, 15))
+        mock_load.return_value = ([Mock()], {})
+        mock_generate.return_value = (io.BytesIO(b"xlsx"), Mock())
+        mock_send.side_effect = lambda **kwargs: events.append("upload") or True
+
+        # Act
+        result = send_excel_report_v2_refactored("SEB", "2024-01-15", "ozon")
+
+        # Assert
+        assert result is True
+        assert events == ["session_closed", "upload"]
+
+
+class TestGenerateAllMarketplaceReports:
+    """Тесты для параллельной генерации отчетов по маркетплейсам."""
+
+    @patch('tasks.refactored_reports.chord')
+    def test_reports_dispatched_as_chord(self, mock_chord):
+        """Тестирует постановку трех отчетов chord'ом без ожидания результатов в задаче."""
+        # Arrange
+        mock_chord.return_value.return_value.id = "chord-result-id"
+
+        # Act
+        result = generate_all_marketplace_reports("SEB", "2024-01-15")
+
+        # Assert
+        assert result == "chord-result-id"
+        signatures = mock_chord.call_args[0][0]
+        assert [tuple(sig.args) for sig in signatures] == [
+            ("SEB", "2024-01-15", "ozon"),
+            ("SEB", "2024-01-15", "wb"),
+            ("SEB", "2024-01-15", None),
+        ]
+        assert all(sig.task == generate_report_for_marketplace.name for sig in signatures)
+        callback = mock_chord.return_value.call_args[0][0]
+        assert callback.task == collect_marketplace_report_results.name
+        assert tuple(callback.args) == ("SEB",)
+        mock_chord.return_value.return_value.get.assert_not_called()
+
+    @patch('tasks.refactored_reports.chord')
+    def test_dispatch_failure_returns_none(self, mock_chord):
+        """Тестирует результат при недоступности брокера."""
+        # Arrange
+        mock_chord.return_value.side_effect = ConnectionError("broker down")
+
+        # Act
+        result = generate_all_marketplace_reports("SEB", "2024-01-15")
+
+        # Assert
+        assert result is None
+
+    def test_callback_collects_results(self):
+        """Тестирует сбор результатов подзадач в словарь {marketplace: success}."""
+        # Act
+        results = collect_marketplace_report_results([True, False, True], "SEB")
+
+        # Assert
+        assert results == {"ozon": True, "wb": False, "all": True}
+
+    @patch('tasks.refactored_reports.send_excel_report_v2_refactored')
+    def test_subtask_error_returns_false(self, mock_send):
+        """Тестирует что ошибка подзадачи не прерывает chord, а дает False."""
+        # Arrange
+        mock_send.side_effect = ValueError("boom")
+
+        # Act
+        result = generate_report_for_marketplace("SEB", "2024-01-15", "ozon")
+
+        # Assert
+        assert result is False
+
+
+class TestLoadReportResults:
+    """Тесты для кэширования срезов отчета в Redis."""
+
+    @patch('tasks.refactored_reports.fetch_report_results')
+    @patch('tasks.refactored_reports.get_report_cache_key', return_value="key")
+    @patch('tasks.refactored_reports.get_redis_client')
+    def test_cache_hit_skips_database_scan(self, mock_get_redis, mock_key, mock_fetch):
+        """Тестирует что при попадании в кэш срезы не читаются из БД."""
+        # Arrange
+        timestamp = datetime(2024, 1, 15, 10, 0)
+        row = Mock(product_code="A1", product_name="Товар", product_link=None,
+                   market_price=100.0, showcase_price=80.0, timestamp=timestamp, market="wb")
+        mock_get_redis.return_value.get.return_value = serialize_report_results([row], {})
+
+        # Act
+        current_results, previous_data = load_report_results(Mock(), "SEB", date(2024, 1, 15), "wb")
+
+        # Assert
+        assert current_results[0].product_code == "A1"
+        assert previous_data == {}
+        mock_fetch.assert_not_called()
+
+    @patch('tasks.refactored_reports.fetch_report_results')
+    @patch('tasks.refactored_reports.get_report_cache_key', return_value="key")
+    @patch('tasks.refactored_reports.get_redis_client')
+    def test_cache_miss_fetches_and_stores(self, mock_get_redis, mock_key, mock_fetch):
+        """Тестирует чтение из БД и запись в кэш при промахе."""
+        # Arrange
+        mock_redis = mock_get_redis.return_value
+        mock_redis.get.return_value = None
+        row = Mock(product_code="A1", product_name="Товар", product_link=None, market_price=100.0,
+                   showcase_price=80.0, timestamp=datetime(2024, 1, 15, 10, 0), market="wb")
+        mock_fetch.return_value = ([row], {})
+
+        # Act
+        result = load_report_results(Mock(), "SEB", date(2024, 1, 15), "wb")
+
+        # Assert
+        assert result == ([row], {})
+        key, ttl, _ = mock_redis.setex.call_args[0]
+        assert (key, ttl) == ("key", REPORT_CACHE_TTL)
+
+    @patch('tasks.refactored_reports.fetch_report_results')
+    @patch('tasks.refactored_reports.get_report_cache_key', return_value="key")
+    @patch('tasks.refactored_reports.get_redis_client')
+    def test_redis_unavailable_falls_back_to_database(self, mock_get_redis, mock_key, mock_fetch):
+        """Тестирует работу отчета без Redis."""
+        # Arrange
+        mock_redis = mock_get_redis.return_value
+        mock_redis.get.side_effect = ConnectionError("redis down")
+        mock_redis.setex.side_effect = ConnectionError("redis down")
+        mock_fetch.return_value = ([Mock()], {})
+
+        # Act
+        current_results, _ = load_report_results(Mock(), "SEB", date(2024, 1, 15), None)
+
+        # Assert
+        assert len(current_results) == 1
+        mock_fetch.assert_called_once()
+
+
+class TestValidateExcelReportRequest:
+    """Тесты для кэширования валидации запроса на отчет."""
+
+    @patch('db.session.get_sync_session')
+    @patch('tasks.refactored_reports.get_redis_client')
+    def test_cache_hit_skips_database(self, mock_get_redis, mock_get_session):
+        """Тестирует что при попадании в кэш БД не запрашивается."""
+        # Arrange
+        mock_get_redis.return_value.get.return_value = b'bad'
+
+        # Act
+        result = validate_excel_report_request("SEB", "2024-01-15")
+
+        # Assert
+        assert result is False
+        mock_get_redis.return_value.get.assert_called_once_with("report_validate:SEB:2024-01-15")
+        mock_get_session.assert_not_called()
+
+    @patch('tasks.refactored_reports.validate_report_params')
+    @patch('db.session.get_sync_session')
+    @patch('tasks.refactored_reports.get_redis_client')
+    def test_cache_miss_validates_and_stores(self, mock_get_redis, mock_get_session, mock_validate):
+        """Тестирует валидацию через БД и запись результата в кэш."""
+        # Arrange
+        mock_redis = mock_get_redis.return_value
+        mock_redis.get.return_value = None
+        mock_validate.return_value = (Mock(), date(2024, 1, 15))
+
+        # Act
+        result = validate_excel_report_request("SEB", "2024-01-15")
+
+        # Assert
+        assert result is True
+        mock_redis.setex.assert_called_once_with(
+            "report_validate:SEB:2024-01-15", REPORT_VALIDATE_CACHE_TTL, b'ok'
+        )
+
+    @patch('tasks.refactored_reports.get_redis_client')
+    def test_invalidate_deletes_client_keys(self, mock_get_redis):
+        """Тестирует сброс кэша валидации клиента."""
+        # Arrange
+        mock_redis = mock_get_redis.return_value
+        mock_redis.scan_iter.return_value = iter([b"report_validate:SEB:2024-01-15"])
+
+        # Act
+        invalidate_report_validation("SEB")
+
+        # Assert
+        mock_redis.scan_iter.assert_called_once_with(match="report_validate:SEB:*")
+        mock_redis.delete.assert_called_once_with(b"report_validate:SEB:2024-01-15")
+
 
 class TestRefactoredComplexity:
     """Тесты для проверки снижения цикломатической сложности."""
@@ -141,34 +646,20 @@ class TestRefactoredComplexity:
         """
         # Этот тест проверяет структуру, а не функциональность
         
-        # Подсчитаем количество условных операторов в новой функции
-        from tasks.refactored_reports import send_excel_report_v2_refactored
-        import inspect
-        
-        source = inspect.getsource(send_excel_report_v2_refactored)
-        
-        # Простой подсчет условных операторов
-        if_count = source.count('if ')
-        elif_count = source.count('elif ')
-        for_count = source.count('for ')
-        while_count = source.count('while ')
-        try_count = source.count('try:')
-        except_count = source.count('except ')
+        # Подсчитаем ветвления в новой функции за один проход по исходнику
+        counts = Counter(BRANCH_KEYWORDS_RE.findall(_report_source()))
         
         # Приблизительная оценка CC (упрощенная)
-        estimated_cc = 1 + if_count + elif_count + for_count + while_count + try_count + except_count
+        estimated_cc = 1 + sum(counts.values())
         
         # Проверяем что сложность значительно снижена
         assert estimated_cc < 10, f"Цикломатическая сложность все еще высокая: {estimated_cc}"
     
     def test_single_responsibility_separation(self):
         """Тестирует что функции разделены по ответственности."""
-        from services.telegram_notifier import send_document_to_telegram, create_excel_filename
-        from services.report_generator import validate_report_params, fetch_current_results
-        
         # Проверяем что каждая функция имеет четкую ответственность
         telegram_functions = [send_document_to_telegram, create_excel_filename]
-        data_functions = [validate_report_params, fetch_current_results]
+        data_functions = [validate_report_params, fetch_report_results]
         
         # Все функции должны быть определены и импортируемы
         for func in telegram_functions + data_functions:
@@ -176,22 +667,25 @@ class TestRefactoredComplexity:
             assert func.__doc__, f"Функция {func.__name__} не документирована"
 
 
+@pytest.fixture
+def document_data():
+    """Excel документ для отправки; новый буфер на каждый тест, т.к. отправка его дочитывает."""
+    return io.BytesIO(b"test data")
+
+
 class TestIntegration:
     """Интеграционные тесты для проверки взаимодействия компонентов."""
     
-    @patch('services.telegram_notifier.requests.post')
-    @patch('services.telegram_notifier.os.getenv')
-    def test_send_document_success(self, mock_getenv, mock_post):
-        """Тестирует успешную отправку документа."""
+    @pytest.mark.parametrize("status_code,expected", [
+        (200, True),
+        (400, False),
+    ], ids=["success", "failure"])
+    @patch('services.telegram_notifier.telegram_http_session.post')
+    @patch('services.telegram_notifier.BOT_TOKEN', "test_token")
+    def test_send_document(self, mock_post, document_data, status_code, expected):
+        """Тестирует результат отправки документа по статусу ответа Telegram."""
         # Arrange
-        mock_getenv.return_value = "test_token"
-        mock_response = Mock()
-        mock_response.status_code = 200
-        mock_post.return_value = mock_response
-        
-        from services.telegram_notifier import send_document_to_telegram
-        
-        document_data = io.BytesIO(b"test data")
+        mock_post.return_value = Mock(status_code=status_code, text="Bad Request")
         
         # Act
         result = send_document_to_telegram(
@@ -202,35 +696,36 @@ class TestIntegration:
         )
         
         # Assert
-        assert result is True
+        assert result is expected
         mock_post.assert_called_once()
     
-    @patch('services.telegram_notifier.requests.post')
-    @patch('services.telegram_notifier.os.getenv')
-    def test_send_document_failure(self, mock_getenv, mock_post):
-        """Тестирует неуспешную отправку документа."""
+    @patch('services.telegram_notifier.telegram_http_session.post')
+    @patch('services.telegram_notifier.BOT_TOKEN', "test_token")
+    @patch('services.telegram_notifier.TELEGRAM_UPLOAD_CHUNK_SIZE', 4)
+    def test_send_document_streams_file_in_chunks(self, mock_post, document_data):
+        """Тестирует потоковую отправку: тело совпадает с multipart от urllib3, файл читается кусками."""
         # Arrange
-        mock_getenv.return_value = "test_token"
-        mock_response = Mock()
-        mock_response.status_code = 400
-        mock_response.text = "Bad Request"
-        mock_post.return_value = mock_response
-        
-        from services.telegram_notifier import send_document_to_telegram
-        
-        document_data = io.BytesIO(b"test data")
+        mock_post.return_value = Mock(status_code=200)
         
         # Act
-        result = send_document_to_telegram(
+        send_document_to_telegram(
             chat_id="12345",
             document_data=document_data,
             filename="test.xlsx",
-            caption="Test caption"
+            caption="Отчет"
         )
         
         # Assert
-        assert result is False
-
+        body = mock_post.call_args[1]['data']
+        chunks = list(body)
+        expected, content_type = encode_multipart_formdata([
+            ("chat_id", "12345"), ("caption", "Отчет"), ("parse_mode", "HTML"),
+            ("document", ("test.xlsx", b"test data", EXCEL_MIME_TYPE)),
+        ], boundary=body.boundary)
+        assert b"".join(chunks) == expected
+        assert len(body) == len(expected)
+        assert mock_post.call_args[1]['headers']['Content-Type'] == content_type
+        assert b"test" in chunks and b" dat" in chunks
 
 if __name__ == "__main__":
     # Запуск тестов
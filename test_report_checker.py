@@ -5,15 +5,78 @@ Unit тесты для рефакторенного модуля проверк
 """
 
 import pytest
+import ast
+import functools
+import inspect
 import json
+import orjson
 from datetime import datetime
+from types import SimpleNamespace
 from unittest.mock import Mock, patch, MagicMock
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import Session
+from db.models import Base, Client, Order, Result
+from services import report_checker
 from services.report_checker import (
     OrderStatus,
     ReportItem,
     validate_client_and_get_orders,
     fetch_parser_reports,
     parse_parser_response,
+    build_task_index,
+    find_order_status,
+    download_and_parse_report,
+    extract_report_items,
+    calculate_final_price,
+    update_results_prices,
+    process_order_in_savepoint,
+    check_reports_refactored,
+    UPDATE_RESULTS_PRICE_SQL
+)
+
+# Ответ парсера со списком задач: task123 готова, other_task без отчета
+PARSER_TASKS_DATA = [
+    [
+        {"userlabel": "task123"},
+        {"status": "completed"},
+        {"report_json": "http://example.com/report.json"}
+    ],
+    [
+        {"userlabel": "other_task"},
+        {"status": "completed"}
+    ]
+]
+
+# Отчеты парсера; тесты их только читают, поэтому они общие для модуля
+VALID_REPORT_JSON = {
+    "data": [
+        {"code": "ABC123", "offers": [{"Price": "99.99", "PromoPrice": ""}]},
+        {"code": "DEF456", "offers": [{"Price": "", "PromoPrice": "89.99"}]}
+    ]
+}
+INVALID_REPORT_JSON = {
+    "data": [
+        {"code": "ABC123", "offers": []},  # Нет предложений
+        {"code": "DEF456", "offers": [{"Price": "", "PromoPrice": ""}]}  # Нет цен
+    ]
+}
+
+# Товары отчета с итоговыми ценами; кортеж, чтобы тесты не могли его изменить
+REPORT_ITEMS = (
+    ReportItem("ABC123", 99.99, []),
+    ReportItem("DEF456", 89.99, [])
+)
+
+# Клиент с ключом парсера и его pending заказ для check_reports_refactored
+PARSER_CLIENT = SimpleNamespace(parser_api_key="test_key")
+PENDING_ORDERS = (SimpleNamespace(task_id="task123"),)
+
+# Функции, на которые разбита check_reports
+REFACTORED_FUNCTIONS = (
+    validate_client_and_get_orders,
+    fetch_parser_reports,
+    parse_parser_response,
+    build_task_index,
     find_order_status,
     download_and_parse_report,
     extract_report_items,
@@ -23,6 +86,25 @@ from services.report_checker import (
 )
 
 
+@functools.cache
+def _check_reports_tree() -> ast.Module:
+    """AST check_reports_refactored; исходник читается и разбирается один раз."""
+    return ast.parse(inspect.getsource(check_reports_refactored))
+
+
+class BranchCounter(ast.NodeVisitor):
+    """Считает ветвления (if/elif, for, while, try) для оценки цикломатической сложности."""
+    
+    def __init__(self):
+        self.branches = 0
+    
+    def visit_If(self, node):
+        self.branches += 1
+        self.generic_visit(node)
+    
+    visit_For = visit_While = visit_Try = visit_If
+
+
 class TestOrderStatus:
     """Тесты для dataclass OrderStatus."""
     
@@ -63,91 +145,161 @@ class TestReportItem:
         assert len(item.offers) == 1
 
 
+@pytest.fixture
+def orders_session():
+    """
+    Mock сессии с готовой цепочкой session.query(...).outerjoin(...).filter(...).
+    
+    Returns:
+        Tuple[session, query]; тесты задают query.all строками (client, order)
+    """
+    session = Mock(spec=Session)
+    return session, session.query.return_value.outerjoin.return_value.filter.return_value
+
+
 class TestValidateClientAndGetOrders:
     """Тесты для валидации клиента и получения заказов."""
     
-    @patch('services.report_checker.Client')
-    @patch('services.report_checker.Order')
-    def test_validate_success(self, mock_order, mock_client):
+    def test_validate_success(self, orders_session):
         """Тестирует успешную валидацию."""
         # Arrange
-        mock_session = Mock()
-        mock_client_obj = Mock()
-        mock_orders = [Mock(), Mock()]
-        
-        mock_session.query.return_value.filter.return_value.first.return_value = mock_client_obj
-        mock_session.query.return_value.filter.return_value.all.return_value = mock_orders
+        session, query = orders_session
+        mock_client_obj = SimpleNamespace(id="client123")
+        mock_orders = [SimpleNamespace(task_id="task1"), SimpleNamespace(task_id="task2")]
+        query.all.return_value = [(mock_client_obj, order) for order in mock_orders]
         
         # Act
-        client, orders = validate_client_and_get_orders(mock_session, "client123")
+        client, orders = validate_client_and_get_orders(session, "client123")
         
         # Assert
         assert client == mock_client_obj
         assert orders == mock_orders
+        session.query.assert_called_once()
     
-    @patch('services.report_checker.Client')
-    def test_validate_client_not_found(self, mock_client):
+    def test_validate_client_not_found(self, orders_session):
         """Тестирует случай отсутствующего клиента."""
         # Arrange
-        mock_session = Mock()
-        mock_session.query.return_value.filter.return_value.first.return_value = None
+        session, query = orders_session
+        query.all.return_value = []
         
         # Act
-        client, orders = validate_client_and_get_orders(mock_session, "nonexistent")
+        client, orders = validate_client_and_get_orders(session, "nonexistent")
         
         # Assert
         assert client is None
         assert orders == []
     
-    @patch('services.report_checker.Client')
-    @patch('services.report_checker.Order')
-    def test_validate_no_orders(self, mock_order, mock_client):
+    def test_validate_no_orders(self, orders_session):
         """Тестирует случай отсутствия заказов."""
         # Arrange
-        mock_session = Mock()
-        mock_client_obj = Mock()
-        
-        mock_session.query.return_value.filter.return_value.first.return_value = mock_client_obj
-        mock_session.query.return_value.filter.return_value.all.return_value = []
+        session, query = orders_session
+        mock_client_obj = SimpleNamespace(id="client123")
+        query.all.return_value = [(mock_client_obj, None)]
         
         # Act
-        client, orders = validate_client_and_get_orders(mock_session, "client123")
+        client, orders = validate_client_and_get_orders(session, "client123")
         
         # Assert
         assert client == mock_client_obj
         assert orders == []
+    
+    def test_validate_single_query_sqlite(self):
+        """Тестирует на SQLite, что клиент и pending заказы читаются одним SELECT."""
+        # Arrange
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        statements = []
+        event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        now = datetime(2024, 1, 1)
+        
+        with Session(engine) as session:
+            session.add(Client(id="client123", name="Client", group_chat_id=1))
+            session.add_all(
+                Order(id=i, client_id="client123", task_id=f"task{i}", region="77", market="ozon",
+                      status=status, created_at=now, updated_at=now)
+                for i, status in enumerate(["pending", "completed", "pending"], start=1)
+            )
+            session.commit()
+            statements.clear()
+            
+            # Act
+            client, orders = validate_client_and_get_orders(session, "client123")
+            
+            # Assert
+            assert client.id == "client123"
+            assert sorted(order.task_id for order in orders) == ["task1", "task3"]
+            assert len(statements) == 1
+        engine.dispose()
+
+
+@pytest.fixture
+def parser_post(monkeypatch):
+    """
+    Подменяет requests.post в report_checker.
+    
+    Returns:
+        Функция configure(status_code, payload, text), которая задает ответ
+        и возвращает mock requests.post
+    """
+    post = Mock()
+    monkeypatch.setattr(report_checker.requests, "post", post)
+    
+    def configure(status_code, payload=None, text=""):
+        post.return_value = SimpleNamespace(status_code=status_code, text=text, content=orjson.dumps(payload))
+        return post
+    
+    return configure
 
 
 class TestFetchParserReports:
     """Тесты для получения отчетов от парсера."""
     
-    @patch('services.report_checker.requests.post')
-    def test_fetch_success(self, mock_post):
-        """Тестирует успешное получение отчетов."""
+    @pytest.mark.parametrize("status_code,payload,text,expected", [
+        (200, {"data": ["test_data"]}, "", {"data": ["test_data"]}),
+        (400, None, "Bad Request", None),
+    ], ids=["success", "failure"])
+    def test_fetch_parser_reports(self, parser_post, status_code, payload, text, expected):
+        """Тестирует получение отчетов и обработку ответа с ошибкой."""
         # Arrange
-        mock_response = Mock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {"data": ["test_data"]}
-        mock_post.return_value = mock_response
+        post = parser_post(status_code, payload, text)
         
         # Act
         result = fetch_parser_reports("http://api.example.com", "test_key")
         
         # Assert
-        assert result == {"data": ["test_data"]}
-        mock_post.assert_called_once()
+        assert result == expected
+        post.assert_called_once_with(
+            "http://api.example.com/get-last50",
+            json={"apikey": "test_key", "limit": 50},
+            timeout=30
+        )
+
+
+class TestDownloadAndParseReport:
+    """Тесты для скачивания JSON отчета."""
+    
+    def test_download_parses_body_bytes(self, monkeypatch):
+        """Тестирует разбор тела ответа (bytes) через orjson."""
+        # Arrange
+        response = Mock(spec=["raise_for_status", "content"], content=orjson.dumps(VALID_REPORT_JSON))
+        get = Mock(return_value=response)
+        monkeypatch.setattr(report_checker.requests, "get", get)
+        
+        # Act
+        result = download_and_parse_report("http://example.com/report.json")
+        
+        # Assert
+        assert result == VALID_REPORT_JSON
+        get.assert_called_once_with("http://example.com/report.json", timeout=30)
     
-    @patch('services.report_checker.requests.post')
-    def test_fetch_failure(self, mock_post):
-        """Тестирует неуспешный запрос."""
+    def test_download_invalid_json(self, monkeypatch):
+        """Тестирует что битый JSON возвращает None."""
         # Arrange
-        mock_response = Mock()
-        mock_response.status_code = 400
-        mock_response.text = "Bad Request"
-        mock_post.return_value = mock_response
+        response = Mock(spec=["raise_for_status", "content"], content=b"<html>")
+        monkeypatch.setattr(report_checker.requests, "get", Mock(return_value=response))
         
         # Act
-        result = fetch_parser_reports("http://api.example.com", "bad_key")
+        result = download_and_parse_report("http://example.com/report.json")
         
         # Assert
         assert result is None
@@ -156,110 +308,143 @@ class TestFetchParserReports:
 class TestParseParserResponse:
     """Тесты для парсинга ответа парсера."""
     
-    def test_parse_list_with_data(self):
-        """Тестирует парсинг списка с данными."""
-        # Arrange
-        response = [{"other": "value"}, {"data": "target_data"}]
-        
+    @pytest.mark.parametrize("response,expected", [
+        ([{"other": "value"}, {"data": "target_data"}], "target_data"),
+        ({"direct": "data"}, {"direct": "data"}),
+    ], ids=["list_with_data", "direct_data"])
+    def test_parse_parser_response(self, response, expected):
+        """Тестирует извлечение данных из ответа парсера."""
+        assert parse_parser_response(response) == expected
+
+
+class TestFindOrderStatus:
+    """Тесты для поиска статуса заказа."""
+    
+    def test_find_existing_order(self):
+        """Тестирует поиск существующего заказа."""
         # Act
-        result = parse_parser_response(response)
+        status = find_order_status(PARSER_TASKS_DATA, "task123")
         
         # Assert
-        assert result == "target_data"
+        assert status.found is True
+        assert status.task_id == "task123"
+        assert status.status == "completed"
+        assert status.report_url == "http://example.com/report.json"
     
-    def test_parse_direct_data(self):
-        """Тестирует парсинг прямых данных."""
-        # Arrange
-        response = {"direct": "data"}
-        
+    def test_find_nonexistent_order(self):
+        """Тестирует поиск несуществующего заказа."""
         # Act
-        result = parse_parser_response(response)
+        status = find_order_status(PARSER_TASKS_DATA, "missing_task")
         
         # Assert
-        assert result == {"direct": "data"}
+        assert status.found is False
+        assert status.task_id == "missing_task"
 
 
-class TestFindOrderStatus:
-    """Тесты для поиска статуса заказа."""
+class TestBuildTaskIndex:
+    """Тесты для построения индекса задач."""
     
-    def test_find_existing_order(self):
-        """Тестирует поиск существующего заказа."""
+    def test_build_index_multiple_tasks(self):
+        """Тестирует индексацию нескольких задач за один проход."""
         # Arrange
         data = [
             [
-                {"userlabel": "task123"},
+                {"userlabel": "task1"},
                 {"status": "completed"},
-                {"report_json": "http://example.com/report.json"}
-            ]
+                {"report_json": "http://example.com/1.json"}
+            ],
+            [
+                {"userlabel": "task2"},
+                {"status": "pending"}
+            ],
+            "not_a_group"
         ]
         
         # Act
-        status = find_order_status(data, "task123")
+        index = build_task_index(data)
         
         # Assert
-        assert status.found is True
-        assert status.task_id == "task123"
-        assert status.status == "completed"
-        assert status.report_url == "http://example.com/report.json"
+        assert set(index) == {"task1", "task2"}
+        assert index["task1"].found is True
+        assert index["task1"].status == "completed"
+        assert index["task1"].report_url == "http://example.com/1.json"
+        assert index["task2"].status == "pending"
+        assert index["task2"].report_url is None
     
-    def test_find_nonexistent_order(self):
-        """Тестирует поиск несуществующего заказа."""
+    def test_build_index_item_with_several_fields(self):
+        """Тестирует элемент, содержащий сразу несколько полей задачи."""
         # Arrange
         data = [
             [
-                {"userlabel": "other_task"},
-                {"status": "completed"}
+                {
+                    "userlabel": "task1",
+                    "status": "completed",
+                    "report_json": "http://example.com/1.json"
+                }
             ]
         ]
         
         # Act
-        status = find_order_status(data, "task123")
+        index = build_task_index(data)
         
         # Assert
-        assert status.found is False
-        assert status.task_id == "task123"
-
-
-class TestCalculateFinalPrice:
-    """Тесты для вычисления итоговой цены."""
+        assert index["task1"].status == "completed"
+        assert index["task1"].report_url == "http://example.com/1.json"
     
-    def test_promo_price_available(self):
-        """Тестирует использование промо цены."""
+    def test_build_index_first_occurrence_wins(self):
+        """Тестирует что при повторе задачи используется первое вхождение."""
         # Arrange
-        offer = {"PromoPrice": "89.99", "Price": "99.99"}
+        data = [
+            [{"userlabel": "task1"}, {"status": "completed"}],
+            [{"userlabel": "task1"}, {"status": "pending"}]
+        ]
         
         # Act
-        price = calculate_final_price(offer)
+        index = build_task_index(data)
         
         # Assert
-        assert price == 89.99
+        assert index["task1"].status == "completed"
+
+
+class TestCalculateFinalPrice:
+    """Тесты для вычисления итоговой цены."""
+    
+    @pytest.mark.parametrize("offer,expected", [
+        ({"PromoPrice": "89.99", "Price": "99.99"}, 89.99),
+        ({"PromoPrice": "", "Price": "99.99"}, 99.99),
+        ({"PromoPrice": "", "Price": ""}, None),
+        ({"PromoPrice": "invalid", "Price": "also_invalid"}, None),
+    ], ids=["promo_price", "regular_price_only", "no_valid_price", "invalid_format"])
+    def test_calculate_final_price(self, offer, expected):
+        """Тестирует выбор промо или обычной цены."""
+        assert calculate_final_price(offer) == expected
     
-    def test_regular_price_only(self):
-        """Тестирует использование обычной цены."""
+    def test_report_sized_offer_list(self):
+        """Тестирует отчет в 10k предложений (пустая промо цена - частый случай)."""
         # Arrange
-        offer = {"PromoPrice": "", "Price": "99.99"}
+        offers = [{"PromoPrice": "", "Price": f"{i}.99"} for i in range(10000)]
         
         # Act
-        price = calculate_final_price(offer)
+        prices = [calculate_final_price(offer) for offer in offers]
         
         # Assert
-        assert price == 99.99
+        assert prices == [float(f"{i}.99") for i in range(10000)]
     
-    def test_no_valid_price(self):
-        """Тестирует отсутствие валидной цены."""
+    def test_zero_promo_price_falls_back_to_regular(self):
+        """Тестирует переход к обычной цене при нулевой промо цене."""
         # Arrange
-        offer = {"PromoPrice": "", "Price": ""}
+        offer = {"PromoPrice": 0, "Price": "99.99"}
         
         # Act
         price = calculate_final_price(offer)
         
         # Assert
-        assert price is None
+        assert price == 99.99
     
-    def test_invalid_price_format(self):
-        """Тестирует некорректный формат цены."""
+    def test_unhashable_price(self):
+        """Тестирует нехешируемое значение цены."""
         # Arrange
-        offer = {"PromoPrice": "invalid", "Price": "also_invalid"}
+        offer = {"PromoPrice": {"value": 1}, "Price": ["99.99"]}
         
         # Act
         price = calculate_final_price(offer)
@@ -271,167 +456,293 @@ class TestCalculateFinalPrice:
 class TestExtractReportItems:
     """Тесты для извлечения данных из отчета."""
     
-    def test_extract_valid_items(self):
-        """Тестирует извлечение валидных товаров."""
+    @pytest.mark.parametrize("json_data,expected", [
+        (VALID_REPORT_JSON, [("ABC123", 99.99), ("DEF456", 89.99)]),
+        (INVALID_REPORT_JSON, []),
+    ], ids=["valid_items", "skip_invalid_items"])
+    def test_extract_report_items(self, json_data, expected):
+        """Тестирует извлечение товаров и пропуск товаров без валидных цен."""
+        items = extract_report_items(json_data)
+        
+        assert [(item.product_code, item.final_price) for item in items] == expected
+
+
+class TestUpdateResultsPrices:
+    """Тесты для обновления цен в результатах."""
+    
+    def test_update_prices_success(self):
+        """Тестирует успешное обновление цен."""
         # Arrange
-        json_data = {
-            "data": [
-                {
-                    "code": "ABC123",
-                    "offers": [{"Price": "99.99", "PromoPrice": ""}]
-                },
-                {
-                    "code": "DEF456", 
-                    "offers": [{"Price": "", "PromoPrice": "89.99"}]
-                }
-            ]
-        }
+        mock_session = Mock(spec=Session)
+        mock_session.execute.return_value = SimpleNamespace(rowcount=2)
         
         # Act
-        items = extract_report_items(json_data)
+        count = update_results_prices(mock_session, "client123", "task456", REPORT_ITEMS)
         
         # Assert
-        assert len(items) == 2
-        assert items[0].product_code == "ABC123"
-        assert items[0].final_price == 99.99
-        assert items[1].product_code == "DEF456"
-        assert items[1].final_price == 89.99
-    
-    def test_extract_skip_invalid_items(self):
-        """Тестирует пропуск товаров без валидных цен."""
+        assert count == 2
+        mock_session.execute.assert_called_once()
+        statement, params = mock_session.execute.call_args.args
+        assert statement is UPDATE_RESULTS_PRICE_SQL
+        assert params == [
+            {"price": 99.99, "client_id": "client123", "task_id": "task456", "product_code": "ABC123"},
+            {"price": 89.99, "client_id": "client123", "task_id": "task456", "product_code": "DEF456"}
+        ]
+    
+    def test_update_prices_error_propagates(self):
+        """Тестирует что ошибка UPDATE не скрывается за нулевым счетчиком."""
         # Arrange
-        json_data = {
-            "data": [
-                {
-                    "code": "ABC123",
-                    "offers": []  # Нет предложений
-                },
-                {
-                    "code": "DEF456",
-                    "offers": [{"Price": "", "PromoPrice": ""}]  # Нет цен
-                }
-            ]
-        }
+        mock_session = Mock(spec=Session)
+        mock_session.execute.side_effect = RuntimeError("DB Error")
+        
+        # Act / Assert
+        with pytest.raises(RuntimeError):
+            update_results_prices(mock_session, "client123", "task456", REPORT_ITEMS)
+    
+    def test_update_prices_empty_report(self):
+        """Тестирует что пустой отчет не выполняет запрос."""
+        # Arrange
+        mock_session = Mock(spec=Session)
         
         # Act
-        items = extract_report_items(json_data)
+        count = update_results_prices(mock_session, "client123", "task456", [])
         
         # Assert
-        assert len(items) == 0
+        assert count == 0
+        mock_session.execute.assert_not_called()
 
 
-class TestUpdateResultsPrices:
-    """Тесты для обновления цен в результатах."""
+@pytest.fixture
+def savepoint_engine():
+    """
+    SQLite с клиентом, двумя pending заказами и их результатами без цены.
     
-    @patch('services.report_checker.text')
-    def test_update_prices_success(self, mock_text):
-        """Тестирует успешное обновление цен."""
+    pysqlite сам открывает транзакции и ломает SAVEPOINT, поэтому BEGIN
+    выдается явно (рецепт из документации SQLAlchemy).
+    """
+    engine = create_engine("sqlite://")
+    
+    @event.listens_for(engine, "connect")
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+    
+    @event.listens_for(engine, "begin")
+    def emit_begin(connection):
+        connection.exec_driver_sql("BEGIN")
+    
+    Base.metadata.create_all(engine)
+    now = datetime(2024, 1, 1)
+    
+    with Session(engine) as session:
+        session.add(Client(id="client123", name="Client", group_chat_id=1, parser_api_key="test_key"))
+        for i in (1, 2):
+            session.add(Order(id=i, client_id="client123", task_id=f"task{i}", region="77", market="ozon",
+                              status="pending", created_at=now, updated_at=now))
+            # id явно: BIGINT первичный ключ в SQLite не автоинкрементный
+            session.add_all(
+                Result(id=i * 10 + n, client_id="client123", task_id=f"task{i}", product_code=item.product_code,
+                       product_name=item.product_code, timestamp=now)
+                for n, item in enumerate(REPORT_ITEMS)
+            )
+        session.commit()
+    
+    yield engine
+    engine.dispose()
+
+
+def saved_orders(engine) -> dict:
+    """Статусы заказов и цены их результатов после фиксации: {task_id: (status, [prices])}."""
+    with Session(engine) as session:
+        return {
+            order.task_id: (
+                order.status,
+                [float(price) if price is not None else None for price in session.scalars(
+                    select(Result.showcase_price)
+                    .where(Result.task_id == order.task_id)
+                    .order_by(Result.product_code)
+                )]
+            )
+            for order in session.scalars(select(Order).order_by(Order.id))
+        }
+
+
+class TestProcessOrderInSavepoint:
+    """Тесты для обработки заказа внутри SAVEPOINT."""
+    
+    @pytest.mark.parametrize("outcome", [False, Exception("DB Error")], ids=["failed", "raised"])
+    def test_savepoint_rolled_back_on_failure(self, savepoint_engine, monkeypatch, outcome):
+        """Тестирует что неуспешный заказ откатывает только свои изменения."""
         # Arrange
-        mock_session = Mock()
-        mock_result = Mock()
-        mock_result.rowcount = 1
-        mock_session.execute.return_value = mock_result
-        
-        report_items = [
-            ReportItem("ABC123", 99.99, []),
-            ReportItem("DEF456", 89.99, [])
-        ]
+        def process(session, client_id, order, report_url):
+            update_results_prices(session, client_id, order.task_id, REPORT_ITEMS)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        
+        monkeypatch.setattr(report_checker, "process_completed_order", process)
+        
+        with Session(savepoint_engine) as session:
+            first, second = session.scalars(select(Order).order_by(Order.id)).all()
+            session.execute(UPDATE_RESULTS_PRICE_SQL, {
+                "price": 1.0, "client_id": "client123", "task_id": "task1", "product_code": "ABC123"
+            })
+            
+            # Act
+            result = process_order_in_savepoint(session, "client123", second, "http://report.url")
+            session.commit()
+        
+        # Assert
+        assert result is False
+        assert saved_orders(savepoint_engine) == {
+            "task1": ("pending", [1.0, None]),
+            "task2": ("pending", [None, None])
+        }
+    
+    def test_savepoint_released_on_success(self, savepoint_engine, monkeypatch):
+        """Тестирует фиксацию SAVEPOINT при успешной обработке."""
+        # Arrange
+        def process(session, client_id, order, report_url):
+            update_results_prices(session, client_id, order.task_id, REPORT_ITEMS)
+            return True
+        
+        monkeypatch.setattr(report_checker, "process_completed_order", process)
+        
+        with Session(savepoint_engine) as session:
+            order = session.scalars(select(Order).where(Order.task_id == "task1")).one()
+            
+            # Act
+            result = process_order_in_savepoint(session, "client123", order, "http://report.url")
+            session.commit()
+        
+        # Assert
+        assert result is True
+        assert saved_orders(savepoint_engine)["task1"] == ("pending", [99.99, 89.99])
+    
+    def test_failed_update_keeps_other_orders(self, savepoint_engine, monkeypatch):
+        """Тестирует что ошибка UPDATE одного заказа не теряет остальные заказы прогона."""
+        # Arrange
+        def fail_task2_update(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().startswith("UPDATE results") and "task2" in str(parameters):
+                raise RuntimeError("UPDATE failed")
+        
+        event.listen(savepoint_engine, "before_cursor_execute", fail_task2_update)
+        summary = Mock()
+        monkeypatch.setattr("db.session.get_sync_session", lambda: Session(savepoint_engine))
+        monkeypatch.setattr(report_checker, "fetch_parser_reports", Mock(return_value={"data": []}))
+        monkeypatch.setattr(report_checker, "build_task_index", Mock(return_value={
+            f"task{i}": OrderStatus(f"task{i}", "completed", f"http://report{i}.url", True) for i in (1, 2)
+        }))
+        monkeypatch.setattr(report_checker, "download_and_parse_report", Mock(return_value=VALID_REPORT_JSON))
+        monkeypatch.setattr(report_checker, "trigger_daily_summary", summary)
         
         # Act
-        count = update_results_prices(mock_session, "client123", "task456", report_items)
+        result = check_reports_refactored("http://api.url", "client123")
         
         # Assert
-        assert count == 2
-        assert mock_session.execute.call_count == 2
+        assert result is True
+        assert saved_orders(savepoint_engine) == {
+            "task1": ("completed", [99.99, 89.99]),
+            "task2": ("pending", [None, None])
+        }
+        summary.assert_called_once_with("client123")
+
+
+@pytest.fixture
+def patched_checker(monkeypatch):
+    """
+    Подменяет зависимости check_reports_refactored через monkeypatch.
+    
+    Сессия берется из db.session.get_sync_session: check_reports_refactored
+    импортирует ее внутри функции, поэтому подменяется атрибут модуля db.session.
+    """
+    session = Mock(spec=Session)
+    session.begin_nested.return_value = MagicMock()  # SAVEPOINT используется как контекстный менеджер
+    mocks = SimpleNamespace(
+        session=session,
+        get_session=Mock(return_value=session),
+        validate=Mock(return_value=(None, [])),
+        fetch=Mock(return_value=None),
+        parse=Mock(),
+        index=Mock(return_value={}),
+        process=Mock(return_value=True)
+    )
+    
+    monkeypatch.setattr("db.session.get_sync_session", mocks.get_session)
+    monkeypatch.setattr(report_checker, "validate_client_and_get_orders", mocks.validate)
+    monkeypatch.setattr(report_checker, "fetch_parser_reports", mocks.fetch)
+    monkeypatch.setattr(report_checker, "parse_parser_response", mocks.parse)
+    monkeypatch.setattr(report_checker, "build_task_index", mocks.index)
+    monkeypatch.setattr(report_checker, "process_completed_order", mocks.process)
+    
+    return mocks
 
 
 class TestCheckReportsRefactored:
     """Интеграционные тесты для основной функции."""
     
-    @patch('services.report_checker.get_sync_session')
-    @patch('services.report_checker.validate_client_and_get_orders')
-    @patch('services.report_checker.fetch_parser_reports')
-    @patch('services.report_checker.parse_parser_response')
-    @patch('services.report_checker.find_order_status')
-    @patch('services.report_checker.process_completed_order')
-    def test_check_reports_success(self, mock_process, mock_find, mock_parse, 
-                                   mock_fetch, mock_validate, mock_session):
+    def test_check_reports_success(self, patched_checker):
         """Тестирует успешную проверку отчетов."""
         # Arrange
-        mock_client = Mock()
-        mock_client.parser_api_key = "test_key"
-        mock_orders = [Mock()]
-        mock_orders[0].task_id = "task123"
-        
-        mock_validate.return_value = (mock_client, mock_orders)
-        mock_fetch.return_value = {"data": "test_data"}
-        mock_parse.return_value = "parsed_data"
-        
-        mock_status = OrderStatus("task123", "completed", "http://report.url", True)
-        mock_find.return_value = mock_status
-        mock_process.return_value = True
+        patched_checker.validate.return_value = (PARSER_CLIENT, list(PENDING_ORDERS))
+        patched_checker.fetch.return_value = {"data": "test_data"}
+        patched_checker.parse.return_value = "parsed_data"
+        patched_checker.index.return_value = {
+            "task123": OrderStatus("task123", "completed", "http://report.url", True)
+        }
         
         # Act
         result = check_reports_refactored("http://api.url", "client123")
         
         # Assert
         assert result is True
-        mock_validate.assert_called_once()
-        mock_fetch.assert_called_once()
-        mock_process.assert_called_once()
+        patched_checker.validate.assert_called_once_with(patched_checker.session, "client123")
+        patched_checker.fetch.assert_called_once_with("http://api.url", "test_key")
+        patched_checker.process.assert_called_once()
+        patched_checker.session.commit.assert_called_once()
+        patched_checker.session.close.assert_called_once()
     
-    @patch('services.report_checker.get_sync_session')
-    @patch('services.report_checker.validate_client_and_get_orders')
-    def test_check_reports_no_client(self, mock_validate, mock_session):
+    def test_check_reports_no_client(self, patched_checker):
         """Тестирует случай отсутствия клиента."""
+        # Act
+        result = check_reports_refactored("http://api.url", "nonexistent")
+        
+        # Assert
+        assert result is False
+        patched_checker.fetch.assert_not_called()
+        patched_checker.session.close.assert_called_once()
+    
+    def test_check_reports_closes_session_on_error(self, patched_checker):
+        """Тестирует что сессия закрывается и при ошибке посреди проверки."""
         # Arrange
-        mock_validate.return_value = (None, [])
+        patched_checker.validate.return_value = (PARSER_CLIENT, list(PENDING_ORDERS))
+        patched_checker.fetch.side_effect = RuntimeError("parser down")
         
         # Act
-        result = check_reports_refactored("http://api.url", "nonexistent")
+        result = check_reports_refactored("http://api.url", "client123")
         
         # Assert
         assert result is False
+        patched_checker.session.commit.assert_not_called()
+        patched_checker.session.close.assert_called_once()
 
 
 class TestComplexityReduction:
     """Тесты для проверки снижения цикломатической сложности."""
     
-    def test_function_separation(self):
+    @pytest.mark.parametrize("func", REFACTORED_FUNCTIONS, ids=lambda func: func.__name__)
+    def test_function_separation(self, func):
         """Тестирует что функции разделены правильно."""
-        functions = [
-            validate_client_and_get_orders,
-            fetch_parser_reports,
-            parse_parser_response,
-            find_order_status,
-            download_and_parse_report,
-            extract_report_items,
-            calculate_final_price,
-            update_results_prices,
-            check_reports_refactored
-        ]
-        
-        # Проверяем что все функции определены и документированы
-        for func in functions:
-            assert callable(func), f"Функция {func.__name__} не определена"
-            assert func.__doc__, f"Функция {func.__name__} не документирована"
+        assert callable(func), f"Функция {func.__name__} не определена"
+        assert func.__doc__, f"Функция {func.__name__} не документирована"
     
     def test_cyclomatic_complexity_reduction(self):
         """Проверяет снижение цикломатической сложности."""
-        import inspect
-        
-        # Получаем исходный код основной функции
-        source = inspect.getsource(check_reports_refactored)
-        
-        # Простой подсчет условных операторов
-        if_count = source.count('if ')
-        elif_count = source.count('elif ')
-        for_count = source.count('for ')
-        while_count = source.count('while ')
-        try_count = source.count('try:')
+        # Подсчет ветвлений по AST: строки и комментарии не учитываются
+        counter = BranchCounter()
+        counter.visit(_check_reports_tree())
         
         # Приблизительная оценка CC
-        estimated_cc = 1 + if_count + elif_count + for_count + while_count + try_count
+        estimated_cc = 1 + counter.branches
         
         # Проверяем что сложность значительно снижена (было 25)
         assert estimated_cc < 10, f"Цикломатическая сложность все еще высокая: {estimated_cc}"